@@ -88,6 +88,17 @@ DATABASES = {
     }
 }
 
+# use a cache shared by all workers (memcached, DatabaseCache) in production so
+# changes to payment methods reach every worker straight away
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -137,13 +148,102 @@ API_HOST_NAME = os.environ.get("API_HOST_NAME")
 # payment configs
 PAYBILL_NUMBER = 1234
 
+# serve the daraja routes with async views, requires running under core.asgi
+DARAJA_ASYNC_VIEWS = True if os.environ.get("DARAJA_ASYNC_VIEWS") == "True" else False
+# seconds to wait for the stk push callback before querying safaricom
+DARAJA_STKPUSH_COMPLETION_TIMEOUT = int(
+    os.environ.get("DARAJA_STKPUSH_COMPLETION_TIMEOUT", 90)
+)
+# how often a waiter checks the db for callbacks handled by another worker
+DARAJA_STKPUSH_COMPLETION_POLL_INTERVAL = int(
+    os.environ.get("DARAJA_STKPUSH_COMPLETION_POLL_INTERVAL", 5)
+)
+# renew the daraja access token this many seconds before it expires
+DARAJA_TOKEN_REFRESH_MARGIN = int(os.environ.get("DARAJA_TOKEN_REFRESH_MARGIN", 60))
+# pooled keep-alive http transport used for every daraja call
+DARAJA_HTTP_POOL_CONNECTIONS = int(os.environ.get("DARAJA_HTTP_POOL_CONNECTIONS", 4))
+DARAJA_HTTP_POOL_SIZE = int(os.environ.get("DARAJA_HTTP_POOL_SIZE", 20))
+DARAJA_HTTP_CONNECT_TIMEOUT = float(os.environ.get("DARAJA_HTTP_CONNECT_TIMEOUT", 5))
+DARAJA_HTTP_READ_TIMEOUT = float(os.environ.get("DARAJA_HTTP_READ_TIMEOUT", 30))
+
+# transaction refs and account numbers
+PAYMENTS_ID_ALLOCATOR = os.environ.get(
+    "PAYMENTS_ID_ALLOCATOR", "payments.ids.SequenceIdAllocator"
+)
+# account numbers each worker reserves at a time
+PAYMENTS_ACCOUNT_NUMBER_BLOCK_SIZE = int(
+    os.environ.get("PAYMENTS_ACCOUNT_NUMBER_BLOCK_SIZE", 100)
+)
+# first allocated account number, above the old random 6 digit numbers
+PAYMENTS_ACCOUNT_NUMBER_START = int(
+    os.environ.get("PAYMENTS_ACCOUNT_NUMBER_START", 1000000)
+)
+
+# payment methods are kept in memory, see payments.registry
+PAYMENT_METHOD_REGISTRY_CHECK_INTERVAL = float(
+    os.environ.get("PAYMENT_METHOD_REGISTRY_CHECK_INTERVAL", 5)
+)
+# reload even without a change, bounds staleness when CACHES is not shared
+PAYMENT_METHOD_REGISTRY_TTL = float(os.environ.get("PAYMENT_METHOD_REGISTRY_TTL", 300))
+
+# hourly and daily transaction rollups, see payments.rollups
+ROLLUP_ENABLED = False if os.environ.get("ROLLUP_ENABLED") == "False" else True
+# seconds between recomputing the buckets of changed transactions
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get("ROLLUP_FLUSH_INTERVAL", 30))
+# seconds between recomputing the buckets of every transaction edited since the
+# last catch up, repairs changes lost with a worker that died before flushing
+ROLLUP_CATCH_UP_INTERVAL = float(os.environ.get("ROLLUP_CATCH_UP_INTERVAL", 300))
+# seconds the catch up stays behind now, so edits still committing are not skipped
+ROLLUP_CATCH_UP_LAG = float(os.environ.get("ROLLUP_CATCH_UP_LAG", 60))
+
+# callback TransactionLog rows are buffered and saved in batches
+TRANSACTION_LOG_BUFFER_ENABLED = (
+    False if os.environ.get("TRANSACTION_LOG_BUFFER_ENABLED") == "False" else True
+)
+TRANSACTION_LOG_BATCH_SIZE = int(os.environ.get("TRANSACTION_LOG_BATCH_SIZE", 200))
+TRANSACTION_LOG_FLUSH_INTERVAL = float(
+    os.environ.get("TRANSACTION_LOG_FLUSH_INTERVAL", 1)
+)
+# buffered payloads are spooled here until they are saved
+TRANSACTION_LOG_SPOOL_DIR = os.environ.get(
+    "TRANSACTION_LOG_SPOOL_DIR", os.path.join(BASE_DIR, "spool")
+)
+TRANSACTION_LOG_SPOOL_FSYNC = (
+    True if os.environ.get("TRANSACTION_LOG_SPOOL_FSYNC") == "True" else False
+)
+# TransactionLog is partitioned by month on postgres, see payments.partitions.
+# Months older than this are archived and dropped by archive_transactionlogs
+TRANSACTION_LOG_RETENTION_MONTHS = int(
+    os.environ.get("TRANSACTION_LOG_RETENTION_MONTHS", 6)
+)
+# partitions created ahead of time, later rows go to the default partition
+TRANSACTION_LOG_PARTITIONS_AHEAD = int(
+    os.environ.get("TRANSACTION_LOG_PARTITIONS_AHEAD", 2)
+)
+TRANSACTION_LOG_ARCHIVE_DIR = os.environ.get(
+    "TRANSACTION_LOG_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive")
+)
+
+# /metrics asks for `Authorization: Bearer <token>` when set, see utils.metrics.
+# Under gunicorn the metrics of all workers are read from PROMETHEUS_MULTIPROC_DIR
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 
 min_django_level = "INFO"
-min_level = "DEBUG"
+min_level = os.environ.get("LOG_LEVEL", "INFO")
 
 LOG_ROOT_DIR = "payments.log"
+# json lines, or text for the one line format
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# records waiting for the log writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# info and debug records kept a second per logging call, 0 keeps all of them
+LOG_RATE_LIMIT = float(os.environ.get("LOG_RATE_LIMIT", 0))
+# share of info and debug payload (dict) records kept
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1))
 # error logging configs
-# logging dictConfig configuration
+# logging dictConfig configuration. Records are queued and written by a
+# background thread, see utils.log
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,  # keep Django's default loggers
@@ -151,6 +251,14 @@ LOGGING = {
         "simple": {
             "format": "[%(asctime)s] %(levelname)s: %(filename)s, %(funcName)s -line, %(lineno)s -- %(message)s"
         },
+        "json": {"()": "utils.log.JsonFormatter"},
+    },
+    "filters": {
+        "sampling": {
+            "()": "utils.log.SamplingFilter",
+            "rate_limit": LOG_RATE_LIMIT,
+            "sample_rate": LOG_SAMPLE_RATE,
+        },
     },
     "handlers": {
         "logfile": {
@@ -161,16 +269,24 @@ LOGGING = {
             "filename": os.path.join(BASE_DIR, LOG_ROOT_DIR),
             "maxBytes": 50 * 10**6,  # will 50 MB do?
             "backupCount": 2,  # keep this many extra historical files
-            "formatter": "simple",
+            "formatter": "json" if LOG_FORMAT == "json" else "simple",
+            "delay": True,
         },
         "console": {
             "level": min_level,  # this level or higher goes to the console
             "class": "logging.StreamHandler",
-            "formatter": "simple",
+            "formatter": "json" if LOG_FORMAT == "json" else "simple",
+        },
+        "queue": {
+            "level": min_level,
+            "class": "utils.log.QueuedLogHandler",
+            "filters": ["sampling"],
+            "handlers": ["cfg://handlers.console", "cfg://handlers.logfile"],
+            "maxsize": LOG_QUEUE_SIZE,
         },
     },
     "root": {
-        "handlers": ["console", "logfile"],
+        "handlers": ["queue"],
         "level": min_level,  # this level or higher goes to the console,
     },
 }
@@ -184,6 +300,31 @@ ELASTIC_PASSWORD = os.environ.get("ELASTIC_PASSWORD")
 ELASTICSEARCH_DSL = {
     "default": {"hosts": f"{ELASTIC_USERNAME}:{ELASTIC_PASSWORD}@localhost:9200"},
 }
+# index changes from a background queue instead of on every save
+ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = os.environ.get(
+    "ELASTICSEARCH_DSL_SIGNAL_PROCESSOR", "search.processors.QueuedSignalProcessor"
+)
+ELASTICSEARCH_SYNC_BATCH_SIZE = int(
+    os.environ.get("ELASTICSEARCH_SYNC_BATCH_SIZE", 500)
+)
+ELASTICSEARCH_SYNC_FLUSH_INTERVAL = float(
+    os.environ.get("ELASTICSEARCH_SYNC_FLUSH_INTERVAL", 1)
+)
+# rows waiting to be indexed before writers start dropping changes
+ELASTICSEARCH_SYNC_MAX_PENDING = int(
+    os.environ.get("ELASTICSEARCH_SYNC_MAX_PENDING", 50000)
+)
+# seconds a writer waits for room in a full queue
+ELASTICSEARCH_SYNC_BLOCK_TIMEOUT = float(
+    os.environ.get("ELASTICSEARCH_SYNC_BLOCK_TIMEOUT", 0.05)
+)
+# per process cache of search results, only invalidated by changes this
+# process indexed so the TTL bounds how stale results from other workers can be
+SEARCH_CACHE_ENABLED = (
+    False if os.environ.get("SEARCH_CACHE_ENABLED") == "False" else True
+)
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 5))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", 1000))
 
 # rest framework pagination
 
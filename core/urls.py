@@ -16,9 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from utils.metrics import metrics_view
+
 common = "transaction/"
 urlpatterns = [
     path("admin/", admin.site.urls),
     path(common, include("daraja.urls")),
     path("search/", include("search.urls")),
+    path("payments/", include("payments.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -0,0 +1,182 @@
+"""
+Async versions of the daraja views, used in place of the DRF views when
+DARAJA_ASYNC_VIEWS is enabled and the app is served through core.asgi.
+
+Safaricom calls are awaited through AsyncMpesaTransaction and database work runs
+through sync_to_async, so a worker never blocks on the network.
+"""
+import json
+import logging
+
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from asgiref.sync import sync_to_async
+
+from daraja.completion import stk_push_completion
+from daraja.facade import AsyncMpesaTransaction
+from daraja.views import (
+    build_stk_push_result,
+    build_stk_push_status,
+    confirm_c2b_payment,
+    get_c2b_urls,
+    get_stk_push_status,
+    handle_stk_push_callback,
+    prepare_stk_push,
+    save_stk_push_response,
+    stk_push_completed,
+    validate_c2b_payment,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def csrf_exempt_async(view):
+    # django.views.decorators.csrf.csrf_exempt wraps views in a sync function
+    view.csrf_exempt = True
+    return view
+
+
+def get_json_payload(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError as e:
+        logger.error(e)
+        return None
+
+
+def parse_error_response():
+    return JsonResponse({"detail": "JSON parse error"}, status=400)
+
+
+@csrf_exempt_async
+async def initiate_stk_push(request, account_number):
+    """
+    async version of InitiateStkPushView.
+
+    The worker is released while we wait for the stk callback, so one process can
+    hold thousands of pending stk pushes
+    Args:
+        request: json body with amount, phone_number and description
+
+    Returns:
+        200: if success
+        400: in case of error or fails
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    payload = get_json_payload(request)
+    if payload is None:
+        return parse_error_response()
+
+    prepared, error = await sync_to_async(prepare_stk_push)(account_number, payload)
+    if error is not None:
+        data, status_code = error
+        return JsonResponse(data, status=status_code, safe=False)
+
+    transaction, stk_data = prepared
+    await sync_to_async(transaction.save)()
+    mpesa_transaction = AsyncMpesaTransaction()
+    # we cannot hold a db transaction open across the safaricom call, so the
+    # transaction is deleted by hand if the stk push does not go through. Left
+    # behind it would keep the account number taken
+    try:
+        mpesa_request = await mpesa_transaction.lipa_na_mpesa_online(**stk_data)
+        error = await sync_to_async(save_stk_push_response)(transaction, mpesa_request)
+    except BaseException:
+        # timeouts, unreadable responses and cancelled requests included
+        await sync_to_async(transaction.delete)()
+        raise
+    if error is not None:
+        await sync_to_async(transaction.delete)()
+        data, status_code = error
+        return JsonResponse(data, status=status_code)
+
+    await stk_push_completion.wait_async(
+        account_number, sync_to_async(lambda: stk_push_completed(transaction))
+    )
+
+    await sync_to_async(transaction.refresh_from_db)()
+    mpesa_request = None
+    if transaction.status not in ["Successful"]:
+        mpesa_request = await mpesa_transaction.query_mpesa_express_transaction_status(
+            transaction.checkout_request_id
+        )
+    data, status_code = build_stk_push_result(transaction, mpesa_request)
+    return JsonResponse(data, status=status_code)
+
+
+@csrf_exempt_async
+async def stk_push_callback(request, account_number):
+    """
+    async version of MpesaStkPushCallbackView.
+    POST is the stk push callback, GET is the status query
+    """
+    if request.method == "POST":
+        payload = get_json_payload(request)
+        if payload is None:
+            return parse_error_response()
+        data = await sync_to_async(handle_stk_push_callback)(account_number, payload)
+        return JsonResponse(data, safe=False)
+
+    if request.method == "GET":
+        transaction, data = await sync_to_async(get_stk_push_status)(account_number)
+        if data is None:
+            mpesa_transaction = AsyncMpesaTransaction()
+            mpesa_request = (
+                await mpesa_transaction.query_mpesa_express_transaction_status(
+                    transaction.checkout_request_id
+                )
+            )
+            data = build_stk_push_status(transaction, mpesa_request)
+        return JsonResponse(data)
+
+    return HttpResponseNotAllowed(["GET", "POST"])
+
+
+@csrf_exempt_async
+async def register_c2b_urls(request):
+    """
+    async version of MpesaRegisterUrlView
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    confirmation_url, validation_url = get_c2b_urls()
+    mpesa_transaction = AsyncMpesaTransaction()
+    mpesa_request = await mpesa_transaction.register_c2b_urls(
+        confirmation_url, validation_url
+    )
+    response = mpesa_request.json()
+    logger.info(response)
+    return JsonResponse(response, safe=False)
+
+
+@csrf_exempt_async
+async def c2b_validation(request):
+    """
+    async version of MpesaValidationUrlView
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    payload = get_json_payload(request)
+    if payload is None:
+        return parse_error_response()
+    context = await sync_to_async(validate_c2b_payment)(payload)
+    return JsonResponse(context)
+
+
+@csrf_exempt_async
+async def c2b_confirmation(request):
+    """
+    async version of MpesaConfirmationUrlView
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    payload = get_json_payload(request)
+    if payload is None:
+        return parse_error_response()
+    context = await sync_to_async(confirm_c2b_payment)(payload)
+    return JsonResponse(context)
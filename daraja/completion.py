@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+
+
+class CompletionRegistry(object):
+    """
+    per transaction completion signals for stk pushes
+
+    InitiateStkPushView waits on the account number of the transaction it started and
+    MpesaStkPushCallbackView fires it once the callback has been applied.
+    Signals only reach waiters in the same process, so waiters still check the
+    database every `DARAJA_STKPUSH_COMPLETION_POLL_INTERVAL` seconds to pick up
+    callbacks that landed on another worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+
+    def _subscribe(self, key, wake):
+        with self._lock:
+            self._waiters.setdefault(key, set()).add(wake)
+
+    def _unsubscribe(self, key, wake):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                return
+            waiters.discard(wake)
+            if not waiters:
+                del self._waiters[key]
+
+    @staticmethod
+    def _get_deadline(timeout):
+        if timeout is None:
+            timeout = settings.DARAJA_STKPUSH_COMPLETION_TIMEOUT
+        return time.monotonic() + timeout
+
+    def notify(self, key):
+        """
+        wake every waiter on key
+        Args:
+            key: account number of the transaction
+
+        Returns:
+            - number of waiters woken in this process
+        """
+        with self._lock:
+            waiters = list(self._waiters.get(str(key), ()))
+        for wake in waiters:
+            wake()
+        return len(waiters)
+
+    def wait(self, key, is_complete, timeout=None):
+        """
+        block the calling thread until key is notified or the deadline passes
+        Args:
+            key: account number of the transaction
+            is_complete: callable returning True once the transaction is done
+            timeout: seconds to wait, default=DARAJA_STKPUSH_COMPLETION_TIMEOUT
+
+        Returns:
+            - True if the transaction completed before the deadline
+        """
+        key = str(key)
+        deadline = self._get_deadline(timeout)
+        poll_interval = settings.DARAJA_STKPUSH_COMPLETION_POLL_INTERVAL
+        event = threading.Event()
+        self._subscribe(key, event.set)
+        try:
+            while True:
+                if is_complete():
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                event.wait(min(poll_interval, remaining))
+                event.clear()
+        finally:
+            self._unsubscribe(key, event.set)
+
+    async def wait_async(self, key, is_complete, timeout=None):
+        """
+        same as wait but suspends the coroutine instead of holding a thread
+        Args:
+            key: account number of the transaction
+            is_complete: coroutine function returning True once the transaction is done
+            timeout: seconds to wait, default=DARAJA_STKPUSH_COMPLETION_TIMEOUT
+
+        Returns:
+            - True if the transaction completed before the deadline
+        """
+        key = str(key)
+        deadline = self._get_deadline(timeout)
+        poll_interval = settings.DARAJA_STKPUSH_COMPLETION_POLL_INTERVAL
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            # notify runs on whichever thread applied the callback
+            loop.call_soon_threadsafe(event.set)
+
+        self._subscribe(key, wake)
+        try:
+            while True:
+                if await is_complete():
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(
+                        event.wait(), timeout=min(poll_interval, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            self._unsubscribe(key, wake)
+
+
+stk_push_completion = CompletionRegistry()
@@ -1,14 +1,13 @@
 import base64
 import logging
-import time
 from datetime import datetime
-from threading import Thread
 
 from django.conf import settings
 from django.urls import reverse
 
+from daraja.completion import stk_push_completion
 from daraja.configs import DarajaConfigs
-from daraja.gateway import MpesaGateway
+from daraja.gateway import AsyncMpesaGateway, MpesaGateway
 from utils.loading import get_model
 
 Transaction = get_model("payments", "Transaction")
@@ -17,9 +16,9 @@ TransactionLog = get_model("payments", "TransactionLog")
 logger = logging.getLogger(__name__)
 
 
-class MpesaTransaction(object):
+class MpesaPayloadMixin(object):
     """
-    a class to handle mpesa operations
+    builds the daraja request payloads, shared by the sync and async clients
     """
 
     def __init__(self):
@@ -27,7 +26,6 @@ class MpesaTransaction(object):
         self.lipa_time = datetime.now().strftime("%Y%m%d%H%M%S")
         self.business_short_code = self.vault.DARAJA_BUSINESS_SHORT_CODE
         self.c2b_bussiness_code = self.vault.DARAJA_C2B_BUSINESS_SHORT_CODE
-        self.mpesa_gateway = MpesaGateway(self.vault)
 
     def get_password(self):
         passkey = self.vault.DARAJA_PASS_KEY
@@ -36,22 +34,9 @@ class MpesaTransaction(object):
         decode_password = online_password.decode("utf-8")
         return decode_password
 
-    def lipa_na_mpesa_online(
+    def get_stk_push_payload(
         self, amount, phone_number, callbackurl, accountref, transaction_desc=""
     ):
-        """
-        takes the arguments creates an mpesa payload
-        and initiate an mpesa stk push with appropriate details passed
-        Args:
-            amount: 200
-            phone_number: 254712345678
-            callbackurl: https://......
-            accountref: what you requesting payment for
-            transaction_desc: a short narration of the transaction in progress, default=''
-
-        Returns:
-            - mpesa response
-        """
         payload = {
             "BusinessShortCode": self.business_short_code,
             "Password": self.get_password(),
@@ -66,10 +51,9 @@ class MpesaTransaction(object):
             "TransactionDesc": transaction_desc,
         }
         logging.info(payload)
-        response = self.mpesa_gateway.initiate_stk_push(payload)
-        return response
+        return payload
 
-    def query_mpesa_express_transaction_status(self, checkout_request_id):
+    def get_stk_push_query_payload(self, checkout_request_id):
         payload = {
             "BusinessShortCode": self.business_short_code,
             "Password": self.get_password(),
@@ -77,6 +61,52 @@ class MpesaTransaction(object):
             "CheckoutRequestID": checkout_request_id,
         }
         logging.info(payload)
+        return payload
+
+    def get_register_c2b_urls_payload(self, confirmation_url, validation_url):
+        payload = {
+            "ShortCode": self.c2b_bussiness_code,
+            "ResponseType": "Completed",  # can be 'Cancelled', 'Completed'
+            "ConfirmationURL": confirmation_url,
+            "ValidationURL": validation_url,
+        }
+        logging.info(payload)
+        return payload
+
+
+class MpesaTransaction(MpesaPayloadMixin):
+    """
+    a class to handle mpesa operations
+    """
+
+    def __init__(self):
+        super(MpesaTransaction, self).__init__()
+        self.mpesa_gateway = MpesaGateway(self.vault)
+
+    def lipa_na_mpesa_online(
+        self, amount, phone_number, callbackurl, accountref, transaction_desc=""
+    ):
+        """
+        takes the arguments creates an mpesa payload
+        and initiate an mpesa stk push with appropriate details passed
+        Args:
+            amount: 200
+            phone_number: 254712345678
+            callbackurl: https://......
+            accountref: what you requesting payment for
+            transaction_desc: a short narration of the transaction in progress, default=''
+
+        Returns:
+            - mpesa response
+        """
+        payload = self.get_stk_push_payload(
+            amount, phone_number, callbackurl, accountref, transaction_desc
+        )
+        response = self.mpesa_gateway.initiate_stk_push(payload)
+        return response
+
+    def query_mpesa_express_transaction_status(self, checkout_request_id):
+        payload = self.get_stk_push_query_payload(checkout_request_id)
         response = self.mpesa_gateway.mpesa_express_query(payload)
         return response
 
@@ -135,24 +165,14 @@ class MpesaTransaction(object):
             transaction.checkout_request_id = response_data["CheckoutRequestID"]
             transaction.save(update_fields=["merchant_id", "checkout_request_id"])
 
-            # wait for mpesa transactions to happen and return appropriate response
-            # max wait is 90 sec with 10 loops. Then return a failed response
-
-            def await_transaction(await_period):
-                while await_period < 20:
-                    time.sleep(await_period)
-                    transaction.refresh_from_db()
-                    if transaction.status in ["Successful"]:
-                        break
-                    elif transaction.status not in ["Initiated"]:
-                        break
-                    else:
-                        await_period += 2
-                return
-
-            async_wait = Thread(target=await_transaction, args=(2,))
-            async_wait.start()
-            async_wait.join()
+            # wait for the stk callback to complete the transaction, the callback
+            # view wakes us up. Gives up after DARAJA_STKPUSH_COMPLETION_TIMEOUT
+
+            def await_transaction():
+                transaction.refresh_from_db(fields=["status"])
+                return transaction.status != Transaction.INITIATED
+
+            stk_push_completion.wait(transaction.account_number, await_transaction)
 
             transaction.refresh_from_db()
 
@@ -186,12 +206,33 @@ class MpesaTransaction(object):
             mpesa response with
 
         """
-        payload = {
-            "ShortCode": self.c2b_bussiness_code,
-            "ResponseType": "Completed",  # can be 'Cancelled', 'Completed'
-            "ConfirmationURL": confirmation_url,
-            "ValidationURL": validation_url,
-        }
-        logging.info(payload)
+        payload = self.get_register_c2b_urls_payload(confirmation_url, validation_url)
         response = self.mpesa_gateway.register_c2b_urls(payload)
         return response
+
+
+class AsyncMpesaTransaction(MpesaPayloadMixin):
+    """
+    asyncio version of MpesaTransaction, the mpesa calls return awaitables
+    with httpx responses instead of requests responses
+    """
+
+    def __init__(self):
+        super(AsyncMpesaTransaction, self).__init__()
+        self.mpesa_gateway = AsyncMpesaGateway(self.vault)
+
+    async def lipa_na_mpesa_online(
+        self, amount, phone_number, callbackurl, accountref, transaction_desc=""
+    ):
+        payload = self.get_stk_push_payload(
+            amount, phone_number, callbackurl, accountref, transaction_desc
+        )
+        return await self.mpesa_gateway.initiate_stk_push(payload)
+
+    async def query_mpesa_express_transaction_status(self, checkout_request_id):
+        payload = self.get_stk_push_query_payload(checkout_request_id)
+        return await self.mpesa_gateway.mpesa_express_query(payload)
+
+    async def register_c2b_urls(self, confirmation_url, validation_url):
+        payload = self.get_register_c2b_urls_payload(confirmation_url, validation_url)
+        return await self.mpesa_gateway.register_c2b_urls(payload)
@@ -0,0 +1,525 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import string
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.stats import summarize
+
+logger = logging.getLogger(__name__)
+
+# paths of the daraja endpoints, the same as on safaricom
+ACCESS_PATH = "/oauth/v1/generate"
+STKPUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+STKPUSH_QUERY_PATH = "/mpesa/stkpushquery/v1/query"
+C2B_REGISTER_PATH = "/mpesa/c2b/v1/registerurl"
+C2B_SIMULATE_PATH = "/mpesa/c2b/v1/simulate"
+# not part of daraja, used by the load driver
+STATS_PATH = "/loadtest/stats"
+STATS_RESET_PATH = "/loadtest/stats/reset"
+
+# the daraja env config pointing at each endpoint
+CONFIG_PATHS = (
+    ("DARAJA_SANDBOX_ACCESS_URL", ACCESS_PATH + "?grant_type=client_credentials"),
+    ("DARAJA_SANDBOX_STKPUSH_URL", STKPUSH_PATH),
+    ("DARAJA_SANDBOX_STKPUSH_QUERY_URL", STKPUSH_QUERY_PATH),
+    ("DARAJA_SANDBOX_C2B_REGISTER_URL", C2B_REGISTER_PATH),
+)
+
+DEFAULT_PORT = 8089
+TOKEN_EXPIRES_IN = 3599
+# stk pushes remembered for status queries
+MAX_STK_PUSHES = 100000
+
+# result code and description of failed stk pushes, cancelled by the customer
+# most of the time
+STK_FAILURES = (
+    (1032, "Request cancelled by user", 6),
+    (1037, "DS timeout user cannot be reached", 3),
+    (1, "The balance is insufficient for the transaction", 1),
+)
+STK_SUCCESS_DESC = "The service request is processed successfully."
+# daraja errors answered at the failure rate
+API_ERRORS = (
+    (
+        "500.001.1001",
+        "Unable to lock subscriber, a transaction is already in process for the "
+        "current subscriber",
+    ),
+    ("500.003.02", "System is busy. Please try again in few minutes."),
+    ("500.003.1001", "Internal Server Error"),
+)
+FIRST_NAMES = ("JOHN", "JANE", "PETER", "MARY", "JAMES", "GRACE", "DAVID", "ANN")
+LAST_NAMES = ("DOE", "KAMAU", "OTIENO", "WANJIKU", "MUTUA", "CHEPKOECH")
+
+
+def receipt_number():
+    """
+    Returns:
+        - mpesa style receipt number e.g. QDK8NK9HV8
+    """
+    return random.choice(string.ascii_uppercase) + "".join(
+        random.choices(string.ascii_uppercase + string.digits, k=9)
+    )
+
+
+class StkPush(object):
+    def __init__(self, merchant_request_id, checkout_request_id, payload):
+        self.merchant_request_id = merchant_request_id
+        self.checkout_request_id = checkout_request_id
+        self.payload = payload
+        # None until the customer has answered
+        self.result_code = None
+        self.result_desc = None
+        self.answered_at = None
+
+
+class FakeDaraja(object):
+    """
+    stand-in for the safaricom daraja api used for offline load tests.
+
+    Answers oauth, stk push, stk push query and c2b url registration like
+    daraja does after `latency` seconds, fails `failure_rate` of them with a
+    daraja error and posts the stk push callback to the CallBackURL of the push
+    `callback_delay` seconds after accepting it. C2B payments started through
+    the simulate endpoint are posted to the registered confirmation url.
+    Callbacks are posted by a pool of `callback_workers` threads
+    """
+
+    def __init__(
+        self,
+        latency=0.05,
+        jitter=0.02,
+        failure_rate=0.0,
+        callback_delay=1.0,
+        cancel_rate=0.1,
+        callback_workers=8,
+        callback_timeout=30,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.callback_delay = callback_delay
+        self.cancel_rate = cancel_rate
+        self.callback_timeout = callback_timeout
+
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._stk_pushes = OrderedDict()
+        # short code: (confirmation url, validation url)
+        self._c2b_urls = {}
+
+        # (due, sequence, kind, url, payload) of callbacks not posted yet
+        self._scheduled = []
+        self._scheduled_ready = threading.Condition(self._lock)
+        self._posting = 0
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=callback_workers, thread_name_prefix="fake-daraja-callback"
+        )
+        self._client = httpx.Client(
+            timeout=callback_timeout,
+            limits=httpx.Limits(max_connections=callback_workers),
+        )
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="fake-daraja-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        with self._stats_lock:
+            self._durations = defaultdict(list)
+            self._errors = defaultdict(int)
+
+    def _record(self, kind, duration, ok):
+        with self._stats_lock:
+            self._durations[kind].append(duration)
+            if not ok:
+                self._errors[kind] += 1
+
+    def stats(self):
+        """
+        Returns:
+            - callbacks waiting to be posted and the latency of the callbacks
+              posted since the last reset, by kind
+        """
+        with self._lock:
+            pending = len(self._scheduled) + self._posting
+        with self._stats_lock:
+            callbacks = {}
+            for kind, durations in self._durations.items():
+                callbacks[kind] = summarize(durations)
+                callbacks[kind]["errors"] = self._errors[kind]
+        return {"pending": pending, "callbacks": callbacks}
+
+    def reset_stats(self):
+        self._reset_stats()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._scheduled_ready.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+        self._client.close()
+
+    def delay(self):
+        """
+        sleep for the configured response latency
+        """
+        latency = self.latency + random.uniform(-self.jitter, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def should_fail(self):
+        return self.failure_rate > 0 and random.random() < self.failure_rate
+
+    def error(self):
+        code, message = random.choice(API_ERRORS)
+        return {
+            "requestId": uuid.uuid4().hex,
+            "errorCode": code,
+            "errorMessage": message,
+        }
+
+    def schedule_callback(self, kind, url, payload, delay):
+        with self._lock:
+            heapq.heappush(
+                self._scheduled,
+                (time.monotonic() + delay, next(self._counter), kind, url, payload),
+            )
+            self._scheduled_ready.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                while not self._stopped:
+                    if self._scheduled:
+                        wait = self._scheduled[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._scheduled_ready.wait(wait)
+                    else:
+                        self._scheduled_ready.wait()
+                if self._stopped:
+                    return
+                _, _, kind, url, payload = heapq.heappop(self._scheduled)
+                self._posting += 1
+            self._executor.submit(self._post_callback, kind, url, payload)
+
+    def _post_callback(self, kind, url, payload):
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = self._client.post(url, json=payload)
+            ok = response.status_code < 400
+            if not ok:
+                logger.warning("%s callback to %s: %s", kind, url, response.status_code)
+        except httpx.HTTPError as e:
+            logger.warning("%s callback to %s failed: %s", kind, url, e)
+        finally:
+            self._record(kind, time.perf_counter() - started, ok)
+            with self._lock:
+                self._posting -= 1
+
+    def stk_push(self, payload):
+        """
+        accept an stk push and schedule its callback
+        Returns:
+            - (data, status_code)
+        """
+        callback_url = payload.get("CallBackURL")
+        phone_number = str(payload.get("PhoneNumber") or "")
+        if not callback_url or not phone_number.isdigit():
+            return {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "400.002.02",
+                "errorMessage": "Bad Request - Invalid CallBackURL or PhoneNumber",
+            }, 400
+
+        sequence = next(self._counter)
+        merchant_request_id = "{}-{}-1".format(random.randint(10000, 99999), sequence)
+        checkout_request_id = "ws_CO_{:%d%m%Y%H%M%S}{:03d}{}".format(
+            datetime.now(), sequence % 1000, phone_number
+        )
+        push = StkPush(merchant_request_id, checkout_request_id, payload)
+        with self._lock:
+            self._stk_pushes[checkout_request_id] = push
+            while len(self._stk_pushes) > MAX_STK_PUSHES:
+                self._stk_pushes.popitem(last=False)
+
+        delay = max(self.callback_delay + random.uniform(-self.jitter, self.jitter), 0)
+        self.schedule_callback(
+            "stkpush-callback", callback_url, self.complete_stk_push(push, delay), delay
+        )
+        return {
+            "MerchantRequestID": merchant_request_id,
+            "CheckoutRequestID": checkout_request_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        }, 200
+
+    def complete_stk_push(self, push, delay):
+        """
+        decide how the customer answers an stk push, `delay` seconds from now
+        Returns:
+            - the callback payload for it
+        """
+        callback = {
+            "MerchantRequestID": push.merchant_request_id,
+            "CheckoutRequestID": push.checkout_request_id,
+        }
+        if self.cancel_rate > 0 and random.random() < self.cancel_rate:
+            weights = [weight for _, _, weight in STK_FAILURES]
+            code, desc, _ = random.choices(STK_FAILURES, weights)[0]
+            callback.update({"ResultCode": code, "ResultDesc": desc})
+        else:
+            callback.update(
+                {
+                    "ResultCode": 0,
+                    "ResultDesc": STK_SUCCESS_DESC,
+                    "CallbackMetadata": {
+                        "Item": [
+                            {"Name": "Amount", "Value": push.payload.get("Amount")},
+                            {"Name": "MpesaReceiptNumber", "Value": receipt_number()},
+                            {"Name": "Balance"},
+                            {
+                                "Name": "TransactionDate",
+                                "Value": int(datetime.now().strftime("%Y%m%d%H%M%S")),
+                            },
+                            {
+                                "Name": "PhoneNumber",
+                                "Value": int(push.payload["PhoneNumber"]),
+                            },
+                        ]
+                    },
+                }
+            )
+        # like daraja the status query reports the push as still processing
+        # until the customer has answered
+        push.result_code = callback["ResultCode"]
+        push.result_desc = callback["ResultDesc"]
+        push.answered_at = time.monotonic() + delay
+        return {"Body": {"stkCallback": callback}}
+
+    def stk_push_query(self, payload):
+        """
+        Returns:
+            - (data, status_code) with the result of an stk push
+        """
+        checkout_request_id = payload.get("CheckoutRequestID")
+        with self._lock:
+            push = self._stk_pushes.get(checkout_request_id)
+        if push is None:
+            return {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "400.002.02",
+                "errorMessage": "Bad Request - Invalid CheckoutRequestID",
+            }, 400
+        if push.answered_at is None or push.answered_at > time.monotonic():
+            return {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "500.001.1001",
+                "errorMessage": "The transaction is being processed",
+            }, 500
+        return {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted "
+            "successsfully",
+            "MerchantRequestID": push.merchant_request_id,
+            "CheckoutRequestID": push.checkout_request_id,
+            "ResultCode": str(push.result_code),
+            "ResultDesc": push.result_desc,
+        }, 200
+
+    def register_c2b_urls(self, payload):
+        short_code = str(payload.get("ShortCode") or "")
+        confirmation_url = payload.get("ConfirmationURL")
+        if not short_code or not confirmation_url:
+            return {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "400.003.02",
+                "errorMessage": "Bad Request - Invalid ShortCode or ConfirmationURL",
+            }, 400
+        with self._lock:
+            self._c2b_urls[short_code] = (
+                confirmation_url,
+                payload.get("ValidationURL"),
+            )
+        return {
+            "OriginatorCoversationID": uuid.uuid4().hex,
+            "ResponseCode": "0",
+            "ResponseDescription": "success",
+        }, 200
+
+    def simulate_c2b(self, payload):
+        """
+        a customer paying the short code, the confirmation is posted to the
+        registered url
+        Returns:
+            - (data, status_code)
+        """
+        short_code = str(payload.get("ShortCode") or "")
+        with self._lock:
+            urls = self._c2b_urls.get(short_code)
+        if urls is None:
+            return {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "400.003.02",
+                "errorMessage": "Bad Request - No urls registered for ShortCode",
+            }, 400
+        amount = payload.get("Amount") or 0
+        confirmation = {
+            "TransactionType": "Pay Bill",
+            "TransID": receipt_number(),
+            "TransTime": datetime.now().strftime("%Y%m%d%H%M%S"),
+            "TransAmount": "{:.2f}".format(float(amount)),
+            "BusinessShortCode": short_code,
+            "BillRefNumber": str(payload.get("BillRefNumber") or ""),
+            "InvoiceNumber": "",
+            "OrgAccountBalance": "{:.2f}".format(random.uniform(1000, 10**7)),
+            "ThirdPartyTransID": "",
+            "MSISDN": str(payload.get("Msisdn") or ""),
+            "FirstName": random.choice(FIRST_NAMES),
+            "MiddleName": "",
+            "LastName": random.choice(LAST_NAMES),
+        }
+        self.schedule_callback("c2b-confirmation", urls[0], confirmation, 0)
+        return {
+            "OriginatorCoversationID": uuid.uuid4().hex,
+            "ResponseCode": "0",
+            "ResponseDescription": "Accept the service request successfully.",
+        }, 200
+
+
+class FakeDarajaHandler(BaseHTTPRequestHandler):
+    # keep-alive, the daraja transport pools its connections
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, data, status_code=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def authorized(self):
+        # any bearer token is accepted, the app keeps its token in the db across
+        # restarts of this server
+        scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+        return scheme == "Bearer" and bool(token.strip())
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == STATS_PATH:
+            return self.send_json(self.fake.stats())
+        if path != ACCESS_PATH:
+            return self.send_json({"errorMessage": "Not Found"}, 404)
+
+        self.fake.delay()
+        if not (self.headers.get("Authorization") or "").startswith("Basic "):
+            return self.send_json(
+                {"errorCode": "400.008.01", "errorMessage": "Invalid Authentication"},
+                400,
+            )
+        if self.fake.should_fail():
+            return self.send_json(self.fake.error(), 500)
+        self.send_json(
+            {
+                "access_token": uuid.uuid4().hex,
+                "expires_in": str(TOKEN_EXPIRES_IN),
+            }
+        )
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        payload = self.read_json()
+        if path == STATS_RESET_PATH:
+            self.fake.reset_stats()
+            return self.send_json({"ResponseCode": "0"})
+        routes = {
+            STKPUSH_PATH: self.fake.stk_push,
+            STKPUSH_QUERY_PATH: self.fake.stk_push_query,
+            C2B_REGISTER_PATH: self.fake.register_c2b_urls,
+            C2B_SIMULATE_PATH: self.fake.simulate_c2b,
+        }
+        handler = routes.get(path)
+        if handler is None:
+            return self.send_json({"errorMessage": "Not Found"}, 404)
+
+        self.fake.delay()
+        if not self.authorized():
+            return self.send_json(
+                {
+                    "requestId": uuid.uuid4().hex,
+                    "errorCode": "404.001.03",
+                    "errorMessage": "Invalid Access Token",
+                },
+                400,
+            )
+        if payload is None:
+            return self.send_json(
+                {
+                    "requestId": uuid.uuid4().hex,
+                    "errorCode": "400.002.02",
+                    "errorMessage": "Bad Request - Invalid JSON",
+                },
+                400,
+            )
+        # simulate stands for the customer paying, only calls from the app fail
+        if path != C2B_SIMULATE_PATH and self.fake.should_fail():
+            return self.send_json(self.fake.error(), 500)
+        data, status_code = handler(payload)
+        self.send_json(data, status_code)
+
+
+class FakeDarajaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fake):
+        super(FakeDarajaServer, self).__init__(address, FakeDarajaHandler)
+        self.fake = fake
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def config(self):
+        """
+        Returns:
+            - list of (env name, url) pointing DarajaConfigs at this server
+        """
+        return [(name, self.base_url + path) for name, path in CONFIG_PATHS]
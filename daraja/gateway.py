@@ -1,15 +1,59 @@
+import asyncio
 import json
 import logging
+import threading
+import weakref
 from datetime import datetime, timedelta
 
+from django.conf import settings
+from django.db import transaction as db_transaction
+
 import pytz
-import requests
+from asgiref.sync import sync_to_async
 from requests.auth import HTTPBasicAuth
 
 from daraja.models import DarajaAcessToken
+from daraja.transport import get_async_transport, get_transport
+from utils.metrics import observe_daraja_request
 
 logger = logging.getLogger(__name__)
 
+ACCESS_TOKEN_CODE = "DARAJA_ACCESS_TOKEN"
+
+
+class AccessTokenCache(object):
+    """
+    process wide copy of the DarajaAcessToken row
+    """
+
+    def __init__(self):
+        # held by the caller refreshing the token
+        self.lock = threading.Lock()
+        # (token, expires_in) replaced as a whole so readers never see a mix
+        self._entry = None
+
+    def get(self, margin):
+        entry = self._entry
+        if entry is None:
+            return None
+        token, expires_in = entry
+        now = datetime.now(pytz.timezone("Africa/Nairobi"))
+        if expires_in - margin <= now:
+            return None
+        return token
+
+    def set(self, token, expires_in):
+        self._entry = (token, expires_in)
+
+    def clear(self):
+        self._entry = None
+
+
+access_token_cache = AccessTokenCache()
+
+# asyncio.Lock per event loop, the async counterpart of access_token_cache.lock
+_async_refresh_locks = weakref.WeakKeyDictionary()
+
 
 class MpesaGateway(object):
     """
@@ -24,35 +68,87 @@ class MpesaGateway(object):
         headers = {"Authorization": "Bearer %s" % access_token}
         return headers
 
+    def _post(self, endpoint, api_url, payload):
+        headers = self._get_access_headers()
+        with observe_daraja_request(endpoint) as request:
+            response = get_transport().post(api_url, json=payload, headers=headers)
+            request["status"] = response.status_code
+        return response
+
     def get_daraja_access_token(self):
         """
-        use this method to get mpesa access token
-        Returns:
+        use this method to get mpesa access token.
 
+        The token is served from memory while it is valid. Once it is within
+        DARAJA_TOKEN_REFRESH_MARGIN seconds of expiring only one caller per process
+        goes to the db, and only one process at a time refreshes it from safaricom
+        Returns:
+            - access token or '' if safaricom could not be reached
+        """
+        margin = timedelta(seconds=settings.DARAJA_TOKEN_REFRESH_MARGIN)
+        token = access_token_cache.get(margin)
+        if token:
+            return token
+
+        with access_token_cache.lock:
+            # another thread may have refreshed the token while we waited
+            token = access_token_cache.get(margin)
+            if token:
+                return token
+            token, expires_in = self._refresh_daraja_access_token(margin)
+            if token:
+                access_token_cache.set(token, expires_in)
+            return token
+
+    def _refresh_daraja_access_token(self, margin):
+        """
+        get the token from the db row, refreshing it from safaricom if it is about to
+        expire. The row stays locked until the refresh is saved so other workers wait
+        for it instead of calling safaricom as well
+        """
+        with db_transaction.atomic():
+            token_q, _ = DarajaAcessToken.objects.select_for_update().get_or_create(
+                code=ACCESS_TOKEN_CODE
+            )
+            now = datetime.now(pytz.timezone("Africa/Nairobi"))
+            if bool(token_q.expires_in) and token_q.expires_in - margin > now:
+                return token_q.token, token_q.expires_in
+
+            token, expires_in = self.request_daraja_access_token()
+            if not token:
+                # keep using the old token until it really expires
+                if bool(token_q.expires_in) and token_q.expires_in > now:
+                    return token_q.token, token_q.expires_in
+                return "", None
+            token_q.token = token
+            token_q.expires_in = expires_in
+            token_q.save()
+            return token, expires_in
+
+    def request_daraja_access_token(self):
+        """
+        get a new access token from safaricom
+        Returns:
+            - (token, expires_in) or ('', None) if the request fails
         """
         consumer_key = self.vault.DARAJA_CONSUMER_KEY
         consumer_secret = self.vault.DARAJA_CONSUMER_SECRET
 
         now = datetime.now(pytz.timezone("Africa/Nairobi"))
-        token_q, _ = DarajaAcessToken.objects.get_or_create(code="DARAJA_ACCESS_TOKEN")
-        if token_q and bool(token_q.expires_in) and token_q.expires_in > now:
-            return token_q.token
-        else:
-            req = requests.get(
+        with observe_daraja_request("access_token") as request:
+            req = get_transport().get(
                 self.vault.DARAJA_ACCESS_URL,
                 auth=HTTPBasicAuth(consumer_key, consumer_secret),
             )
-            try:
-                mpesa_access_token = json.loads(req.text)
-                validated_mpesa_token = mpesa_access_token["access_token"]
-                expires_in = int(mpesa_access_token["expires_in"])
-                token_q.token = validated_mpesa_token
-                token_q.expires_in = now + timedelta(seconds=expires_in)
-                token_q.save()
-                return validated_mpesa_token
-            except Exception as e:
-                logger.error(e)
-                return ""
+            request["status"] = req.status_code
+        try:
+            mpesa_access_token = json.loads(req.text)
+            validated_mpesa_token = mpesa_access_token["access_token"]
+            expires_in = int(mpesa_access_token["expires_in"])
+            return validated_mpesa_token, now + timedelta(seconds=expires_in)
+        except Exception as e:
+            logger.error(e)
+            return "", None
 
     def initiate_stk_push(self, payload):
         """
@@ -63,10 +159,7 @@ class MpesaGateway(object):
         Returns:
             - mpesa stk push response
         """
-        api_url = self.vault.DARAJA_STKPUSH_URL
-        headers = self._get_access_headers()
-        response = requests.post(api_url, json=payload, headers=headers)
-        return response
+        return self._post("stk_push", self.vault.DARAJA_STKPUSH_URL, payload)
 
     def mpesa_express_query(self, payload):
         """
@@ -87,13 +180,70 @@ class MpesaGateway(object):
         Returns:
 
         """
-        api_url = self.vault.DARAJA_STKPUSH_QUERY_URL
-        headers = self._get_access_headers()
-        response = requests.post(api_url, json=payload, headers=headers, timeout=20)
-        return response
+        return self._post(
+            "stk_push_query", self.vault.DARAJA_STKPUSH_QUERY_URL, payload
+        )
 
     def register_c2b_urls(self, payload):
-        api_url = self.vault.DARAJA_C2B_REGISTER_URL
-        headers = self._get_access_headers()
-        response = requests.post(api_url, json=payload, headers=headers)
+        return self._post(
+            "register_c2b_urls", self.vault.DARAJA_C2B_REGISTER_URL, payload
+        )
+
+
+class AsyncMpesaGateway(object):
+    """
+    asyncio version of MpesaGateway for the async daraja views.
+    Shares the access token cache with MpesaGateway
+    """
+
+    def __init__(self, vault):
+        self.vault = vault
+        self.sync_gateway = MpesaGateway(vault)
+
+    async def _get_access_headers(self):
+        access_token = await self.get_daraja_access_token()
+        headers = {"Authorization": "Bearer %s" % access_token}
+        return headers
+
+    async def _post(self, endpoint, api_url, payload):
+        headers = await self._get_access_headers()
+        with observe_daraja_request(endpoint) as request:
+            response = await get_async_transport().post(
+                api_url, json=payload, headers=headers
+            )
+            request["status"] = response.status_code
         return response
+
+    async def get_daraja_access_token(self):
+        """
+        same as MpesaGateway.get_daraja_access_token. A cached token is returned
+        without leaving the event loop; the rare refresh holds the token row lock
+        so it runs in a thread through the sync gateway
+        """
+        margin = timedelta(seconds=settings.DARAJA_TOKEN_REFRESH_MARGIN)
+        token = access_token_cache.get(margin)
+        if token:
+            return token
+
+        loop = asyncio.get_running_loop()
+        lock = _async_refresh_locks.get(loop)
+        if lock is None:
+            lock = _async_refresh_locks[loop] = asyncio.Lock()
+        async with lock:
+            token = access_token_cache.get(margin)
+            if token:
+                return token
+            return await sync_to_async(self.sync_gateway.get_daraja_access_token)()
+
+    async def initiate_stk_push(self, payload):
+        return await self._post("stk_push", self.vault.DARAJA_STKPUSH_URL, payload)
+
+    async def mpesa_express_query(self, payload):
+        return await self._post(
+            "stk_push_query", self.vault.DARAJA_STKPUSH_QUERY_URL, payload
+        )
+
+    async def register_c2b_urls(self, payload):
+        return await self._post(
+            "register_c2b_urls", self.vault.DARAJA_C2B_REGISTER_URL, payload
+        )
@@ -0,0 +1,169 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.urls import reverse
+
+import httpx
+
+from daraja.configs import DarajaConfigs
+from daraja.fakeserver import C2B_SIMULATE_PATH, STATS_PATH, STATS_RESET_PATH
+from utils.stats import summarize
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks for callbacks the fake server has not posted yet
+DRAIN_POLL_INTERVAL = 0.5
+
+
+class LoadTest(object):
+    """
+    drives the stk push -> callback -> status flow against a running app whose
+    daraja urls point at a FakeDaraja server.
+
+    Each flow initiates an stk push for a new account, which returns once the
+    callback posted by the fake server has completed the transaction, then
+    queries its status. `c2b_rate` of the flows are followed by a c2b payment to
+    the same account, confirmed through the registered confirmation url
+    """
+
+    def __init__(
+        self,
+        host,
+        daraja_url,
+        concurrency=20,
+        c2b_rate=0.5,
+        max_amount=1000,
+        timeout=120,
+    ):
+        self.host = host.rstrip("/")
+        self.daraja_url = daraja_url.rstrip("/")
+        self.concurrency = concurrency
+        self.c2b_rate = c2b_rate
+        self.max_amount = max_amount
+        self.short_code = DarajaConfigs().DARAJA_C2B_BUSINESS_SHORT_CODE
+        # keeps account numbers of separate runs apart
+        self.run_id = int(time.time())
+        self.client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+        )
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)
+        self._errors = defaultdict(int)
+
+    def request(self, name, method, url, **kwargs):
+        """
+        send a request and record its latency under name
+        Returns:
+            - the response, None if it could not be sent
+        """
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            logger.warning("%s %s failed: %s", method, url, e)
+        duration = time.perf_counter() - started
+        ok = response is not None and response.status_code < 400
+        if response is not None and not ok:
+            logger.warning("%s %s: %s", method, url, response.status_code)
+        with self._lock:
+            self._durations[name].append(duration)
+            if not ok:
+                self._errors[name] += 1
+        return response if ok else None
+
+    def register_c2b_urls(self):
+        return self.request(
+            "c2b-register-urls", "POST", self.host + reverse("c2b-register-urls")
+        )
+
+    def flow(self, index):
+        account_number = "{}{:06d}".format(self.run_id, index)
+        phone_number = "+2547{:08d}".format(random.randint(0, 10**8 - 1))
+        amount = random.randint(1, self.max_amount)
+        response = self.request(
+            "initiate-stkpush",
+            "POST",
+            self.host
+            + reverse(
+                "daraja-initiate-stkpush", kwargs={"account_number": account_number}
+            ),
+            json={"amount": amount, "phone_number": phone_number},
+        )
+        if response is None:
+            return
+        self.request(
+            "stkpush-query-status",
+            "GET",
+            self.host
+            + reverse(
+                "transaction-stkpush-query-status",
+                kwargs={"account_number": account_number},
+            ),
+        )
+        if self.c2b_rate > 0 and random.random() < self.c2b_rate:
+            self.request(
+                "c2b-simulate",
+                "POST",
+                self.daraja_url + C2B_SIMULATE_PATH,
+                headers={"Authorization": "Bearer loadtest"},
+                json={
+                    "ShortCode": self.short_code,
+                    "CommandID": "CustomerPayBillOnline",
+                    "Amount": amount,
+                    "Msisdn": phone_number[1:],
+                    "BillRefNumber": account_number,
+                },
+            )
+
+    def wait_for_callbacks(self, timeout):
+        """
+        wait until the fake server has posted every callback
+        Returns:
+            - the fake server stats
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            stats = self.client.get(self.daraja_url + STATS_PATH).json()
+            if not stats["pending"] or time.monotonic() >= deadline:
+                return stats
+            time.sleep(DRAIN_POLL_INTERVAL)
+
+    def run(self, flows, drain_timeout=60):
+        """
+        Returns:
+            - (elapsed seconds, {endpoint: summary}) where summary is the
+              utils.stats summary with errors and requests per second added.
+              Callbacks are reported by the fake server as `callback <kind>`
+        """
+        self.client.post(self.daraja_url + STATS_RESET_PATH)
+        started = time.monotonic()
+        if self.c2b_rate > 0 and self.register_c2b_urls() is None:
+            logger.warning("c2b urls could not be registered")
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for _ in executor.map(self.flow, range(flows)):
+                pass
+        stats = self.wait_for_callbacks(drain_timeout)
+        elapsed = time.monotonic() - started
+
+        results = {}
+        for name, durations in self._durations.items():
+            results[name] = summarize(durations)
+            results[name]["errors"] = self._errors[name]
+        for kind, summary in stats["callbacks"].items():
+            results["callback {}".format(kind)] = summary
+        for summary in results.values():
+            summary["rps"] = summary["count"] / elapsed if elapsed else 0
+        if stats["pending"]:
+            logger.warning("%s callback(s) still pending", stats["pending"])
+        return elapsed, results
+
+    def close(self):
+        self.client.close()
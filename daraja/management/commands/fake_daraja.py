@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+
+from daraja.fakeserver import DEFAULT_PORT, FakeDaraja, FakeDarajaServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a stand-in for the daraja api that posts realistic stk push and c2b "
+        "callbacks back to the app, for offline load tests"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+        parser.add_argument(
+            "--latency-ms", type=float, default=50, help="added to every response"
+        )
+        parser.add_argument(
+            "--jitter-ms",
+            type=float,
+            default=20,
+            help="latency and callback delay vary by up to this much",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0.0,
+            help="share of requests answered with a daraja error, 0 - 1",
+        )
+        parser.add_argument(
+            "--callback-delay-ms",
+            type=float,
+            default=1000,
+            help="time the customer takes to answer an stk push",
+        )
+        parser.add_argument(
+            "--cancel-rate",
+            type=float,
+            default=0.1,
+            help="share of stk pushes the customer does not complete, 0 - 1",
+        )
+        parser.add_argument(
+            "--callback-workers",
+            type=int,
+            default=8,
+            help="callbacks posted at the same time",
+        )
+
+    def handle(self, *args, **options):
+        fake = FakeDaraja(
+            latency=options["latency_ms"] / 1000.0,
+            jitter=options["jitter_ms"] / 1000.0,
+            failure_rate=options["failure_rate"],
+            callback_delay=options["callback_delay_ms"] / 1000.0,
+            cancel_rate=options["cancel_rate"],
+            callback_workers=options["callback_workers"],
+        )
+        server = FakeDarajaServer((options["bind"], options["port"]), fake)
+        self.stdout.write("fake daraja listening on {}".format(server.base_url))
+        self.stdout.write("point the app at it with these env configs:")
+        for name, url in server.config():
+            self.stdout.write("{}={}".format(name, url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            fake.stop()
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from daraja.fakeserver import DEFAULT_PORT
+from daraja.loadtest import LoadTest
+
+
+class Command(BaseCommand):
+    help = (
+        "Run stk push and c2b payment flows against the app while its daraja urls "
+        "point at fake_daraja, and report requests per second and latency per "
+        "endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host", default=settings.API_HOST_NAME, help="url of the app"
+        )
+        parser.add_argument(
+            "--daraja",
+            default="http://127.0.0.1:{}".format(DEFAULT_PORT),
+            help="url of the fake_daraja server",
+        )
+        parser.add_argument("--flows", type=int, default=200, help="stk pushes to run")
+        parser.add_argument(
+            "--concurrency", type=int, default=20, help="flows run at the same time"
+        )
+        parser.add_argument(
+            "--c2b-rate",
+            type=float,
+            default=0.5,
+            help="share of flows followed by a c2b payment, 0 - 1",
+        )
+        parser.add_argument("--max-amount", type=int, default=1000)
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=120,
+            help="seconds to wait for a response, an stk push waits for its callback",
+        )
+        parser.add_argument(
+            "--drain-timeout",
+            type=float,
+            default=60,
+            help="seconds to wait for the fake server to post its last callbacks",
+        )
+
+    def handle(self, *args, **options):
+        if not options["host"]:
+            raise CommandError("set --host or API_HOST_NAME")
+        load_test = LoadTest(
+            options["host"],
+            options["daraja"],
+            concurrency=options["concurrency"],
+            c2b_rate=options["c2b_rate"],
+            max_amount=options["max_amount"],
+            timeout=options["timeout"],
+        )
+        try:
+            elapsed, results = load_test.run(
+                options["flows"], drain_timeout=options["drain_timeout"]
+            )
+        finally:
+            load_test.close()
+
+        self.stdout.write(
+            "{} flow(s) in {:.1f}s, {:.1f} flows/s\n".format(
+                options["flows"], elapsed, options["flows"] / elapsed
+            )
+        )
+        self.stdout.write(
+            "{:<28} {:>7} {:>7} {:>8} {:>10} {:>10} {:>10}".format(
+                "endpoint", "count", "errors", "req/s", "p50 ms", "p99 ms", "max ms"
+            )
+        )
+        for name, stats in sorted(results.items()):
+            if not stats["count"]:
+                continue
+            self.stdout.write(
+                "{:<28} {count:>7} {errors:>7} {rps:>8.1f} {p50:>10.1f} "
+                "{p99:>10.1f} {max:>10.1f}".format(name, **stats)
+            )
@@ -0,0 +1,92 @@
+import csv
+import sys
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from daraja.reconciliation import (
+    AMOUNT_MISMATCH,
+    APPLIED,
+    MATCHED,
+    MISSING_IN_DB,
+    MISSING_IN_STATEMENT,
+    REPORT_COLUMNS,
+    StatementReconciler,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Match an mpesa statement csv against our payments and report what is "
+        "missing on either side or paid with a different amount"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("statement", help="statement csv exported from mpesa")
+        parser.add_argument(
+            "--report",
+            help="csv file for every line that did not match, - for stdout",
+        )
+        parser.add_argument(
+            "--apply",
+            action="store_true",
+            help="credit statement payments we have no record of to the transaction "
+            "with their account number, like a c2b confirmation would. Only run it "
+            "on statements old enough that no callback for them is still on its way",
+        )
+        parser.add_argument(
+            "--window-days",
+            type=int,
+            default=1,
+            help="read our payments this many days around the statement's dates",
+        )
+        parser.add_argument(
+            "--partitions",
+            type=int,
+            help="number of partitions for the join, sized from the file by default",
+        )
+        parser.add_argument("--tmp-dir", help="where to spill the partitions")
+
+    def handle(self, *args, **options):
+        report_file = None
+        if options["report"] == "-":
+            report_file = sys.stdout
+        elif options["report"]:
+            report_file = open(options["report"], "w", newline="", encoding="utf-8")
+        report = None
+        if report_file is not None:
+            report = csv.writer(report_file)
+            report.writerow(REPORT_COLUMNS)
+
+        started = time.monotonic()
+        reconciler = StatementReconciler(
+            report=report,
+            apply=options["apply"],
+            partitions=options["partitions"],
+            window=timedelta(days=options["window_days"]),
+        )
+        try:
+            counts = reconciler.run(options["statement"], tmp_dir=options["tmp_dir"])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        finally:
+            if report_file is not None and report_file is not sys.stdout:
+                report_file.close()
+
+        elapsed = time.monotonic() - started
+        out = self.stderr if report_file is sys.stdout else self.stdout
+        out.write(
+            "reconciled {} statement line(s) in {:.1f}s: {} matched, {} amount "
+            "mismatch, {} missing in db, {} applied, {} missing in statement".format(
+                counts["statement"],
+                elapsed,
+                counts[MATCHED],
+                counts[AMOUNT_MISMATCH],
+                counts[MISSING_IN_DB],
+                counts[APPLIED],
+                counts[MISSING_IN_STATEMENT],
+            )
+        )
+        for reason, skipped in sorted(reconciler.skipped.items()):
+            out.write("skipped {} line(s): {}".format(skipped, reason))
@@ -0,0 +1,214 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from daraja.facade import MpesaTransaction
+from payments.signals import send_transactions_updated
+from utils.loading import get_model
+from utils.ratelimit import RateLimiter
+
+Transaction = get_model("payments", "Transaction")
+
+logger = logging.getLogger(__name__)
+
+# daraja stk query result codes
+RESULT_SUCCESS = "0"
+RESULT_CANCELLED = "1032"
+# result codes that end an stk push for good: insufficient balance, a request
+# already in process for the subscriber, expired, customer unreachable, wrong pin
+# and push not sent. Anything else (system busy, still processing, internal
+# errors) is asked again on the next run, a callback can still complete it
+RESULT_FAILURES = frozenset(["1", "1001", "1019", "1025", "1037", "2001", "9999"])
+# stk query error while the customer has not responded yet
+ERROR_PROCESSING = "500.001.1001"
+
+
+def iter_stuck_transactions(cutoff, chunk_size):
+    """
+    keyset scan over Initiated stk pushes created before cutoff
+    Yields:
+        - lists of at most chunk_size transactions ordered by id
+    """
+    last_id = 0
+    queryset = (
+        Transaction.objects.filter(
+            status=Transaction.INITIATED,
+            date_created__lt=cutoff,
+            checkout_request_id__isnull=False,
+        )
+        .exclude(checkout_request_id="")
+        .only("id", "checkout_request_id")
+        .order_by("id")
+    )
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def get_query_outcome(mpesa_request):
+    """
+    maps an stk query response to the transaction update it calls for
+    Returns:
+        - (status, error_message) or None if the transaction should stay Initiated
+          because its outcome is not known yet
+    """
+    try:
+        response = mpesa_request.json()
+    except ValueError:
+        return None
+    if mpesa_request.status_code != 200:
+        if response.get("errorCode") != ERROR_PROCESSING:
+            logger.warning(response)
+        return None
+
+    result_code = str(response.get("ResultCode"))
+    result_desc = response.get("ResultDesc", "")
+    if result_code == RESULT_SUCCESS:
+        return Transaction.SUCCESSFUL, result_desc
+    elif result_code == RESULT_CANCELLED:
+        return Transaction.CANCELLED, result_desc
+    elif result_code in RESULT_FAILURES:
+        return Transaction.FAILED, result_desc
+    logger.warning(response)
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Query safaricom for stk pushes stuck in Initiated and record their final "
+        "status"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=120,
+            help="only reconcile transactions initiated this many seconds ago",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=8, help="concurrent status queries"
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=10,
+            help="maximum status queries per second sent to safaricom",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="transactions read from the db per keyset page",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="keep running, reconciling every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="seconds between runs when --loop is set",
+        )
+
+    def handle(self, *args, **options):
+        if options["rate"] <= 0:
+            raise CommandError("--rate has to be more than 0")
+        if options["workers"] < 1:
+            raise CommandError("--workers has to be at least 1")
+        while True:
+            self.reconcile(options)
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def reconcile(self, options):
+        started = time.monotonic()
+        cutoff = timezone.now() - timedelta(seconds=options["older_than"])
+        limiter = RateLimiter(options["rate"])
+        counts = defaultdict(int)
+
+        def query_status(transaction):
+            limiter.acquire()
+            try:
+                mpesa_transaction = MpesaTransaction()
+                mpesa_request = (
+                    mpesa_transaction.query_mpesa_express_transaction_status(
+                        transaction.checkout_request_id
+                    )
+                )
+                return transaction.id, get_query_outcome(mpesa_request)
+            except Exception as e:
+                logger.error(e)
+                return transaction.id, None
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for chunk in iter_stuck_transactions(cutoff, options["chunk_size"]):
+                results = executor.map(query_status, chunk)
+                for pay_status, updated in self.apply_outcomes(results).items():
+                    counts[pay_status] += updated
+                counts["scanned"] += len(chunk)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            "scanned {} transaction(s) in {:.1f}s: {} successful, {} failed, "
+            "{} cancelled".format(
+                counts["scanned"],
+                elapsed,
+                counts[Transaction.SUCCESSFUL],
+                counts[Transaction.FAILED],
+                counts[Transaction.CANCELLED],
+            )
+        )
+
+    def apply_outcomes(self, results):
+        """
+        write the query results back with one conditional update per outcome.
+        Transactions a callback completed in the meantime are left alone
+        Returns:
+            - {status: number of transactions updated}
+        """
+        groups = defaultdict(list)
+        for pk, outcome in results:
+            if outcome is not None:
+                groups[outcome].append(pk)
+
+        updated = defaultdict(int)
+        now = timezone.now()
+        for (pay_status, error_msg), pks in groups.items():
+            fields = {
+                "status": pay_status,
+                "error_message": error_msg,
+                "last_edited": now,
+            }
+            if pay_status == Transaction.SUCCESSFUL:
+                # the query has no amount, an stk push is always for the full amount
+                fields["amount_paid"] = F("amount")
+                fields["last_payment"] = F("amount")
+            with db_transaction.atomic():
+                # only the rows this update changes are passed on to the rollups
+                # and the search index
+                pks = list(
+                    Transaction.objects.select_for_update()
+                    .filter(pk__in=pks, status=Transaction.INITIATED)
+                    .values_list("id", flat=True)
+                )
+                if not pks:
+                    continue
+                updated[pay_status] += Transaction.objects.filter(pk__in=pks).update(
+                    **fields
+                )
+                send_transactions_updated(Transaction, pks)
+        return updated
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.14 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def delete_duplicate_tokens(apps, schema_editor):
+    """
+    keep only the newest token of each code, the racy get_or_create used before
+    could have saved several
+    """
+    DarajaAcessToken = apps.get_model('daraja', 'DarajaAcessToken')
+    seen = set()
+    duplicates = []
+    tokens = DarajaAcessToken.objects.order_by('code', '-date_created', '-id')
+    for token_id, code in tokens.values_list('id', 'code'):
+        if code in seen:
+            duplicates.append(token_id)
+        seen.add(code)
+    DarajaAcessToken.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='darajaacesstoken',
+            name='code',
+            field=models.CharField(default='DARAJA_ACCESS_TOKEN', max_length=255, unique=True),
+        ),
+    ]
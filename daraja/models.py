@@ -7,7 +7,7 @@ class DarajaAcessToken(models.Model):
     """
     Store the Access Token Instead of hitting Safaricom per Every Request
     """
-    code = models.CharField(default="DARAJA_ACCESS_TOKEN", max_length=255)
+    code = models.CharField(default="DARAJA_ACCESS_TOKEN", max_length=255, unique=True)
     token = models.TextField(null=True)
     expires_in = models.DateTimeField(null=True)
     date_created = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,473 @@
+import csv
+import logging
+import os
+import re
+import tempfile
+import zlib
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+from utils.loading import get_model
+
+Transaction = get_model("payments", "Transaction")
+TransactionLog = get_model("payments", "TransactionLog")
+PaymentReceipt = get_model("payments", "PaymentReceipt")
+
+logger = logging.getLogger(__name__)
+
+MATCHED, AMOUNT_MISMATCH = "matched", "amount_mismatch"
+MISSING_IN_DB, MISSING_IN_STATEMENT = "missing_in_db", "missing_in_statement"
+APPLIED = "applied"
+
+# statement column: accepted header names, org portal exports first
+STATEMENT_COLUMNS = {
+    "receipt": ("Receipt No.", "Receipt No", "Receipt", "TransID"),
+    "completed": ("Completion Time", "TransTime"),
+    "details": ("Details",),
+    "status": ("Transaction Status",),
+    "paid_in": ("Paid In", "Amount", "TransAmount"),
+    "party": ("Other Party Info", "MSISDN"),
+    "account": ("A/C No.", "Account No.", "BillRefNumber"),
+}
+STATEMENT_TIME_FORMATS = ("%d-%m-%Y %H:%M:%S", "%Y%m%d%H%M%S")
+# "Pay Bill Online from 254708374149 - JOHN DOE Acc. 1000001"
+DETAILS_ACCOUNT_RE = re.compile(r"Acc\.\s*(\S+)")
+# "254708374149 - JOHN DOE"
+PARTY_RE = re.compile(r"^\s*(\+?\d{9,12})\s*-?\s*(.*)$")
+
+REPORT_COLUMNS = (
+    "result",
+    "receipt_number",
+    "statement_amount",
+    "db_amount",
+    "account_number",
+    "db_account_number",
+    "completion_time",
+    "note",
+)
+
+# statement bytes per partition, each partition is joined in memory
+PARTITION_BYTES = 8 * 1024 * 1024
+# receipts looked up per query when resolving statement lines
+LOOKUP_CHUNK_SIZE = 1000
+# rows read from the db per round trip
+DB_CHUNK_SIZE = 5000
+
+StatementEntry = namedtuple(
+    "StatementEntry", "receipt amount account completed msisdn name"
+)
+# source is one of PaymentReceipt, Transaction or TransactionLog
+Credit = namedtuple("Credit", "source receipt amount account date")
+RECEIPT_FIELDS = (
+    "receipt_number",
+    "amount",
+    "transaction__account_number",
+    "date_created",
+)
+TRANSACTION_FIELDS = (
+    "provider_reference",
+    "amount_paid",
+    "account_number",
+    "date_created",
+)
+
+
+def parse_amount(value):
+    try:
+        return Decimal((value or "").replace(",", "").strip())
+    except InvalidOperation:
+        return None
+
+
+def parse_statement_time(value):
+    """
+    Returns:
+        - naive datetime in TIME_ZONE, statements are in kenyan time
+    """
+    value = (value or "").strip()
+    try:
+        # the usual format, much faster than strptime
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for time_format in STATEMENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    return None
+
+
+def read_statement(lines, skipped=None):
+    """
+    credits in an mpesa statement csv. Anything before the column header, lines
+    that are not completed and money paid out are skipped
+    Args:
+        lines: iterable of csv lines
+        skipped: Counter of skipped lines by reason, updated in place
+
+    Yields:
+        - StatementEntry
+    """
+    skipped = Counter() if skipped is None else skipped
+    reader = csv.reader(lines)
+    columns = None
+    for row in reader:
+        if columns is None:
+            headers = [cell.strip() for cell in row]
+            if any(name in headers for name in STATEMENT_COLUMNS["receipt"]):
+                columns = {}
+                for key, names in STATEMENT_COLUMNS.items():
+                    for name in names:
+                        if name in headers:
+                            columns[key] = headers.index(name)
+                            break
+                if "paid_in" not in columns:
+                    raise ValueError("statement has no paid in or amount column")
+            continue
+
+        def get(key):
+            index = columns.get(key)
+            if index is None or index >= len(row):
+                return ""
+            return row[index].strip()
+
+        receipt = get("receipt")
+        if not receipt:
+            skipped["blank"] += 1
+            continue
+        if get("status") and get("status") != "Completed":
+            skipped["not completed"] += 1
+            continue
+        amount = parse_amount(get("paid_in"))
+        if not amount or amount < 0:
+            skipped["not a credit"] += 1
+            continue
+
+        account = get("account")
+        if not account:
+            match = DETAILS_ACCOUNT_RE.search(get("details"))
+            account = match.group(1) if match else ""
+        msisdn, name = "", ""
+        match = PARTY_RE.match(get("party"))
+        if match:
+            msisdn, name = match.groups()
+        yield StatementEntry(
+            receipt,
+            amount,
+            account,
+            parse_statement_time(get("completed")),
+            msisdn,
+            name.strip(),
+        )
+    if columns is None:
+        raise ValueError("no statement column header found")
+
+
+def partition_of(receipt, partitions):
+    return zlib.crc32(receipt.encode("utf-8")) % partitions
+
+
+def _format_time(value):
+    return value.isoformat() if value is not None else ""
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class StatementReconciler(object):
+    """
+    matches the credits in an mpesa statement against what we recorded.
+
+    A partitioned hash join on the receipt number: the statement and our credits
+    around the statement's dates are both split over temporary files by a hash
+    of the receipt, then each statement partition is loaded into a dict and the
+    credits of the same partition are streamed past it. Memory use is bounded by
+    the partition size whatever the size of the statement.
+
+    Our credits are PaymentReceipts with a receipt number, and successful
+    transactions by provider_reference for payments from before receipts were
+    recorded. C2B confirmations in TransactionLog tell a credit we never applied
+    apart from one we never got a callback for.
+    """
+
+    def __init__(self, report=None, apply=False, partitions=None, window=None):
+        """
+        Args:
+            report: csv writer for one row per REPORT_COLUMNS, optional
+            apply: credit statement payments missing from the db
+            partitions: number of partitions, sized from the statement by default
+            window: how far around the statement's dates to read our credits
+        """
+        self.report = report
+        self.apply = apply
+        self.partitions = partitions
+        self.window = window if window is not None else timedelta(days=1)
+        self.counts = Counter()
+        self.skipped = Counter()
+        # aware bounds of the statement's completion times
+        self.first = self.last = None
+
+    def run(self, path, tmp_dir=None):
+        """
+        Returns:
+            - Counter of results
+        """
+        partitions = self.partitions or max(
+            1, os.path.getsize(path) // PARTITION_BYTES + 1
+        )
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+            statement_paths = self.partition_statement(path, work_dir, partitions)
+            if self.first is None:
+                # no dates to read our credits around, every line is looked up
+                credit_paths = [None] * partitions
+            else:
+                credit_paths = self.partition_credits(work_dir, partitions)
+            for statement_path, credit_path in zip(statement_paths, credit_paths):
+                self.join(statement_path, credit_path)
+        return self.counts
+
+    def _open_partitions(self, work_dir, prefix, partitions):
+        paths = [
+            os.path.join(work_dir, "{}-{}.csv".format(prefix, number))
+            for number in range(partitions)
+        ]
+        files = [open(path, "w", newline="", encoding="utf-8") for path in paths]
+        return paths, files, [csv.writer(spill) for spill in files]
+
+    def partition_statement(self, path, work_dir, partitions):
+        paths, files, writers = self._open_partitions(work_dir, "statement", partitions)
+        first = last = None
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as statement:
+                for entry in read_statement(statement, self.skipped):
+                    self.counts["statement"] += 1
+                    if entry.completed is not None:
+                        if first is None or entry.completed < first:
+                            first = entry.completed
+                        if last is None or entry.completed > last:
+                            last = entry.completed
+                    writers[partition_of(entry.receipt, partitions)].writerow(
+                        (
+                            entry.receipt,
+                            entry.amount,
+                            entry.account,
+                            _format_time(entry.completed),
+                            entry.msisdn,
+                            entry.name,
+                        )
+                    )
+        finally:
+            for spill in files:
+                spill.close()
+        if first is not None:
+            self.first = timezone.make_aware(first)
+            self.last = timezone.make_aware(last)
+        return paths
+
+    def iter_credits(self, start, end):
+        """
+        our credits and c2b confirmations created in [start, end), receipts first
+        Yields:
+            - Credit
+        """
+        receipts = (
+            PaymentReceipt.objects.filter(
+                receipt_number__isnull=False,
+                date_created__gte=start,
+                date_created__lt=end,
+            )
+            .exclude(receipt_number="")
+            .values_list(*RECEIPT_FIELDS)
+        )
+        for receipt, amount, account, date in receipts.iterator(DB_CHUNK_SIZE):
+            yield Credit("PaymentReceipt", receipt, amount, account or "", date)
+
+        transactions = (
+            Transaction.objects.filter(
+                status=Transaction.SUCCESSFUL,
+                provider_reference__isnull=False,
+                date_created__gte=start,
+                date_created__lt=end,
+            )
+            .exclude(provider_reference="")
+            .values_list(*TRANSACTION_FIELDS)
+        )
+        for receipt, amount, account, date in transactions.iterator(DB_CHUNK_SIZE):
+            yield Credit("Transaction", receipt, amount, account, date)
+
+        logs = (
+            TransactionLog.objects.filter(
+                kind=TransactionLog.C2B, date_created__gte=start, date_created__lt=end
+            )
+            .exclude(receipt_number="")
+            .values_list("receipt_number", "account_number", "date_created")
+        )
+        for receipt, account, date in logs.iterator(DB_CHUNK_SIZE):
+            yield Credit("TransactionLog", receipt, None, account, date)
+
+    def partition_credits(self, work_dir, partitions):
+        paths, files, writers = self._open_partitions(work_dir, "credits", partitions)
+        try:
+            for credit in self.iter_credits(
+                self.first - self.window, self.last + self.window
+            ):
+                writers[partition_of(credit.receipt, partitions)].writerow(
+                    (
+                        credit.source,
+                        credit.receipt,
+                        "" if credit.amount is None else credit.amount,
+                        credit.account,
+                        _format_time(credit.date),
+                    )
+                )
+        finally:
+            for spill in files:
+                spill.close()
+        return paths
+
+    def join(self, statement_path, credit_path):
+        entries = {}
+        with open(statement_path, newline="", encoding="utf-8") as spill:
+            for receipt, amount, account, completed, msisdn, name in csv.reader(spill):
+                entries[receipt] = StatementEntry(
+                    receipt,
+                    Decimal(amount),
+                    account,
+                    _parse_time(completed),
+                    msisdn,
+                    name,
+                )
+
+        credited, logged = set(), set()
+        with open(credit_path or os.devnull, newline="", encoding="utf-8") as spill:
+            for source, receipt, amount, account, date in csv.reader(spill):
+                if source == "TransactionLog":
+                    logged.add(receipt)
+                    continue
+                if receipt in credited:
+                    # a transaction whose payment also has a receipt
+                    continue
+                credited.add(receipt)
+                credit = Credit(
+                    source, receipt, int(amount), account, _parse_time(date)
+                )
+                entry = entries.pop(receipt, None)
+                if entry is not None:
+                    self.compare(entry, credit)
+                elif credit.date and self.first <= credit.date <= self.last:
+                    self.record(MISSING_IN_STATEMENT, None, credit)
+
+        # statement lines without a credit near their date, look them up anywhere
+        unmatched = list(entries.values())
+        for offset in range(0, len(unmatched), LOOKUP_CHUNK_SIZE):
+            self.resolve(unmatched[offset : offset + LOOKUP_CHUNK_SIZE], logged)
+
+    def resolve(self, entries, logged):
+        receipts = [entry.receipt for entry in entries]
+        credits = {}
+        # filtering on status as well can make the db pick the status index
+        for receipt, amount, account, date, pay_status in Transaction.objects.filter(
+            provider_reference__in=receipts
+        ).values_list(*TRANSACTION_FIELDS, "status"):
+            if pay_status == Transaction.SUCCESSFUL:
+                credits[receipt] = Credit("Transaction", receipt, amount, account, date)
+        # receipts take precedence over transactions
+        for receipt, amount, account, date in PaymentReceipt.objects.filter(
+            receipt_number__in=receipts
+        ).values_list(*RECEIPT_FIELDS):
+            credits[receipt] = Credit("PaymentReceipt", receipt, amount, account, date)
+        logged = logged | set(
+            TransactionLog.objects.filter(
+                kind=TransactionLog.C2B, receipt_number__in=receipts
+            ).values_list("receipt_number", flat=True)
+        )
+        known_accounts = set()
+        if self.apply:
+            known_accounts = set(
+                Transaction.objects.filter(
+                    account_number__in={entry.account for entry in entries}
+                ).values_list("account_number", flat=True)
+            )
+
+        for entry in entries:
+            credit = credits.get(entry.receipt)
+            if credit is not None:
+                self.compare(entry, credit)
+                continue
+            note = "c2b confirmation logged, not applied"
+            if entry.receipt not in logged:
+                note = "no callback received"
+            if self.apply and entry.account not in known_accounts:
+                # payments are only credited to transactions we know of
+                note += ", no transaction for its account number"
+            elif self.apply:
+                try:
+                    self.apply_credit(entry)
+                except Exception as e:
+                    logger.error(e)
+                    note += ", could not apply: {}".format(e)
+                else:
+                    self.record(APPLIED, entry, None, note)
+                    continue
+            self.record(MISSING_IN_DB, entry, None, note)
+
+    def compare(self, entry, credit):
+        notes = []
+        if entry.account and credit.account and entry.account != credit.account:
+            notes.append("account number differs")
+        if Decimal(credit.amount) != entry.amount:
+            if credit.source == "Transaction":
+                notes.append("amount_paid can include other payments")
+            self.record(AMOUNT_MISMATCH, entry, credit, ", ".join(notes))
+        else:
+            self.record(MATCHED, entry, credit, ", ".join(notes))
+
+    def apply_credit(self, entry):
+        """
+        credit a statement payment through the c2b confirmation path, which logs it
+        and records its receipt so it is never applied twice
+        """
+        from daraja.views import confirm_c2b_payment
+
+        confirm_c2b_payment(
+            {
+                "TransactionType": "Pay Bill",
+                "TransID": entry.receipt,
+                "TransTime": (
+                    entry.completed.strftime("%Y%m%d%H%M%S")
+                    if entry.completed is not None
+                    else ""
+                ),
+                "TransAmount": str(entry.amount),
+                "BillRefNumber": entry.account,
+                "MSISDN": entry.msisdn,
+                "FirstName": entry.name,
+                "Source": "statement",
+            }
+        )
+
+    def record(self, result, entry, credit, note=""):
+        self.counts[result] += 1
+        if self.report is None or result == MATCHED:
+            return
+        if entry is not None:
+            completed = entry.completed
+        else:
+            completed = timezone.make_naive(credit.date)
+        self.report.writerow(
+            (
+                result,
+                entry.receipt if entry is not None else credit.receipt,
+                entry.amount if entry is not None else "",
+                credit.amount if credit is not None else "",
+                entry.account if entry is not None else "",
+                credit.account if credit is not None else "",
+                _format_time(completed),
+                note,
+            )
+        )
@@ -1,3 +1,251 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from daraja.completion import CompletionRegistry, stk_push_completion
+from daraja.management.commands.reconcile_stkpush import Command as ReconcileCommand
+from daraja.views import (
+    confirm_c2b_payment,
+    handle_stk_push_callback,
+    update_transaction_details,
+)
+from utils.loading import get_model
+
+PaymentReceipt = get_model("payments", "PaymentReceipt")
+Transaction = get_model("payments", "Transaction")
+
+
+def stk_callback(checkout_request_id, result_code=0, amount=100, receipt="QKT1A2B3C4"):
+    callback = {
+        "MerchantRequestID": "merchant-{}".format(checkout_request_id),
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully.",
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {
+            "Item": [
+                {"Name": "Amount", "Value": amount},
+                {"Name": "MpesaReceiptNumber", "Value": receipt},
+                {"Name": "PhoneNumber", "Value": 254712345678},
+            ]
+        }
+    else:
+        callback["ResultDesc"] = "Request cancelled by user"
+    return {"Body": {"stkCallback": callback}}
+
+
+def c2b_confirmation(account_number, amount=100, trans_id="QKT1A2B3C4"):
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": trans_id,
+        "TransTime": "20261018101010",
+        "TransAmount": "{}.00".format(amount),
+        "BusinessShortCode": "600000",
+        "BillRefNumber": account_number,
+        "MSISDN": "254712345678",
+        "FirstName": "Jane",
+    }
+
+
+@override_settings(
+    DARAJA_STKPUSH_COMPLETION_TIMEOUT=5, DARAJA_STKPUSH_COMPLETION_POLL_INTERVAL=60
+)
+class CompletionRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = CompletionRegistry()
+        self.completed = threading.Event()
+
+    def complete_later(self, key, delay=0.05):
+        def complete():
+            self.completed.set()
+            self.registry.notify(key)
+
+        timer = threading.Timer(delay, complete)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_wait_returns_at_once_if_complete(self):
+        self.completed.set()
+        self.assertTrue(self.registry.wait("A1", self.completed.is_set))
+
+    def test_wait_is_woken_by_notify(self):
+        self.complete_later("A1")
+        started = time.monotonic()
+        self.assertTrue(self.registry.wait("A1", self.completed.is_set))
+        # well before the poll interval
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_wait_times_out(self):
+        started = time.monotonic()
+        self.assertFalse(self.registry.wait("A1", self.completed.is_set, timeout=0.1))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_notify_only_wakes_its_key(self):
+        self.complete_later("A2")
+        self.assertFalse(self.registry.wait("A1", lambda: False, timeout=0.3))
+
+    def test_wait_unsubscribes(self):
+        self.registry.wait("A1", self.completed.is_set, timeout=0.05)
+        self.assertEqual(self.registry.notify("A1"), 0)
+
+    def test_wait_async_is_woken_by_notify(self):
+        async def is_complete():
+            return self.completed.is_set()
+
+        self.complete_later("A1")
+        started = time.monotonic()
+        self.assertTrue(asyncio.run(self.registry.wait_async("A1", is_complete)))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.registry.notify("A1"), 0)
+
+    def test_wait_async_times_out(self):
+        async def is_complete():
+            return False
+
+        self.assertFalse(
+            asyncio.run(self.registry.wait_async("A1", is_complete, timeout=0.1))
+        )
+
+
+@override_settings(
+    ELASTICSEARCH_DSL_AUTOSYNC=False,
+    ROLLUP_ENABLED=False,
+    TRANSACTION_LOG_BUFFER_ENABLED=False,
+)
+class CallbackTestCase(TestCase):
+    def setUp(self):
+        self.transaction = Transaction.objects.create(
+            account_number="T100",
+            amount=100,
+            narration="test",
+            checkout_request_id="ws_CO_1",
+        )
+
+    def assertCredited(self, amount_paid, receipts):
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, Transaction.SUCCESSFUL)
+        self.assertEqual(self.transaction.amount_paid, amount_paid)
+        self.assertEqual(
+            PaymentReceipt.objects.filter(transaction=self.transaction).count(),
+            receipts,
+        )
+
+
+class StkPushCallbackTests(CallbackTestCase):
+    def test_waiters_are_notified_after_commit(self):
+        with mock.patch.object(stk_push_completion, "notify") as notify:
+            with self.captureOnCommitCallbacks() as callbacks:
+                handle_stk_push_callback("T100", stk_callback("ws_CO_1"))
+            notify.assert_not_called()
+            for callback in callbacks:
+                callback()
+        notify.assert_called_once_with("T100")
+        self.assertCredited(100, 1)
+
+    def test_unknown_transaction_is_rejected(self):
+        with mock.patch.object(stk_push_completion, "notify") as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = handle_stk_push_callback("T404", stk_callback("ws_CO_2"))
+        self.assertEqual(resp, "Invalid Transaction")
+        notify.assert_not_called()
+
+
+class CallbackIdempotencyTests(CallbackTestCase):
+    def test_duplicate_stk_callback_is_applied_once(self):
+        payload = stk_callback("ws_CO_1")
+        self.assertEqual(
+            update_transaction_details("T100", payload), (True, self.transaction.id)
+        )
+        self.assertEqual(
+            update_transaction_details("T100", payload), (True, self.transaction.id)
+        )
+        self.assertCredited(100, 1)
+        self.assertEqual(self.transaction.provider_reference, "QKT1A2B3C4")
+
+    def test_callback_for_completed_transaction_is_not_claimed(self):
+        Transaction.objects.filter(pk=self.transaction.pk).update(
+            status=Transaction.CANCELLED
+        )
+        update_transaction_details("T100", stk_callback("ws_CO_1"))
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, Transaction.CANCELLED)
+        self.assertEqual(self.transaction.amount_paid, 0)
+        self.assertFalse(PaymentReceipt.objects.exists())
+
+    def test_failed_stk_callback_is_applied_once(self):
+        payload = stk_callback("ws_CO_1", result_code=1032)
+        update_transaction_details("T100", payload)
+        update_transaction_details("T100", payload)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, Transaction.FAILED)
+        receipt = PaymentReceipt.objects.get()
+        self.assertIsNone(receipt.receipt_number)
+
+    def test_duplicate_c2b_confirmation_is_applied_once(self):
+        payload = c2b_confirmation("T100")
+        confirm_c2b_payment(payload)
+        confirm_c2b_payment(payload)
+        self.assertCredited(100, 1)
+        self.assertEqual(self.transaction.phone_number, "+254712345678")
+
+    def test_c2b_confirmation_after_stk_callback_is_not_credited(self):
+        update_transaction_details("T100", stk_callback("ws_CO_1"))
+        self.assertEqual(
+            confirm_c2b_payment(c2b_confirmation("T100")),
+            {"ResultCode": 0, "ResultDesc": "Accepted"},
+        )
+        self.assertCredited(100, 1)
+        self.assertEqual(PaymentReceipt.objects.get().source, PaymentReceipt.STKPUSH)
+
+    def test_stk_callback_after_c2b_confirmation_is_not_credited(self):
+        confirm_c2b_payment(c2b_confirmation("T100"))
+        self.assertEqual(
+            update_transaction_details("T100", stk_callback("ws_CO_1")),
+            (True, self.transaction.id),
+        )
+        self.assertCredited(100, 1)
+        self.assertEqual(PaymentReceipt.objects.get().source, PaymentReceipt.C2B)
+
+    def test_receipt_claim_failure_rolls_back_stk_update(self):
+        # a c2b confirmation with the stk payment's receipt landed while the
+        # transaction was still Initiated, e.g. on another account
+        other = Transaction.objects.create(
+            account_number="T200", amount=100, narration="test"
+        )
+        confirm_c2b_payment(c2b_confirmation("T200"))
+        update_transaction_details("T100", stk_callback("ws_CO_1"))
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, Transaction.INITIATED)
+        self.assertEqual(self.transaction.amount_paid, 0)
+        self.assertEqual(PaymentReceipt.objects.get().transaction_id, other.id)
+
+
+class ReconcileStkPushTests(CallbackTestCase):
+    def test_rate_has_to_be_positive(self):
+        with self.assertRaises(CommandError):
+            call_command("reconcile_stkpush", rate=0)
+
+    def test_only_updated_transactions_are_sent(self):
+        completed = Transaction.objects.create(
+            account_number="T200",
+            amount=100,
+            narration="test",
+            status=Transaction.SUCCESSFUL,
+        )
+        outcome = (Transaction.FAILED, "DS timeout user cannot be reached")
+        with mock.patch(
+            "daraja.management.commands.reconcile_stkpush.send_transactions_updated"
+        ) as send:
+            updated = ReconcileCommand().apply_outcomes(
+                [(self.transaction.id, outcome), (completed.id, outcome)]
+            )
+        self.assertEqual(updated, {Transaction.FAILED: 1})
+        send.assert_called_once_with(Transaction, [self.transaction.id])
+        completed.refresh_from_db()
+        self.assertEqual(completed.status, Transaction.SUCCESSFUL)
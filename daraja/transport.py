@@ -0,0 +1,152 @@
+import asyncio
+import os
+import threading
+import weakref
+
+from django.conf import settings
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from utils.metrics import DARAJA_HTTP_REQUESTS
+
+
+class _CountingPoolMixin(object):
+    def _make_request(self, conn, *args, **kwargs):
+        # a pooled connection that is still open has its socket, a new or
+        # dropped one connects inside _make_request
+        connection = "reused" if getattr(conn, "sock", None) else "new"
+        DARAJA_HTTP_REQUESTS.labels(transport="requests", connection=connection).inc()
+        return super(_CountingPoolMixin, self)._make_request(conn, *args, **kwargs)
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class DarajaHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super(DarajaHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+class DarajaTransport(object):
+    """
+    keep-alive http session shared by every MpesaGateway call.
+
+    Connections to safaricom are pooled and reused so we only pay for the TCP and
+    TLS handshake once per pooled connection instead of once per request
+    """
+
+    def __init__(self):
+        self.timeout = (
+            settings.DARAJA_HTTP_CONNECT_TIMEOUT,
+            settings.DARAJA_HTTP_READ_TIMEOUT,
+        )
+        adapter = DarajaHTTPAdapter(
+            pool_connections=settings.DARAJA_HTTP_POOL_CONNECTIONS,
+            pool_maxsize=settings.DARAJA_HTTP_POOL_SIZE,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_transport_pid = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    process wide DarajaTransport, created on first use.
+    Gunicorn forks workers after import so each worker builds its own pool
+    """
+    global _transport, _transport_pid
+    pid = os.getpid()
+    if _transport is not None and _transport_pid == pid:
+        return _transport
+    with _transport_lock:
+        if _transport is None or _transport_pid != pid:
+            _transport = DarajaTransport()
+            _transport_pid = pid
+        return _transport
+
+
+class AsyncDarajaTransport(object):
+    """
+    asyncio counterpart of DarajaTransport used by AsyncMpesaGateway.
+    An httpx client is bound to the event loop it was created on, so there is one
+    transport per running loop
+    """
+
+    def __init__(self):
+        timeout = httpx.Timeout(
+            settings.DARAJA_HTTP_READ_TIMEOUT,
+            connect=settings.DARAJA_HTTP_CONNECT_TIMEOUT,
+        )
+        limits = httpx.Limits(
+            max_connections=settings.DARAJA_HTTP_POOL_SIZE,
+            max_keepalive_connections=settings.DARAJA_HTTP_POOL_SIZE,
+        )
+        self.client = httpx.AsyncClient(timeout=timeout, limits=limits)
+
+    async def request(self, method, url, **kwargs):
+        connection = {"label": "reused"}
+
+        async def trace(event, info):
+            # httpcore only connects when the pool has no idle connection
+            if event == "connection.connect_tcp.started":
+                connection["label"] = "new"
+
+        try:
+            return await self.client.request(
+                method, url, extensions={"trace": trace}, **kwargs
+            )
+        finally:
+            DARAJA_HTTP_REQUESTS.labels(
+                transport="httpx", connection=connection["label"]
+            ).inc()
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport():
+    """
+    AsyncDarajaTransport for the running event loop, created on first use
+    """
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = _async_transports[loop] = AsyncDarajaTransport()
+    return transport
@@ -1,36 +1,51 @@
+from django.conf import settings
 from django.urls import path
 
+from daraja import async_views as daraja_async_views
 from daraja import views as daraja_views
 
+if settings.DARAJA_ASYNC_VIEWS:
+    initiate_stkpush_view = daraja_async_views.initiate_stk_push
+    stkpush_callback_view = daraja_async_views.stk_push_callback
+    register_urls_view = daraja_async_views.register_c2b_urls
+    validation_url_view = daraja_async_views.c2b_validation
+    confirmation_url_view = daraja_async_views.c2b_confirmation
+else:
+    initiate_stkpush_view = daraja_views.InitiateStkPushView.as_view()
+    stkpush_callback_view = daraja_views.MpesaStkPushCallbackView.as_view()
+    register_urls_view = daraja_views.MpesaRegisterUrlView.as_view()
+    validation_url_view = daraja_views.MpesaValidationUrlView.as_view()
+    confirmation_url_view = daraja_views.MpesaConfirmationUrlView.as_view()
+
 urlpatterns = [
     path(
         'initiate-stkpush/<int:account_number>/',
-        daraja_views.InitiateStkPushView.as_view(),
+        initiate_stkpush_view,
         name='daraja-initiate-stkpush'
     ),
     path(
         "stkpush/<int:account_number>/callback",
-        daraja_views.MpesaStkPushCallbackView.as_view(),
+        stkpush_callback_view,
         name="transaction-stkpush-callback",
     ),
     path(
         "stkpush/<int:account_number>/query-status",
-        daraja_views.MpesaStkPushCallbackView.as_view(),
+        stkpush_callback_view,
         name="transaction-stkpush-query-status",
     ),
     path(
         'c2b-register-urls',
-        daraja_views.MpesaRegisterUrlView.as_view(),
+        register_urls_view,
         name='c2b-register-urls'
     ),
     path(
         'c2b-validation-url',
-        daraja_views.MpesaValidationUrlView.as_view(),
+        validation_url_view,
         name='c2b-validation-url'
     ),
     path(
         'c2b-confirmation-url',
-        daraja_views.MpesaConfirmationUrlView.as_view(),
+        confirmation_url_view,
         name='c2b-confirmation-url'
     ),
 ]
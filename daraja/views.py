@@ -1,43 +1,39 @@
 import logging
-import time
-from threading import Thread
+from functools import partial
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError
 from django.db import transaction as db_transaction
 from django.db.models import F
 from django.urls import reverse
-from django.utils.crypto import get_random_string
+from django.utils import timezone
 
 from rest_framework import status, views
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from daraja.completion import stk_push_completion
 from daraja.facade import MpesaTransaction
 from daraja.serializers import StkPushSerializer
+from payments.ids import get_id_allocator
+from payments.logwriter import transaction_log_writer
+from payments.registry import payment_method_registry
+from payments.signals import send_transactions_updated
 from payments.utils import PaymentProcessor
 from utils.core import validate_phone_number
 from utils.loading import get_model
+from utils.metrics import CALLBACK_SECONDS, DUPLICATE_CALLBACKS, observe, observed
 
 PaymentMethod = get_model("payments", "PaymentMethod")
+PaymentReceipt = get_model("payments", "PaymentReceipt")
 Transaction = get_model("payments", "Transaction")
-TransactionLog = get_model("payments", "TransactionLog")
 
 logger = logging.getLogger(__name__)
 
 
 def generate_account_number():
-    seed = "".join(str(x) for x in range(10))
-    while True:
-        account_number = get_random_string(6, seed)
-        try:
-            Transaction.objects.get(account_number=account_number)
-            logger.warning(
-                "{} not unique account number generated".format(account_number)
-            )
-        except ObjectDoesNotExist:
-            break
-    return account_number
+    return get_id_allocator().account_number()
 
 
 def get_transaction_payload(amount, method, number=None):
@@ -80,12 +76,37 @@ def get_data_from_mpesa_items(items):
     return results
 
 
-def update_transaction_details(account_number, payload):
+def record_payment_receipt(source, reference, **kwargs):
+    """
+    claims a callback for processing. Must run inside a db transaction so the claim
+    is dropped if applying the callback fails
+    Args:
+        source: PaymentReceipt.STKPUSH or PaymentReceipt.C2B
+        reference: CheckoutRequestID or TransID identifying the callback
+
+    Returns:
+        - False if the callback, or another one with the same mpesa receipt
+          number, has already been applied
+    """
+    if not reference:
+        return True
     try:
-        transaction = Transaction.objects.get(account_number=account_number)
-    except ObjectDoesNotExist:
-        return False, "Invalid Transaction"
+        with db_transaction.atomic():
+            PaymentReceipt.objects.create(source=source, reference=reference, **kwargs)
+    except IntegrityError:
+        # a payment sent both as an stk callback and a c2b confirmation shares
+        # its receipt number
+        logger.warning(
+            "{} {} (receipt {}) already applied".format(
+                source, reference, kwargs.get("receipt_number")
+            )
+        )
+        DUPLICATE_CALLBACKS.labels(source=source).inc()
+        return False
+    return True
+
 
+def update_transaction_details(account_number, payload):
     callback_body = payload["Body"]
     stkcallbackdata = callback_body["stkCallback"]
 
@@ -107,32 +128,63 @@ def update_transaction_details(account_number, payload):
         provider_ref = ""
         error_msg = stkcallbackdata["ResultDesc"] if stkcallbackdata else ""
 
-    # if transaction_success and settings.SERVER != "production":
-    #     try:
-    #         order = Order.objects.get(number=transaction.order_number)
-    #         paid_amount = int(order.total_incl_tax)
-    #     except ObjectDoesNotExist:
-    #         pass
-
-    transaction.status = pay_status
-    transaction.provider_reference = provider_ref
-    transaction.error_message = error_msg
-    transaction.amount_paid += paid_amount
-    transaction.last_payment = paid_amount
-    transaction.save(
-        update_fields=[
-            "amount_paid",
-            "status",
-            "provider_reference",
-            "error_message",
-            "last_payment",
-        ]
-    )
-    return True, transaction
+    with db_transaction.atomic():
+        transaction_id = (
+            Transaction.objects.filter(account_number=account_number)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if transaction_id is None:
+            return False, "Invalid Transaction"
+
+        # only a transaction still waiting for its stk push can be completed by it
+        updated = Transaction.objects.filter(
+            pk=transaction_id,
+            status__in=[Transaction.INITIATED, Transaction.PENDING],
+        ).update(
+            status=pay_status,
+            provider_reference=provider_ref,
+            error_message=error_msg,
+            amount_paid=F("amount_paid") + paid_amount,
+            last_payment=paid_amount,
+            last_edited=timezone.now(),
+        )
+        checkout_request_id = stkcallbackdata.get("CheckoutRequestID")
+        if not updated:
+            if PaymentReceipt.objects.filter(
+                source=PaymentReceipt.STKPUSH, reference=checkout_request_id
+            ).exists():
+                logger.warning(
+                    "{} {} already applied".format(
+                        PaymentReceipt.STKPUSH, checkout_request_id
+                    )
+                )
+                DUPLICATE_CALLBACKS.labels(source=PaymentReceipt.STKPUSH).inc()
+            else:
+                # left unclaimed so it can be looked into and replayed
+                logger.warning(
+                    "stk push callback {} ({}) not applied, transaction {} is no "
+                    "longer Initiated or Pending".format(
+                        checkout_request_id, pay_status, transaction_id
+                    )
+                )
+            return True, transaction_id
+
+        if not record_payment_receipt(
+            PaymentReceipt.STKPUSH,
+            checkout_request_id,
+            receipt_number=provider_ref or None,
+            amount=paid_amount,
+            transaction_id=transaction_id,
+        ):
+            db_transaction.set_rollback(True)
+            return True, transaction_id
+        send_transactions_updated(Transaction, [transaction_id])
+    return True, transaction_id
 
 
 def create_transaction_instance(**kwargs):
-    method = PaymentMethod.objects.filter(type=PaymentMethod.MOBILE, islog=True).first()
+    method = payment_method_registry.first(type=PaymentMethod.MOBILE, islog=True)
     data = get_transaction_payload(amount=kwargs["amount"], method=method)
     with db_transaction.atomic():
         transaction = PaymentProcessor.create_transaction_model(
@@ -141,6 +193,313 @@ def create_transaction_instance(**kwargs):
     return transaction
 
 
+def get_stk_push_status_url(account_number):
+    query_url = reverse(
+        "transaction-stkpush-query-status",
+        kwargs={"account_number": account_number},
+    )
+    return settings.API_HOST_NAME + query_url
+
+
+def prepare_stk_push(account_number, payload):
+    """
+    validates the payload and builds the transaction and stk push data
+    Args:
+        account_number: account the customer is paying for
+        payload: request data with amount, phone_number and description
+
+    Returns:
+        - ((transaction, stk_data), None) with the transaction not yet saved
+        - (None, (data, status_code)) if the payload is invalid
+    """
+    serializer = StkPushSerializer(data=payload, many=False)
+    if not serializer.is_valid():
+        return None, (serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    payment_category = "Checkout"
+    try:
+        payment_method = payment_method_registry.get("101MX")
+    except Exception as e:
+        logger.error(e)
+        return None, (
+            {"detail": "Invalid payment method. Kindly load payment method data"},
+            status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+
+    pay_amount = data["amount"]
+    narration = f"Payment for  a transaction {account_number}"
+    phone_number = data["phone_number"]
+    # create an instance of Transaction
+    transaction_payload = {
+        "account_number": account_number,
+        "provider": "702",
+        "phone_number": phone_number,
+        "currency": "KES",
+        "country": "KE",
+        "method": payment_method,
+        "narration": narration,
+        "amount": round(float(pay_amount)),
+        "transaction_is_log": False,
+        "payment_category": payment_category,
+    }
+    logger.info(transaction_payload)
+    transaction = Transaction(**transaction_payload)
+
+    # build callback url
+    base_url = settings.API_HOST_NAME
+    transaction_url = reverse(
+        "transaction-stkpush-callback",
+        kwargs={"account_number": account_number},
+    )
+    callback_url = base_url + transaction_url
+
+    logger.info(callback_url)
+
+    accountref = account_number
+    desc = data.get("description") or narration
+    stk_data = {
+        "callbackurl": callback_url,
+        "accountref": accountref,
+        "transaction_desc": desc,
+        "amount": pay_amount,
+        "phone_number": phone_number[1:],
+    }
+    return (transaction, stk_data), None
+
+
+def save_stk_push_response(transaction, mpesa_request):
+    """
+    records the safaricom ids of an accepted stk push
+    Returns:
+        - None if safaricom accepted the stk push
+        - (data, status_code) if it was rejected
+    """
+    response_data = mpesa_request.json()
+    logger.info(response_data)
+    if mpesa_request.status_code != 200:
+        return (
+            {"message": "Failed to initiate stk push. Try again later"},
+            status.HTTP_400_BAD_REQUEST,
+        )
+    transaction.merchant_id = response_data["MerchantRequestID"]
+    transaction.checkout_request_id = response_data["CheckoutRequestID"]
+    transaction.save(update_fields=["merchant_id", "checkout_request_id"])
+    return None
+
+
+def start_stk_push(account_number, payload):
+    """
+    validates the payload, creates a transaction and sends the stk push
+    Args:
+        account_number: account the customer is paying for
+        payload: request data with amount, phone_number and description
+
+    Returns:
+        - (transaction, None) once safaricom has accepted the stk push
+        - (None, (data, status_code)) if the stk push could not be started
+    """
+    prepared, error = prepare_stk_push(account_number, payload)
+    if error is not None:
+        return None, error
+
+    transaction, stk_data = prepared
+    with db_transaction.atomic():
+        transaction.save()
+        mpesa_transaction = MpesaTransaction()
+        mpesa_request = mpesa_transaction.lipa_na_mpesa_online(**stk_data)
+        error = save_stk_push_response(transaction, mpesa_request)
+        if error is not None:
+            db_transaction.set_rollback(True)
+            return None, error
+    return transaction, None
+
+
+def stk_push_completed(transaction):
+    transaction.refresh_from_db(fields=["status"])
+    return transaction.status != Transaction.INITIATED
+
+
+def build_stk_push_result(transaction, mpesa_request=None):
+    """
+    builds the initiate stk push response once the wait for the callback is over
+    Args:
+        transaction: transaction returned by start_stk_push, freshly loaded
+        mpesa_request: safaricom status query response if the transaction is not
+            successful
+
+    Returns:
+        - (data, status_code)
+    """
+    status_url = get_stk_push_status_url(transaction.account_number)
+    if transaction.status not in ["Successful"]:
+        # check status from safaricom
+        response = mpesa_request.json()
+        logger.info(response)
+        if mpesa_request.status_code != 200:
+            error_msg = response["errorMessage"]
+            status_code = 400
+        else:
+            error_msg = response["ResultDesc"]
+            status_code = response["ResultCode"]
+
+        data = {
+            "status": status_code,
+            "message": error_msg,
+            "query_status_url": status_url,
+        }
+        return data, status.HTTP_200_OK
+    data = {
+        "status": 200,
+        "message": "Transaction successful",
+        "query_status_url": status_url,
+        "amount_paid": transaction.amount_paid,
+    }
+    return data, status.HTTP_200_OK
+
+
+def get_stk_push_result(transaction):
+    transaction.refresh_from_db()
+    mpesa_request = None
+    if transaction.status not in ["Successful"]:
+        mpesa_transaction = MpesaTransaction()
+        mpesa_request = mpesa_transaction.query_mpesa_express_transaction_status(
+            transaction.checkout_request_id
+        )
+    return build_stk_push_result(transaction, mpesa_request)
+
+
+def handle_stk_push_callback(account_number, payload):
+    """
+    applies an stk push callback and wakes whoever is waiting on the transaction
+    Returns:
+        - response data for safaricom
+    """
+    with observe(CALLBACK_SECONDS, callback="stkpush") as outcome:
+        logger.info(payload)
+        transaction_log_writer.write(payload, account_number=account_number)
+
+        updated, resp = update_transaction_details(account_number, payload)
+        if not updated:
+            outcome["outcome"] = "rejected"
+            return resp
+        # wake any InitiateStkPushView waiting on this transaction
+        db_transaction.on_commit(partial(stk_push_completion.notify, account_number))
+        return "Safaricom: The better option"
+
+
+def get_stk_push_status(account_number):
+    """
+    status of an stk push from our records
+    Returns:
+        - (transaction, data) where data is None if safaricom has to be queried
+        - (None, data) if the transaction does not exist
+    """
+    try:
+        transaction = Transaction.objects.get(account_number=account_number)
+    except ObjectDoesNotExist:
+        return None, {"message": "Invalid Transaction", "amount": 0}
+
+    if transaction.status in ["Successful"]:
+        return transaction, {
+            "message": "Transaction successful",
+            "amount": transaction.amount_paid,
+        }
+
+    elif transaction.status not in ["Initiated"]:
+        error_msg = transaction.error_message or "Transaction Failed!!"
+        return transaction, {"message": error_msg, "amount": transaction.amount_paid}
+    return transaction, None
+
+
+def build_stk_push_status(transaction, mpesa_request):
+    response = mpesa_request.json()
+    logger.info(response)
+    if mpesa_request.status_code != 200:
+        return {"message": response["errorMessage"], "amount": 0}
+    msg = response["ResultDesc"]
+    return {"message": msg, "amount": transaction.amount_paid}
+
+
+def get_c2b_urls():
+    """
+    Returns:
+        - (confirmation_url, validation_url) to register with safaricom
+    """
+    server_url = settings.API_HOST_NAME
+    validation_url = server_url + reverse("c2b-validation-url")
+    confirmation_url = server_url + reverse("c2b-confirmation-url")
+    return confirmation_url, validation_url
+
+
+@observed(CALLBACK_SECONDS, callback="c2b_validation")
+def validate_c2b_payment(payload):
+    logger.info(payload)
+    # create a transaction against the account number (account number)
+    # check if transaction exists else create
+    bill_ref = payload.get("BillRefNumber")
+    amount_paid = payload.get("TransAmount")
+    txn_q = Transaction.objects.filter(account_number=bill_ref)
+    if not txn_q.exists():
+        data = {"account_number": bill_ref, "amount": amount_paid}
+        create_transaction_instance(**data)
+
+    return {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+
+@observed(CALLBACK_SECONDS, callback="c2b_confirmation")
+def confirm_c2b_payment(payload):
+    logger.info(payload)
+    transaction_log_writer.write(payload)
+
+    bill_ref = payload.get("BillRefNumber")
+    amount_paid = int(float(payload.get("TransAmount")))
+    trans_id = payload.get("TransID", "")
+
+    # get phone number from logs
+    phone_number = payload.get("MSISDN", "")
+    phone_number = validate_phone_number(phone_number)
+    if not bool(phone_number):
+        phone_number = ""
+
+    with db_transaction.atomic():
+        transaction_id = (
+            Transaction.objects.filter(account_number=bill_ref)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if transaction_id is None:
+            data = {"account_number": bill_ref, "amount": amount_paid}
+            try:
+                transaction_id = create_transaction_instance(**data).id
+            except IntegrityError:
+                # created by a concurrent callback for the same account
+                transaction_id = Transaction.objects.get(account_number=bill_ref).id
+
+        if not record_payment_receipt(
+            PaymentReceipt.C2B,
+            trans_id,
+            receipt_number=trans_id or None,
+            amount=amount_paid,
+            transaction_id=transaction_id,
+        ):
+            return {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+        # update transaction model.
+        Transaction.objects.filter(pk=transaction_id).update(
+            amount_paid=F("amount_paid") + amount_paid,
+            last_payment=amount_paid,
+            status=Transaction.SUCCESSFUL,
+            phone_number=phone_number,
+            first_name=payload.get("FirstName", ""),
+            provider_reference=trans_id,
+            last_edited=timezone.now(),
+        )
+        send_transactions_updated(Transaction, [transaction_id])
+
+    return {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+
 class InitiateStkPushView(views.APIView):
     def post(self, request, account_number, format=None):
         """
@@ -152,138 +511,19 @@ class InitiateStkPushView(views.APIView):
             200: if success
             400: in case of error or fails
         """
-        payload = request.data
-        serializer = StkPushSerializer(data=payload, many=False)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        data = serializer.validated_data
-        payment_category = "Checkout"
-        try:
-            payment_method = PaymentMethod.objects.get(code="101MX")
-        except Exception as e:
-            logger.error(e)
-            return Response(
-                {"detail": "Invalid payment method. Kindly load payment method data"},
-                status=status.HTTP_405_METHOD_NOT_ALLOWED,
-            )
-
-        pay_amount = data["amount"]
-        narration = f"Payment for  a transaction {account_number}"
-        phone_number = data["phone_number"]
-        # create an instance of Transaction
-        transaction_payload = {
-            "account_number": account_number,
-            "provider": "702",
-            "phone_number": phone_number,
-            "currency": "KES",
-            "country": "KE",
-            "method": payment_method,
-            "narration": narration,
-            "amount": round(float(pay_amount)),
-            "transaction_is_log": False,
-            "payment_category": payment_category,
-        }
-        with db_transaction.atomic():
-            logger.info(transaction_payload)
-            transaction = Transaction(**transaction_payload)
-            transaction.save()
-
-            # build callback url
-            base_url = settings.API_HOST_NAME
-            transaction_url = reverse(
-                "transaction-stkpush-callback",
-                kwargs={"account_number": account_number},
-            )
-            callback_url = base_url + transaction_url
+        transaction, error = start_stk_push(account_number, request.data)
+        if error is not None:
+            data, status_code = error
+            return Response(data, status=status_code)
+
+        # wait for the stk callback to complete the transaction. The callback view
+        # wakes us up, otherwise give up after DARAJA_STKPUSH_COMPLETION_TIMEOUT
+        stk_push_completion.wait(
+            account_number, partial(stk_push_completed, transaction)
+        )
 
-            logger.info(callback_url)
-
-            query_url = reverse(
-                "transaction-stkpush-query-status",
-                kwargs={"account_number": account_number},
-            )
-            status_url = base_url + query_url
-
-            accountref = account_number
-            desc = data.get("description") or narration
-            stk_data = {
-                "callbackurl": callback_url,
-                "accountref": accountref,
-                "transaction_desc": desc,
-                "amount": pay_amount,
-                "phone_number": phone_number[1:],
-            }
-            mpesa_transaction = MpesaTransaction()
-            mpesa_request = mpesa_transaction.lipa_na_mpesa_online(**stk_data)
-            response_data = mpesa_request.json()
-            print(response_data)
-            logger.info(response_data)
-            if mpesa_request.status_code != 200:
-                db_transaction.set_rollback(True)
-                return Response(
-                    {"message": "Failed to initiate stk push. Try again later"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            transaction.merchant_id = response_data["MerchantRequestID"]
-            transaction.checkout_request_id = response_data["CheckoutRequestID"]
-            transaction.save(update_fields=["merchant_id", "checkout_request_id"])
-
-        # wait for mpesa transactions to happen and return appropriate response
-        # max wait is 90 sec with 10 loops. Then return a failed response
-        def await_transaction(await_period):
-            while await_period < 20:
-                time.sleep(await_period)
-                transaction.refresh_from_db()
-                if transaction.status in ["Successful"]:
-                    break
-                elif transaction.status not in ["Initiated"]:
-                    break
-                else:
-                    await_period += 2
-            return
-
-        async_wait = Thread(target=await_transaction, args=(2,))
-        async_wait.start()
-        async_wait.join()
-
-        transaction.refresh_from_db()
-        if transaction.status not in ["Successful"]:
-            # check status from safaricom
-            checkout_request_id = transaction.checkout_request_id
-            mpesa_request = mpesa_transaction.query_mpesa_express_transaction_status(
-                checkout_request_id
-            )
-            response = mpesa_request.json()
-            logger.info(response)
-            if mpesa_request.status_code != 200:
-                error_msg = response["errorMessage"]
-                status_code = 400
-            else:
-                error_msg = response["ResultDesc"]
-                status_code = response["ResultCode"]
-                # if status_code == 0:
-                #     # process payments
-                #     transaction.amount_paid = transaction.amount
-                #     transaction.last_payment = transaction.amount
-                #     transaction.status = Transaction.SUCCESSFUL
-                #     transaction.save(
-                #         update_fields=['last_payment', 'amount_paid', 'status'])
-
-            return Response(
-                {
-                    "status": status_code,
-                    "message": error_msg,
-                    "query_status_url": status_url,
-                }
-            )
-        resp = {
-            "status": 200,
-            "message": "Transaction successful",
-            "query_status_url": status_url,
-            "amount_paid": transaction.amount_paid,
-        }
-        return Response(resp)
+        data, status_code = get_stk_push_result(transaction)
+        return Response(data, status=status_code)
 
 
 class MpesaStkPushCallbackView(views.APIView):
@@ -348,15 +588,8 @@ class MpesaStkPushCallbackView(views.APIView):
         Returns:
 
         """
-        payload = request.data
-        logger.info(payload)
-        log = TransactionLog(json_data=payload)
-        log.save()
-
-        updated, resp = update_transaction_details(account_number, payload)
-        if not updated:
-            return Response(resp)
-        return Response("Safaricom: The better option")
+        data = handle_stk_push_callback(account_number, request.data)
+        return Response(data)
 
     def get(self, request, account_number, *args, **kwargs):
         """
@@ -367,47 +600,14 @@ class MpesaStkPushCallbackView(views.APIView):
         Returns:
 
         """
-        try:
-            transaction = Transaction.objects.get(account_number=account_number)
-        except ObjectDoesNotExist:
-            return Response(
-                {"message": "Invalid Transaction", "amount": 0},
-                status=status.HTTP_200_OK,
-            )
-
-        if transaction.status in ["Successful"]:
-            return Response(
-                {
-                    "message": "Transaction successful",
-                    "amount": transaction.amount_paid,
-                },
-                status=status.HTTP_200_OK,
-            )
-
-        elif transaction.status not in ["Initiated"]:
-            error_msg = transaction.error_message or "Transaction Failed!!"
-            return Response(
-                {"message": error_msg, "amount": transaction.amount_paid},
-                status=status.HTTP_200_OK,
-            )
-        else:
+        transaction, data = get_stk_push_status(account_number)
+        if data is None:
             mpesa_transaction = MpesaTransaction()
-            checkout_request_id = transaction.checkout_request_id
             mpesa_request = mpesa_transaction.query_mpesa_express_transaction_status(
-                checkout_request_id
-            )
-            response = mpesa_request.json()
-            logger.info(response)
-            if mpesa_request.status_code != 200:
-                return Response(
-                    {"message": response["errorMessage"], "amount": 0},
-                    status=status.HTTP_200_OK,
-                )
-            msg = response["ResultDesc"]
-            return Response(
-                {"message": msg, "amount": transaction.amount_paid},
-                status=status.HTTP_200_OK,
+                transaction.checkout_request_id
             )
+            data = build_stk_push_status(transaction, mpesa_request)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class MpesaRegisterUrlView(views.APIView):
@@ -419,9 +619,7 @@ class MpesaRegisterUrlView(views.APIView):
 
     def post(self, request, *args, **kwargs):
         # _payload = request.data
-        server_url = settings.API_HOST_NAME
-        validation_url = server_url + reverse("c2b-validation-url")
-        confirmation_url = server_url + reverse("c2b-confirmation-url")
+        confirmation_url, validation_url = get_c2b_urls()
         mpesa_transaction = MpesaTransaction()
         mpesa_request = mpesa_transaction.register_c2b_urls(
             confirmation_url, validation_url
@@ -439,18 +637,7 @@ class MpesaValidationUrlView(views.APIView):
     permission_classes = (AllowAny,)
 
     def post(self, request, *args, **kwargs):
-        payload = request.data
-        logger.info(payload)
-        # create a transaction against the account number (account number)
-        # check if transaction exists else create
-        bill_ref = payload.get("BillRefNumber")
-        amount_paid = payload.get("TransAmount")
-        txn_q = Transaction.objects.filter(account_number=bill_ref)
-        if not txn_q.exists():
-            data = {"account_number": bill_ref, "amount": amount_paid}
-            create_transaction_instance(**data)
-
-        context = {"ResultCode": 0, "ResultDesc": "Accepted"}
+        context = validate_c2b_payment(request.data)
         return Response(context)
 
 
@@ -478,33 +665,5 @@ class MpesaConfirmationUrlView(views.APIView):
     permission_classes = (AllowAny,)
 
     def post(self, request, *args, **kwargs):
-        payload = request.data
-        logger.info(payload)
-        log = TransactionLog(json_data=payload)
-        log.save()
-
-        bill_ref = payload.get("BillRefNumber")
-        amount_paid = int(float(payload.get("TransAmount")))
-        try:
-            transaction = Transaction.objects.get(account_number=bill_ref)
-        except ObjectDoesNotExist:
-            data = {"account_number": bill_ref, "amount": amount_paid}
-            transaction = create_transaction_instance(**data)
-
-        # get phone number from logs
-        phone_number = payload.get("MSISDN", "")
-        phone_number = validate_phone_number(phone_number)
-        if not bool(phone_number):
-            phone_number = ""
-
-        # update transaction model.
-        transaction.amount_paid += amount_paid
-        transaction.last_payment = amount_paid
-        transaction.status = Transaction.SUCCESSFUL
-        transaction.phone_number = phone_number
-        transaction.first_name = payload.get("FirstName", "")
-        transaction.provider_reference = payload.get("TransID", "")
-        transaction.save()
-
-        context = {"ResultCode": 0, "ResultDesc": "Accepted"}
+        context = confirm_c2b_payment(request.data)
         return Response(context)
@@ -0,0 +1,22 @@
+import os
+import shutil
+import tempfile
+
+# every worker writes its prometheus metrics to files in this directory and
+# /metrics adds them up, see utils.metrics. Set before the app is imported
+prometheus_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "payments-prometheus"),
+)
+
+
+def on_starting(server):
+    # counters left by the last run would be added to this one
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
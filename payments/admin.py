@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from payments.models import PaymentMethod, Transaction
+from payments.models import PaymentMethod, PaymentReceipt, Transaction
 
 # Register your models here.
 
@@ -15,3 +15,9 @@ class PaymentMethodAdmin(admin.ModelAdmin):
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ("account_number", "status", "provider_reference",
                     "transaction_ref", "date_created")
+
+
+@admin.register(PaymentReceipt)
+class PaymentReceiptAdmin(admin.ModelAdmin):
+    list_display = ("reference", "source", "receipt_number", "amount",
+                    "transaction", "date_created")
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        # connect the PaymentMethod and Transaction change receivers
+        import payments.registry  # noqa: F401
+        import payments.rollups  # noqa: F401
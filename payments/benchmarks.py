@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+from utils.core import validate_phone_number
+from utils.loading import get_model
+from utils.stats import summarize
+
+PaymentMethod = get_model("payments", "PaymentMethod")
+Transaction = get_model("payments", "Transaction")
+
+BENCHMARK_NARRATION = "hot path benchmark"
+BENCHMARK_PASS_KEY = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
+BENCHMARK_SHORT_CODE = "174379"
+PHONE_FORMATS = ("07{:08d}", "2547{:08d}", "+2547{:08d}")
+
+# shortest timed sample and most calls batched into one
+MIN_SAMPLE_TIME = 0.0002
+MAX_BATCH = 1000
+
+# prepare(i) builds the arguments of one call outside the timing, run(*args) is
+# the call that is timed
+Benchmark = namedtuple("Benchmark", "name prepare run")
+
+
+def stk_callback(checkout_request_id, amount, receipt_number):
+    return {
+        "Body": {
+            "stkCallback": {
+                "MerchantRequestID": "bench-{}".format(checkout_request_id),
+                "CheckoutRequestID": checkout_request_id,
+                "ResultCode": 0,
+                "ResultDesc": "The service request is processed successfully.",
+                "CallbackMetadata": {
+                    "Item": [
+                        {"Name": "Amount", "Value": amount},
+                        {"Name": "MpesaReceiptNumber", "Value": receipt_number},
+                        {"Name": "Balance"},
+                        {"Name": "TransactionDate", "Value": 20220420003234},
+                        {"Name": "PhoneNumber", "Value": 254720600705},
+                    ]
+                },
+            }
+        }
+    }
+
+
+def get_benchmarks(run_id):
+    """
+    the functions every stk push, callback or transaction read goes through.
+    The ones touching the db write rows tagged with BENCHMARK_NARRATION, run
+    them inside a transaction that is rolled back
+    Args:
+        run_id: keeps the account numbers of separate runs apart
+
+    Returns:
+        - list of Benchmark
+    """
+    # imported here so the payments app does not load the daraja views on start
+    from daraja.facade import MpesaTransaction
+    from daraja.serializers import StkPushSerializer
+    from daraja.views import get_data_from_mpesa_items, update_transaction_details
+    from payments.serializers import TransactionSerializer
+
+    mpesa_transaction = MpesaTransaction()
+    # the daraja configs may not be set where the benchmark runs
+    mpesa_transaction.business_short_code = BENCHMARK_SHORT_CODE
+    mpesa_transaction.vault.DARAJA_PASS_KEY = BENCHMARK_PASS_KEY
+    method = PaymentMethod.objects.first()
+    callback_items = stk_callback("ws_CO_bench", 1, "QDK8NK9HV8")["Body"][
+        "stkCallback"
+    ]["CallbackMetadata"]["Item"]
+
+    def new_transaction(i, save=True):
+        transaction = Transaction(
+            account_number="bench{}-{}".format(run_id, i),
+            phone_number="+254720600705",
+            provider=Transaction.MPESA,
+            method=method,
+            narration=BENCHMARK_NARRATION,
+            amount=100,
+            transaction_is_log=False,
+        )
+        if save:
+            transaction.save()
+        return transaction
+
+    def prepare_callback(i):
+        transaction = new_transaction("cb{}".format(i))
+        checkout_request_id = "ws_CO_bench_{}_{}".format(run_id, i)
+        receipt_number = "BN{:08d}".format(i)
+        return (
+            transaction.account_number,
+            stk_callback(checkout_request_id, 100, receipt_number),
+        )
+
+    def prepare_rendered(i):
+        transaction = new_transaction("ser{}".format(i))
+        return (Transaction.objects.select_related("method").get(pk=transaction.pk),)
+
+    return [
+        Benchmark("get_password", lambda i: (), mpesa_transaction.get_password),
+        Benchmark(
+            "get_stk_push_payload",
+            lambda i: (100, "254720600705", "https://example.com/callback", i),
+            mpesa_transaction.get_stk_push_payload,
+        ),
+        Benchmark(
+            "get_data_from_mpesa_items",
+            lambda i: (callback_items,),
+            get_data_from_mpesa_items,
+        ),
+        Benchmark(
+            "validate_phone_number",
+            # a new number every call, the lru cache would hide the work otherwise
+            lambda i: (PHONE_FORMATS[i % 3].format(i),),
+            validate_phone_number,
+        ),
+        Benchmark(
+            "stk_push_serializer",
+            lambda i: ({"amount": 100, "phone_number": "07{:08d}".format(i)},),
+            lambda data: StkPushSerializer(data=data).is_valid(),
+        ),
+        Benchmark(
+            "transaction_serializer",
+            prepare_rendered,
+            lambda transaction: TransactionSerializer(transaction).data,
+        ),
+        Benchmark(
+            "transaction_save",
+            lambda i: (new_transaction("save{}".format(i), save=False),),
+            lambda transaction: transaction.save(),
+        ),
+        Benchmark(
+            "update_transaction_details", prepare_callback, update_transaction_details
+        ),
+    ]
+
+
+def measure(benchmark, iterations, warmup=0):
+    """
+    time `iterations` samples after `warmup` untimed calls. Fast functions are
+    called in batches so each sample takes at least MIN_SAMPLE_TIME, the timer
+    itself would be most of a single call otherwise
+    Returns:
+        - utils.stats summary of the time per call
+    """
+    index = 0
+    started = time.perf_counter()
+    for index in range(warmup):
+        benchmark.run(*benchmark.prepare(index))
+    per_call = (time.perf_counter() - started) / max(warmup, 1)
+    number = max(min(int(MIN_SAMPLE_TIME / max(per_call, 1e-9)), MAX_BATCH), 1)
+
+    durations = []
+    index = warmup
+    for _ in range(iterations):
+        batch = [benchmark.prepare(i) for i in range(index, index + number)]
+        index += number
+        started = time.perf_counter()
+        for args in batch:
+            benchmark.run(*args)
+        durations.append((time.perf_counter() - started) / number)
+    return summarize(durations)
+
+
+def load_baseline(path):
+    """
+    Returns:
+        - {name: summary} saved by save_baseline, {} if there is none
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as baseline:
+        json.dump(results, baseline, indent=2, sort_keys=True)
+        baseline.write("\n")
+
+
+def find_regressions(results, baseline, max_slowdown):
+    """
+    Args:
+        results: {name: summary} of this run
+        baseline: {name: summary} to compare with
+        max_slowdown: allowed ratio of the p50 to the baseline p50
+
+    Returns:
+        - list of (name, p50 ms, baseline p50 ms) slower than allowed
+    """
+    regressions = []
+    for name, stats in results.items():
+        expected = baseline.get(name, {}).get("p50")
+        if expected and stats["p50"] > expected * max_slowdown:
+            regressions.append((name, stats["p50"], expected))
+    return regressions
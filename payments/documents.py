@@ -30,6 +30,9 @@ class TransactionDocument(Document):
         }
     )
     type = fields.TextField(attr="provider_to_string")
+    # raw is matched exactly by the transaction detail lookup, indices built before
+    # it was added need a reindex_transactions --full
+    account_number = fields.TextField(fields={"raw": fields.KeywordField()})
 
     class Index:
         # Name of the Elasticsearch index (must be in small letters)
@@ -44,7 +47,6 @@ class TransactionDocument(Document):
         fields = [
             "id",
             "provider",
-            "account_number",
             "phone_number",
             "transaction_ref",
             "currency",
@@ -76,3 +78,7 @@ class TransactionDocument(Document):
         # Paginate the django queryset used to populate the index with the specified size
         # (by default it uses the database driver's default setting)
         # queryset_pagination = 5000
+
+    def get_queryset(self):
+        # method is indexed as a nested object, fetch it in the same query
+        return super(TransactionDocument, self).get_queryset().select_related("method")
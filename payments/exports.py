@@ -0,0 +1,185 @@
+import csv
+import json
+import threading
+import zlib
+from datetime import datetime, time
+from queue import Empty, Full, Queue
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from utils.loading import get_model
+
+Transaction = get_model("payments", "Transaction")
+
+CSV, NDJSON = "csv", "ndjson"
+EXPORT_FORMATS = (CSV, NDJSON)
+CONTENT_TYPES = {CSV: "text/csv", NDJSON: "application/x-ndjson"}
+
+# (column, queryset field)
+EXPORT_COLUMNS = (
+    ("id", "id"),
+    ("account_number", "account_number"),
+    ("transaction_ref", "transaction_ref"),
+    ("provider", "provider"),
+    ("method", "method__code"),
+    ("phone_number", "phone_number"),
+    ("status", "status"),
+    ("amount", "amount"),
+    ("amount_paid", "amount_paid"),
+    ("currency", "currency"),
+    ("provider_reference", "provider_reference"),
+    ("checkout_request_id", "checkout_request_id"),
+    ("payment_category", "payment_category"),
+    ("narration", "narration"),
+    ("error_message", "error_message"),
+    ("date_created", "date_created"),
+    ("last_edited", "last_edited"),
+)
+# rows fetched per round trip to the db
+EXPORT_CHUNK_SIZE = 2000
+# encoded output is handed on in pieces of about this many characters
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+
+def parse_export_date(value):
+    """
+    Returns:
+        - aware datetime for an ISO date or datetime string, None if invalid
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def get_export_queryset(date_from=None, date_to=None, statuses=None, providers=None):
+    """
+    transactions created in [date_from, date_to) as tuples in EXPORT_COLUMNS order
+    """
+    queryset = Transaction.objects.all()
+    if date_from is not None:
+        queryset = queryset.filter(date_created__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date_created__lt=date_to)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if providers:
+        queryset = queryset.filter(provider__in=providers)
+    fields = [field for _, field in EXPORT_COLUMNS]
+    return queryset.order_by("id").values_list(*fields)
+
+
+class _Echo(object):
+    # csv.writer target that hands back what it is given
+    def write(self, value):
+        return value
+
+
+def _buffered(lines):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([column for column, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    columns = [column for column, _ in EXPORT_COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(queryset, export_format=CSV, compress=False):
+    """
+    encode an export queryset without holding more than a chunk of it in memory
+    Yields:
+        - bytes
+    """
+    rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    lines = iter_ndjson(rows) if export_format == NDJSON else iter_csv(rows)
+    chunks = (text.encode("utf-8") for text in _buffered(lines))
+    if compress:
+        chunks = iter_gzip(chunks)
+    return chunks
+
+
+def iter_in_thread(chunks, max_pending=8):
+    """
+    run a chunk generator that reads from the db in its own thread.
+
+    Under core.asgi django iterates streaming responses on the event loop, where
+    the ORM can not be used. The producer stays at most max_pending chunks ahead
+    and stops when the response is closed
+    """
+    queue = Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if stopped.is_set():
+                    return
+                put(chunk)
+        except Exception as e:
+            put(e)
+        finally:
+            connection.close()
+            put(done)
+
+    producer = threading.Thread(target=produce, name="export", daemon=True)
+    producer.start()
+    try:
+        while True:
+            try:
+                item = queue.get(timeout=1)
+            except Empty:
+                if not producer.is_alive():
+                    return
+                continue
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils.module_loading import import_string
+
+from utils.loading import get_model
+
+# crockford base32, no I, L, O or U so refs are easy to read out over the phone
+REF_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ACCOUNT_NUMBER_SEQUENCE = "account_number"
+
+
+def new_transaction_ref():
+    """
+    26 character time ordered reference, laid out like a ULID: 48 bits of unix
+    time in milliseconds followed by 80 random bits. Unique without a db lookup
+    """
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    chars = []
+    for _ in range(26):
+        value, index = divmod(value, 32)
+        chars.append(REF_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+class BaseIdAllocator(object):
+    """
+    hands out transaction refs and account numbers.
+    Set PAYMENTS_ID_ALLOCATOR to the dotted path of a subclass to swap it
+    """
+
+    def transaction_ref(self):
+        raise NotImplementedError
+
+    def account_number(self):
+        raise NotImplementedError
+
+
+class SequenceIdAllocator(BaseIdAllocator):
+    """
+    time ordered transaction refs and numeric account numbers leased from the
+    IdSequence table in blocks of PAYMENTS_ACCOUNT_NUMBER_BLOCK_SIZE, so the table
+    is only touched once per block per worker
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = 0
+        self._end = 0
+
+    def transaction_ref(self):
+        return new_transaction_ref()
+
+    def _lease(self, lease_connection, block_size):
+        IdSequence = get_model("payments", "IdSequence")
+        table = lease_connection.ops.quote_name(IdSequence._meta.db_table)
+        with lease_connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, next_value) VALUES (%s, %s) "
+                "ON CONFLICT (name) DO NOTHING",
+                [ACCOUNT_NUMBER_SEQUENCE, settings.PAYMENTS_ACCOUNT_NUMBER_START],
+            )
+            cursor.execute(
+                f"UPDATE {table} SET next_value = next_value + %s WHERE name = %s "
+                "RETURNING next_value",
+                [block_size, ACCOUNT_NUMBER_SEQUENCE],
+            )
+            (end,) = cursor.fetchone()
+        return end - block_size, end
+
+    def _lease_block(self):
+        """
+        reserve the next block of account numbers. The lease is committed on a
+        connection of its own: inside the caller's transaction a rollback would
+        undo it while the block stays cached, and the numbers would be handed
+        out again
+        Returns:
+            - (first, end) of the block, end excluded
+        """
+        block_size = settings.PAYMENTS_ACCOUNT_NUMBER_BLOCK_SIZE
+        if connection.vendor == "sqlite":
+            # a second connection would wait on the caller's write lock, lease a
+            # single number that goes away with the caller's transaction instead
+            if connection.in_atomic_block:
+                block_size = 1
+            return self._lease(connection, block_size)
+        lease_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            return self._lease(lease_connection, block_size)
+        finally:
+            lease_connection.close()
+
+    def account_number(self):
+        with self._lock:
+            # numbers leased before a fork belong to the parent
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._lease_block()
+                self._pid = os.getpid()
+            account_number = self._next
+            self._next += 1
+        return str(account_number)
+
+
+_allocator = None
+
+
+def get_id_allocator():
+    global _allocator
+    if _allocator is None:
+        _allocator = import_string(settings.PAYMENTS_ID_ALLOCATOR)()
+    return _allocator
@@ -0,0 +1,237 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from utils.loading import get_model
+
+TransactionLog = get_model("payments", "TransactionLog")
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PREFIX = "transactionlog"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TransactionLogWriter(object):
+    """
+    write-behind buffer for TransactionLog rows.
+
+    Callback payloads are appended to a per process spool file and kept in memory,
+    then saved with bulk_create once TRANSACTION_LOG_BATCH_SIZE payloads are
+    waiting or every TRANSACTION_LOG_FLUSH_INTERVAL seconds. A spool file is only
+    removed after its rows are committed, so payloads buffered by a worker that
+    dies are saved by the next worker that starts (or by the
+    replay_transactionlog_spool command).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._buffer = []
+        self._spool = None
+        self._spool_path = None
+        self._sequence = 0
+        # spool files handed to a flush that has not finished yet
+        self._inflight = set()
+
+    @property
+    def spool_dir(self):
+        return str(settings.TRANSACTION_LOG_SPOOL_DIR)
+
+    def _start(self):
+        # called with the lock held, once per process
+        self._pid = os.getpid()
+        self._buffer = []
+        self._sequence = 0
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._spool_path = os.path.join(
+            self.spool_dir, "{}-{}.spool".format(SPOOL_PREFIX, self._pid)
+        )
+        if os.path.exists(self._spool_path):
+            # left behind by an earlier process with our pid
+            self._rotate_spool()
+        self._spool = open(self._spool_path, "a", encoding="utf-8")
+        flusher = threading.Thread(
+            target=self._run, name="transactionlog-writer", daemon=True
+        )
+        flusher.start()
+        atexit.register(self.flush)
+
+    def _rotate_spool(self):
+        # called with the lock held, hands the current spool file over to a flush
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self._sequence += 1
+        flushing_path = "{}.{}.flushing".format(self._spool_path, self._sequence)
+        os.rename(self._spool_path, flushing_path)
+        return flushing_path
+
+    def write(self, payload, account_number=None):
+        """
+        queue a callback payload for saving
+        Args:
+            payload: raw callback json
+            account_number: the transaction's, for callbacks that do not carry it
+        """
+        if not settings.TRANSACTION_LOG_BUFFER_ENABLED:
+            TransactionLog.from_payload(payload, account_number).save()
+            return
+
+        received = timezone.now()
+        line = json.dumps(
+            {
+                "date_created": received,
+                "json_data": payload,
+                "account_number": account_number,
+            },
+            cls=DjangoJSONEncoder,
+        )
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._spool.write(line + "\n")
+            self._spool.flush()
+            if settings.TRANSACTION_LOG_SPOOL_FSYNC:
+                os.fsync(self._spool.fileno())
+            log = TransactionLog.from_payload(
+                payload, account_number, date_created=received
+            )
+            self._buffer.append(log)
+            if len(self._buffer) >= settings.TRANSACTION_LOG_BATCH_SIZE:
+                self._wakeup.set()
+
+    def flush(self):
+        """
+        save everything buffered so far
+        Returns:
+            - number of rows saved
+        """
+        with self._lock:
+            if self._pid != os.getpid() or not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer, []
+            flushing_path = self._rotate_spool()
+            self._spool = open(self._spool_path, "a", encoding="utf-8")
+            self._inflight.add(flushing_path)
+
+        try:
+            with db_transaction.atomic():
+                TransactionLog.objects.bulk_create(
+                    batch, batch_size=settings.TRANSACTION_LOG_BATCH_SIZE
+                )
+        except Exception as e:
+            # the spool file is kept and replayed by recover()
+            logger.error(e)
+            return 0
+        finally:
+            with self._lock:
+                self._inflight.discard(flushing_path)
+        os.remove(flushing_path)
+        return len(batch)
+
+    def recover(self, include_live=False):
+        """
+        save spool files whose rows never made it to the db: failed flushes of this
+        process and anything left by processes that are gone
+        Args:
+            include_live: also replay files of running processes, only safe when
+                no worker is running
+
+        Returns:
+            - number of rows saved
+        """
+        saved = 0
+        pattern = os.path.join(self.spool_dir, "{}-*.spool*".format(SPOOL_PREFIX))
+        for path in sorted(glob.glob(pattern)):
+            name = os.path.basename(path)
+            try:
+                pid = int(name[len(SPOOL_PREFIX) + 1 :].split(".")[0])
+                if ".replaying-" in name:
+                    # claimed by a replay, only take over if that process is gone
+                    pid = int(name.rsplit("-", 1)[1])
+            except ValueError:
+                continue
+            with self._lock:
+                if path in self._inflight:
+                    continue
+            if pid == self._pid and path.endswith(".spool"):
+                continue
+            if pid != self._pid and _pid_alive(pid) and not include_live:
+                continue
+            saved += self._replay(path)
+        return saved
+
+    def _replay(self, path):
+        original_path = path.split(".replaying-")[0]
+        claimed_path = original_path + ".replaying-{}".format(os.getpid())
+        try:
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            # another process claimed it first
+            return 0
+
+        logs = []
+        with open(claimed_path, encoding="utf-8") as spool:
+            for line in spool:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a torn last line from a crash mid write
+                    logger.warning("skipping corrupt spool line in %s", path)
+                    continue
+                logs.append(
+                    TransactionLog.from_payload(
+                        entry["json_data"],
+                        entry.get("account_number"),
+                        date_created=parse_datetime(entry["date_created"]),
+                    )
+                )
+        try:
+            with db_transaction.atomic():
+                TransactionLog.objects.bulk_create(
+                    logs, batch_size=settings.TRANSACTION_LOG_BATCH_SIZE
+                )
+        except Exception as e:
+            logger.error(e)
+            os.rename(claimed_path, original_path)
+            return 0
+        os.remove(claimed_path)
+        return len(logs)
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wakeup.wait(settings.TRANSACTION_LOG_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+                self.recover()
+            except Exception as e:
+                logger.error(e)
+
+
+transaction_log_writer = TransactionLogWriter()
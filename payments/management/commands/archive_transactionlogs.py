@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.partitions import archive_expired, create_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive callback logs older than TRANSACTION_LOG_RETENTION_MONTHS to "
+        "TRANSACTION_LOG_ARCHIVE_DIR and remove them. Run it daily"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-months",
+            type=int,
+            default=settings.TRANSACTION_LOG_RETENTION_MONTHS,
+            help="keep this month and this many minus one before it",
+        )
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.TRANSACTION_LOG_PARTITIONS_AHEAD,
+            help="monthly partitions to create in advance",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only print what would be archived",
+        )
+
+    def handle(self, *args, **options):
+        if options["retention_months"] < 1:
+            raise CommandError("--retention-months has to keep at least this month")
+        if is_partitioned() and not options["dry_run"]:
+            for name in create_partitions(options["months_ahead"]):
+                self.stdout.write("created partition {}".format(name))
+
+        results = archive_expired(options["retention_months"], options["dry_run"])
+        for target, count in results:
+            self.stdout.write("{}: {} log(s)".format(target, count))
+        self.stdout.write(
+            "{} {} log(s)".format(
+                "would archive" if options["dry_run"] else "archived",
+                sum(count for _, count in results),
+            )
+        )
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+
+from utils.loading import get_model
+
+Transaction = get_model("payments", "Transaction")
+TransactionLog = get_model("payments", "TransactionLog")
+
+LOOKUP_FIELDS = (
+    "kind",
+    "checkout_request_id",
+    "merchant_request_id",
+    "receipt_number",
+    "account_number",
+    "msisdn",
+    "result_code",
+)
+
+
+def backfill_logs(logs):
+    """
+    fill in the lookup fields of logs from their json_data. Stk push callbacks
+    do not carry the account number, it is taken from the transaction with the
+    same CheckoutRequestID
+    Returns:
+        - number of logs updated
+    """
+    for log in logs:
+        fields = TransactionLog.extract_fields(log.json_data, log.account_number)
+        for name, value in fields.items():
+            setattr(log, name, value)
+
+    checkout_request_ids = {
+        log.checkout_request_id
+        for log in logs
+        if log.checkout_request_id and not log.account_number
+    }
+    if checkout_request_ids:
+        account_numbers = dict(
+            Transaction.objects.filter(
+                checkout_request_id__in=checkout_request_ids
+            ).values_list("checkout_request_id", "account_number")
+        )
+        for log in logs:
+            if not log.account_number:
+                log.account_number = account_numbers.get(log.checkout_request_id, "")
+
+    TransactionLog.objects.bulk_update(logs, LOOKUP_FIELDS)
+    return len(logs)
+
+
+class Command(BaseCommand):
+    help = "Extract the lookup fields of callback logs saved before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="also redo logs whose kind is already known",
+        )
+
+    def handle(self, *args, **options):
+        logs = TransactionLog.objects.order_by("id").only(
+            "id", "json_data", "account_number"
+        )
+        if not options["all"]:
+            logs = logs.filter(kind="")
+        last_id, updated = 0, 0
+        while True:
+            chunk = list(logs.filter(id__gt=last_id)[: options["chunk_size"]])
+            if not chunk:
+                break
+            updated += backfill_logs(chunk)
+            last_id = chunk[-1].id
+        self.stdout.write("backfilled {} transaction log(s)".format(updated))
@@ -0,0 +1,111 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from payments.benchmarks import (
+    find_regressions,
+    get_benchmarks,
+    load_baseline,
+    measure,
+    save_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the per request payment functions and fail if one got slower than "
+        "its saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations", type=int, default=500, help="timed samples of each function"
+        )
+        parser.add_argument(
+            "--warmup", type=int, default=50, help="untimed calls made first"
+        )
+        parser.add_argument(
+            "--only", nargs="+", metavar="NAME", help="run only these benchmarks"
+        )
+        parser.add_argument(
+            "--baseline",
+            default=str(settings.BASE_DIR / "benchmarks" / "hot_paths.json"),
+            help="json file with the p50/p99 to compare with",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="record this run as the baseline instead of comparing",
+        )
+        parser.add_argument(
+            "--max-slowdown",
+            type=float,
+            default=1.5,
+            help="fail when a p50 is more than this many times its baseline p50",
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        # nothing the benchmarks write is kept
+        with db_transaction.atomic():
+            benchmarks = get_benchmarks(int(time.time()))
+            names = [benchmark.name for benchmark in benchmarks]
+            unknown = set(options["only"] or []) - set(names)
+            if unknown:
+                raise CommandError(
+                    "unknown benchmark(s) {}, pick from {}".format(
+                        ", ".join(sorted(unknown)), ", ".join(names)
+                    )
+                )
+            for benchmark in benchmarks:
+                if options["only"] and benchmark.name not in options["only"]:
+                    continue
+                results[benchmark.name] = measure(
+                    benchmark, options["iterations"], options["warmup"]
+                )
+            db_transaction.set_rollback(True)
+
+        baseline = {}
+        if not options["save_baseline"]:
+            baseline = load_baseline(options["baseline"])
+        self.stdout.write(
+            "{:<28} {:>10} {:>10} {:>10} {:>10}".format(
+                "benchmark", "p50 ms", "p99 ms", "max ms", "baseline"
+            )
+        )
+        for name, stats in results.items():
+            expected = baseline.get(name, {}).get("p50")
+            ratio = "x{:.2f}".format(stats["p50"] / expected) if expected else "-"
+            self.stdout.write(
+                "{:<28} {p50:>10.4f} {p99:>10.4f} {max:>10.4f} {:>10}".format(
+                    name, ratio, **stats
+                )
+            )
+
+        if options["save_baseline"]:
+            # keep the baselines of benchmarks left out with --only
+            saved = load_baseline(options["baseline"])
+            saved.update(results)
+            save_baseline(options["baseline"], saved)
+            self.stdout.write("saved baseline to {}".format(options["baseline"]))
+            return
+        if not baseline:
+            self.stdout.write(
+                "no baseline at {}, run with --save-baseline".format(
+                    options["baseline"]
+                )
+            )
+            return
+        regressions = find_regressions(results, baseline, options["max_slowdown"])
+        if regressions:
+            raise CommandError(
+                "slower than {}x the baseline: {}".format(
+                    options["max_slowdown"],
+                    ", ".join(
+                        "{} {:.4f}ms (baseline {:.4f}ms)".format(*regression)
+                        for regression in regressions
+                    ),
+                )
+            )
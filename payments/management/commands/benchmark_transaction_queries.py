@@ -0,0 +1,154 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.ids import new_transaction_ref
+from utils.loading import get_model
+from utils.stats import summarize
+
+Transaction = get_model("payments", "Transaction")
+
+BENCHMARK_NARRATION = "query benchmark"
+# share of seeded rows per status, roughly what production looks like
+STATUS_WEIGHTS = (
+    (Transaction.SUCCESSFUL, 85),
+    (Transaction.FAILED, 8),
+    (Transaction.CANCELLED, 4),
+    (Transaction.INITIATED, 2),
+    (Transaction.PENDING, 1),
+)
+
+
+def seed_transactions(rows, batch_size, days):
+    """
+    bulk insert benchmark transactions spread over the last `days` days
+    Returns:
+        - sample of seeded rows to look up
+    """
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    weights = [weight for _, weight in STATUS_WEIGHTS]
+    period = timedelta(days=days)
+    started = timezone.now() - period
+    offset = Transaction.objects.filter(narration=BENCHMARK_NARRATION).count()
+    samples = []
+    for start in range(offset, offset + rows, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, offset + rows)):
+            batch.append(
+                Transaction(
+                    account_number="bench{}".format(i),
+                    transaction_ref=new_transaction_ref(),
+                    phone_number="+2547{:08d}".format(i % 10**8),
+                    provider="702",
+                    narration=BENCHMARK_NARRATION,
+                    status=random.choices(statuses, weights)[0],
+                    amount=random.randint(1, 5000),
+                    provider_reference="BR{:08d}".format(i),
+                    checkout_request_id="ws_CO_bench_{}".format(i),
+                    merchant_id="bench-{}".format(i),
+                )
+            )
+        Transaction.objects.bulk_create(batch)
+        # auto_now_add ignores explicit values, so move each batch back in time
+        # afterwards keeping ids and dates in the same order as in production
+        date_created = started + period * ((start - offset) / float(rows))
+        Transaction.objects.filter(
+            account_number__in=[txn.account_number for txn in batch]
+        ).update(date_created=date_created)
+        samples.extend(random.sample(batch, min(len(batch), 10)))
+    return samples
+
+
+def get_hot_queries(sample):
+    """
+    the queries on the payment hot paths, keyed by name
+    """
+    now = timezone.now()
+    return {
+        "checkout_request_id": lambda: Transaction.objects.filter(
+            checkout_request_id=sample.checkout_request_id
+        ),
+        "account_number": lambda: Transaction.objects.filter(
+            account_number=sample.account_number
+        ),
+        "phone_number": lambda: Transaction.objects.filter(
+            phone_number=sample.phone_number
+        )[:25],
+        "provider_reference": lambda: Transaction.objects.filter(
+            provider_reference=sample.provider_reference
+        ),
+        "initiated_sweep": lambda: Transaction.objects.filter(
+            status=Transaction.INITIATED,
+            date_created__lt=now - timedelta(minutes=2),
+        ).order_by("id")[:500],
+        "status_date_range": lambda: Transaction.objects.filter(
+            status=Transaction.SUCCESSFUL,
+            date_created__gte=now - timedelta(hours=1),
+        )[:500],
+    }
+
+
+class Command(BaseCommand):
+    help = "Seed transactions and report query plans and latency of the hot queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=100000, help="transactions to seed"
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--iterations", type=int, default=200, help="runs of each query"
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="spread seeded rows over this period"
+        )
+        parser.add_argument(
+            "--no-seed", action="store_true", help="reuse rows from an earlier run"
+        )
+        parser.add_argument(
+            "--cleanup", action="store_true", help="delete the seeded rows at the end"
+        )
+
+    def handle(self, *args, **options):
+        if options["no_seed"]:
+            benchmark_rows = Transaction.objects.filter(narration=BENCHMARK_NARRATION)
+            samples = list(benchmark_rows.order_by("?")[:100])
+        else:
+            started = time.monotonic()
+            samples = seed_transactions(
+                options["rows"], options["batch_size"], options["days"]
+            )
+            self.stdout.write(
+                "seeded {} transaction(s) in {:.1f}s".format(
+                    options["rows"], time.monotonic() - started
+                )
+            )
+        if not samples:
+            self.stderr.write("no benchmark transactions, run without --no-seed")
+            return
+
+        total = Transaction.objects.count()
+        self.stdout.write("{} transaction(s) in the table\n".format(total))
+        for name, query in get_hot_queries(samples[0]).items():
+            self.stdout.write(name)
+            self.stdout.write(query().explain())
+
+            durations = []
+            for i in range(options["iterations"]):
+                query = get_hot_queries(samples[i % len(samples)])[name]
+                started = time.perf_counter()
+                list(query())
+                durations.append(time.perf_counter() - started)
+            stats = summarize(durations)
+            self.stdout.write(
+                "p50 {p50:.3f}ms  p99 {p99:.3f}ms  max {max:.3f}ms\n".format(**stats)
+            )
+
+        if options["cleanup"]:
+            deleted, _ = Transaction.objects.filter(
+                narration=BENCHMARK_NARRATION
+            ).delete()
+            self.stdout.write("deleted {} benchmark row(s)".format(deleted))
@@ -0,0 +1,55 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.exports import (
+    CSV,
+    EXPORT_FORMATS,
+    get_export_queryset,
+    iter_export,
+    parse_export_date,
+)
+
+
+class Command(BaseCommand):
+    help = "Export transactions as csv or ndjson, streamed from the db in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from", dest="date_from", help="ISO date or datetime, inclusive"
+        )
+        parser.add_argument(
+            "--to", dest="date_to", help="ISO date or datetime, exclusive"
+        )
+        parser.add_argument(
+            "--status", action="append", default=[], help="can be repeated"
+        )
+        parser.add_argument(
+            "--provider", action="append", default=[], help="can be repeated"
+        )
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default=CSV)
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument(
+            "--output", help="file to write to, defaults to standard output"
+        )
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ("date_from", "date_to"):
+            if options[name]:
+                dates[name] = parse_export_date(options[name])
+                if dates[name] is None:
+                    raise CommandError(f"Invalid {name}: {options[name]}")
+
+        queryset = get_export_queryset(
+            statuses=options["status"], providers=options["provider"], **dates
+        )
+        chunks = iter_export(queryset, options["format"], options["gzip"])
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
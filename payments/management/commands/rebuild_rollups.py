@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from payments.exports import parse_export_date
+from payments.rollups import catch_up, rebuild_range
+from utils.loading import get_model
+
+Transaction = get_model("payments", "Transaction")
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily transaction rollups, one day at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="date_from",
+            help="ISO date or datetime, defaults to the first transaction",
+        )
+        parser.add_argument(
+            "--to",
+            dest="date_to",
+            help="ISO date or datetime, exclusive, defaults to now",
+        )
+        parser.add_argument(
+            "--catch-up",
+            action="store_true",
+            help=(
+                "only recompute the buckets of transactions edited since the last "
+                "catch up, e.g. when the app starts or from cron"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["catch_up"]:
+            hours = catch_up()
+            self.stdout.write("caught up {} hour(s)".format(hours))
+            return
+
+        bounds = Transaction.objects.aggregate(
+            first=Min("date_created"), last=Max("date_created")
+        )
+        if bounds["first"] is None:
+            self.stdout.write("no transactions to roll up")
+            return
+
+        start, end = bounds["first"], timezone.now()
+        if options["date_from"]:
+            start = parse_export_date(options["date_from"])
+        if options["date_to"]:
+            end = parse_export_date(options["date_to"])
+        if start is None or end is None:
+            raise CommandError("Invalid date, use YYYY-MM-DD")
+
+        # whole local days so each batch also rebuilds its daily rollup once
+        day = timezone.localtime(start).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        days = 0
+        while day < end:
+            next_day = timezone.localtime(day + timedelta(days=1)).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            rebuild_range(max(day, start), min(next_day, end))
+            day = next_day
+            days += 1
+        self.stdout.write("rebuilt rollups for {} day(s)".format(days))
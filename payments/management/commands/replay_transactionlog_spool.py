@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from payments.logwriter import transaction_log_writer
+
+
+class Command(BaseCommand):
+    help = "Save callback logs left in TRANSACTION_LOG_SPOOL_DIR by stopped workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="also replay spool files of running processes. "
+            "Only use this when no worker is running",
+        )
+
+    def handle(self, *args, **options):
+        saved = transaction_log_writer.recover(include_live=options["all"])
+        self.stdout.write("saved {} transaction log(s)".format(saved))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from payments.partitions import restore_archive
+
+
+class Command(BaseCommand):
+    help = "Load archived callback logs back into TransactionLog"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="+", help="files written by archive_transactionlogs"
+        )
+
+    def handle(self, *args, **options):
+        for path in options["paths"]:
+            restored = restore_archive(path)
+            self.stdout.write("{}: {} log(s)".format(path, restored))
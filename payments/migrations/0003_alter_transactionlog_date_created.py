@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_auto_20220723_0035'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactionlog',
+            name='date_created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.14 on 2026-10-18 10:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_alter_transactionlog_date_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('stkpush', 'STK Push Callback'), ('c2b', 'C2B Confirmation')], max_length=12)),
+                ('reference', models.CharField(help_text='CheckoutRequestID for stk push callbacks, TransID for c2b', max_length=50)),
+                ('receipt_number', models.CharField(blank=True, db_index=True, help_text='mpesa receipt', max_length=30, null=True)),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='receipts', to='payments.transaction')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='paymentreceipt',
+            constraint=models.UniqueConstraint(fields=('source', 'reference'), name='unique_payment_receipt'),
+        ),
+    ]
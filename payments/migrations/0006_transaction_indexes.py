@@ -0,0 +1,38 @@
+# Generated by Django 3.2.14 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+from utils.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking writes to the table, see
+    # utils.operations
+    atomic = False
+
+    dependencies = [
+        ('payments', '0005_idsequence'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['checkout_request_id'], name='txn_checkout_request_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'date_created'], name='txn_status_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['phone_number'], name='txn_phone_number_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['provider_reference'], name='txn_provider_ref_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('status', 'Initiated')), fields=['id'], name='txn_initiated_idx'),
+        ),
+    ]
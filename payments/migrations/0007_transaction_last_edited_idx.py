@@ -0,0 +1,22 @@
+# Generated by Django 3.2.14 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+from utils.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking writes to the table, see
+    # utils.operations
+    atomic = False
+
+    dependencies = [
+        ('payments', '0006_transaction_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['last_edited', 'id'], name='txn_last_edited_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.14 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+from utils.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # the transaction index is built without locking writes to the table, see
+    # utils.operations
+    atomic = False
+
+    dependencies = [
+        ('payments', '0007_transaction_last_edited_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(blank=True, default='', max_length=50)),
+                ('method', models.CharField(blank=True, default='', help_text='payment method code', max_length=10)),
+                ('status', models.CharField(max_length=50)),
+                ('payment_category', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.BigIntegerField(default=0)),
+                ('amount_paid', models.BigIntegerField(default=0)),
+                ('bucket', models.DateField(help_text='day in TIME_ZONE')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyTransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(blank=True, default='', max_length=50)),
+                ('method', models.CharField(blank=True, default='', help_text='payment method code', max_length=10)),
+                ('status', models.CharField(max_length=50)),
+                ('payment_category', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.BigIntegerField(default=0)),
+                ('amount_paid', models.BigIntegerField(default=0)),
+                ('bucket', models.DateTimeField(help_text='start of the hour')),
+            ],
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['date_created'], name='txn_date_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlytransactionrollup',
+            constraint=models.UniqueConstraint(fields=('bucket', 'provider', 'method', 'status', 'payment_category'), name='unique_hourly_transaction_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailytransactionrollup',
+            constraint=models.UniqueConstraint(fields=('bucket', 'provider', 'method', 'status', 'payment_category'), name='unique_daily_transaction_rollup'),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:05
+
+from datetime import datetime, time
+
+from django.db import migrations, models
+from django.utils import timezone
+
+TABLE = 'payments_transactionlog'
+LEGACY_TABLE = 'payments_transactionlog_legacy'
+SEQUENCE = 'payments_transactionlog_id_seq'
+PLAIN_TABLE = 'payments_transactionlog_plain'
+
+
+def month_start(year, month):
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return timezone.make_aware(datetime.combine(datetime(year, month, 1), time.min))
+
+
+def partition_table(apps, schema_editor):
+    """
+    turn TransactionLog into a table range partitioned by month on date_created.
+    The existing rows become one partition that ends with the current month,
+    archive_expired deletes its expired months until all of it has expired
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT max(date_created) FROM {TABLE}')
+        (latest,) = cursor.fetchone()
+        last_day = timezone.localdate()
+        if latest is not None:
+            last_day = max(last_day, timezone.localdate(latest))
+        first_month = month_start(last_day.year, last_day.month + 1)
+
+        cursor.execute(
+            "SELECT conname FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'p'",
+            [TABLE],
+        )
+        (primary_key,) = cursor.fetchone()
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}')
+        cursor.execute(f'ALTER TABLE {LEGACY_TABLE} DROP CONSTRAINT {primary_key}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (date_created)'
+        )
+        # a partitioned table's unique constraints have to include the partition key
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, date_created)')
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+        cursor.execute(
+            f'ALTER TABLE {TABLE} ATTACH PARTITION {LEGACY_TABLE} '
+            'FOR VALUES FROM (MINVALUE) TO (%s)',
+            [first_month],
+        )
+        for offset in range(2):
+            start = month_start(last_day.year, last_day.month + offset + 1)
+            end = month_start(last_day.year, last_day.month + offset + 2)
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_p{start:%Y%m} PARTITION OF {TABLE} '
+                'FOR VALUES FROM (%s) TO (%s)',
+                [start, end],
+            )
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+
+def unpartition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE {PLAIN_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS)'
+        )
+        cursor.execute(f'INSERT INTO {PLAIN_TABLE} SELECT * FROM {TABLE}')
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {PLAIN_TABLE}.id')
+        cursor.execute(f'DROP TABLE {TABLE}')
+        cursor.execute(f'ALTER TABLE {PLAIN_TABLE} RENAME TO {TABLE}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_transaction_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['date_created'], name='txnlog_date_created_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_transactionlog_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionlog',
+            name='account_number',
+            field=models.CharField(blank=True, default='', help_text="BillRefNumber for c2b, the transaction's for stk push", max_length=50),
+        ),
+        migrations.AddField(
+            model_name='transactionlog',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='transactionlog',
+            name='kind',
+            field=models.CharField(blank=True, choices=[('stkpush', 'STK Push Callback'), ('c2b', 'C2B Confirmation')], default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='transactionlog',
+            name='merchant_request_id',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='transactionlog',
+            name='msisdn',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='transactionlog',
+            name='receipt_number',
+            field=models.CharField(blank=True, default='', help_text='MpesaReceiptNumber or TransID', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='transactionlog',
+            name='result_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['checkout_request_id'], name='txnlog_checkout_request_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['merchant_request_id'], name='txnlog_merchant_request_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['receipt_number'], name='txnlog_receipt_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['account_number'], name='txnlog_account_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['msisdn'], name='txnlog_msisdn_idx'),
+        ),
+    ]
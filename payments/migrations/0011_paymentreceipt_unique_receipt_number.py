@@ -0,0 +1,22 @@
+# Generated by Django 3.2.14 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_transactionlog_lookup_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentreceipt',
+            name='receipt_number',
+            field=models.CharField(blank=True, help_text='mpesa receipt', max_length=30, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentreceipt',
+            constraint=models.UniqueConstraint(condition=models.Q(('receipt_number__isnull', False)), fields=('receipt_number',), name='unique_payment_receipt_number'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_paymentreceipt_unique_receipt_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('watermark', models.DateTimeField(help_text='last_edited covered by the rollups')),
+                ('last_run', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
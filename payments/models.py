@@ -1,8 +1,10 @@
-from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from django.utils.crypto import get_random_string
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from payments.ids import get_id_allocator
+from utils.core import validate_phone_number
+
 # Create your models here.
 
 
@@ -159,18 +161,36 @@ class Transaction(models.Model):
     date_created = models.DateTimeField(auto_now_add=True, null=True)
     last_edited = models.DateTimeField(auto_now=True, null=True)
 
+    class Meta:
+        indexes = [
+            # stk push status queries and callbacks
+            models.Index(
+                fields=["checkout_request_id"], name="txn_checkout_request_idx"
+            ),
+            # status sweeps and reports over a date range
+            models.Index(
+                fields=["status", "date_created"], name="txn_status_created_idx"
+            ),
+            models.Index(fields=["phone_number"], name="txn_phone_number_idx"),
+            models.Index(fields=["provider_reference"], name="txn_provider_ref_idx"),
+            # the few transactions still waiting for mpesa, scanned by
+            # reconcile_stkpush in id order
+            models.Index(
+                fields=["id"],
+                name="txn_initiated_idx",
+                condition=models.Q(status="Initiated"),
+            ),
+            # incremental reindex, rows changed since the last run
+            models.Index(fields=["last_edited", "id"], name="txn_last_edited_idx"),
+            # rollup recomputation and exports over a date range
+            models.Index(fields=["date_created"], name="txn_date_created_idx"),
+        ]
+
     def __str__(self):
         return self.narration
 
     def _get_unique_ref(self):
-        while True:
-            length = 20
-            ref = get_random_string(length)
-            try:
-                Transaction.objects.get(transaction_ref=ref)
-            except ObjectDoesNotExist:
-                break
-        return ref
+        return get_id_allocator().transaction_ref()
 
     def provider_to_string(self):
         if self.provider == "702":
@@ -192,13 +212,246 @@ class Transaction(models.Model):
         return super(Transaction, self).save(*args, **kwargs)
 
 
+class IdSequence(models.Model):
+    """
+    Named counters the id allocator leases blocks of numbers from
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} {self.next_value}"
+
+
+class PaymentReceipt(models.Model):
+    """
+    One row per mpesa callback applied to a transaction.
+    The (source, reference) pair is unique so a replayed callback is never
+    applied twice, and so is the receipt number so a payment sent both as an stk
+    callback and a c2b confirmation is only credited once
+    """
+
+    STKPUSH, C2B = "stkpush", "c2b"
+    SOURCES = (
+        (STKPUSH, _("STK Push Callback")),
+        (C2B, _("C2B Confirmation")),
+    )
+    source = models.CharField(max_length=12, choices=SOURCES)
+    reference = models.CharField(
+        max_length=50,
+        help_text="CheckoutRequestID for stk push callbacks, TransID for c2b",
+    )
+    receipt_number = models.CharField(
+        max_length=30, blank=True, null=True, help_text="mpesa receipt"
+    )
+    transaction = models.ForeignKey(
+        Transaction,
+        blank=True,
+        null=True,
+        related_name="receipts",
+        on_delete=models.SET_NULL,
+    )
+    amount = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "reference"], name="unique_payment_receipt"
+            ),
+            models.UniqueConstraint(
+                fields=["receipt_number"],
+                condition=models.Q(receipt_number__isnull=False),
+                name="unique_payment_receipt_number",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.reference}"
+
+
+class RollupCheckpoint(models.Model):
+    """
+    How far the rollups have caught up with transaction changes.
+    Every transaction edited up to the watermark is in the rollups, changes after
+    it may only have been collected in the memory of a worker
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    watermark = models.DateTimeField(help_text="last_edited covered by the rollups")
+    last_run = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} {self.watermark}"
+
+
+class TransactionRollup(models.Model):
+    """
+    Transaction totals per bucket, provider, method, status and category.
+    Missing values are stored as "" so the key columns can be unique
+    """
+
+    provider = models.CharField(max_length=50, blank=True, default="")
+    method = models.CharField(
+        max_length=10, blank=True, default="", help_text="payment method code"
+    )
+    status = models.CharField(max_length=50)
+    payment_category = models.CharField(max_length=100, blank=True, default="")
+    count = models.PositiveIntegerField(default=0)
+    amount = models.BigIntegerField(default=0)
+    amount_paid = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class HourlyTransactionRollup(TransactionRollup):
+    bucket = models.DateTimeField(help_text="start of the hour")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "provider", "method", "status", "payment_category"],
+                name="unique_hourly_transaction_rollup",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket} {self.status} {self.count}"
+
+
+class DailyTransactionRollup(TransactionRollup):
+    bucket = models.DateField(help_text="day in TIME_ZONE")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "provider", "method", "status", "payment_category"],
+                name="unique_daily_transaction_rollup",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket} {self.status} {self.count}"
+
+
 class TransactionLog(models.Model):
     """
-    Logs
+    Logs.
+    The identifiers in a callback are copied out of json_data when it is logged
+    so callbacks can be looked up without reading the payloads
     """
 
+    STKPUSH, C2B = PaymentReceipt.STKPUSH, PaymentReceipt.C2B
+    KINDS = PaymentReceipt.SOURCES
+
     json_data = models.JSONField()
-    date_created = models.DateTimeField(auto_now_add=True)
+    kind = models.CharField(max_length=12, choices=KINDS, blank=True, default="")
+    checkout_request_id = models.CharField(max_length=50, blank=True, default="")
+    merchant_request_id = models.CharField(max_length=50, blank=True, default="")
+    receipt_number = models.CharField(
+        max_length=30, blank=True, default="", help_text="MpesaReceiptNumber or TransID"
+    )
+    account_number = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        help_text="BillRefNumber for c2b, the transaction's for stk push",
+    )
+    msisdn = models.CharField(max_length=20, blank=True, default="")
+    result_code = models.IntegerField(blank=True, null=True)
+    # set when the callback is received, which can be before the row is written
+    date_created = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        # on postgres the table is range partitioned by month on date_created
+        # and its primary key is (id, date_created), see migration 0009
+        indexes = [
+            models.Index(fields=["date_created"], name="txnlog_date_created_idx"),
+            models.Index(
+                fields=["checkout_request_id"], name="txnlog_checkout_request_idx"
+            ),
+            models.Index(
+                fields=["merchant_request_id"], name="txnlog_merchant_request_idx"
+            ),
+            models.Index(fields=["receipt_number"], name="txnlog_receipt_number_idx"),
+            models.Index(fields=["account_number"], name="txnlog_account_number_idx"),
+            models.Index(fields=["msisdn"], name="txnlog_msisdn_idx"),
+        ]
+
+    @classmethod
+    def extract_fields(cls, payload, account_number=None):
+        """
+        pull the lookup fields out of a stk push callback or c2b confirmation
+        Args:
+            payload: raw callback json
+            account_number: the transaction's account number for stk push
+                callbacks, they do not carry it
+
+        Returns:
+            - dict of field values, empty strings for anything not found
+        """
+        fields = {
+            "kind": "",
+            "checkout_request_id": "",
+            "merchant_request_id": "",
+            "receipt_number": "",
+            "account_number": str(account_number or ""),
+            "msisdn": "",
+            "result_code": None,
+        }
+        if not isinstance(payload, dict):
+            return fields
+
+        body = payload.get("Body")
+        callback = body.get("stkCallback") if isinstance(body, dict) else None
+        if isinstance(callback, dict):
+            fields["kind"] = cls.STKPUSH
+            fields["checkout_request_id"] = callback.get("CheckoutRequestID") or ""
+            fields["merchant_request_id"] = callback.get("MerchantRequestID") or ""
+            try:
+                fields["result_code"] = int(callback.get("ResultCode"))
+            except (TypeError, ValueError):
+                pass
+            metadata = callback.get("CallbackMetadata")
+            items = metadata.get("Item") if isinstance(metadata, dict) else None
+            for item in items if isinstance(items, list) else []:
+                if not isinstance(item, dict):
+                    continue
+                if item.get("Name") == "MpesaReceiptNumber":
+                    fields["receipt_number"] = item.get("Value") or ""
+                elif item.get("Name") == "PhoneNumber":
+                    fields["msisdn"] = item.get("Value") or ""
+        elif "TransID" in payload:
+            fields["kind"] = cls.C2B
+            fields["receipt_number"] = payload.get("TransID") or ""
+            fields["account_number"] = payload.get("BillRefNumber") or ""
+            fields["msisdn"] = payload.get("MSISDN") or ""
+
+        if fields["msisdn"]:
+            # stored as +254... like Transaction.phone_number where possible
+            msisdn = str(fields["msisdn"])
+            fields["msisdn"] = validate_phone_number(msisdn) or msisdn
+        for name in (
+            "checkout_request_id",
+            "merchant_request_id",
+            "receipt_number",
+            "account_number",
+            "msisdn",
+        ):
+            max_length = cls._meta.get_field(name).max_length
+            fields[name] = str(fields[name])[:max_length]
+        return fields
+
+    @classmethod
+    def from_payload(cls, payload, account_number=None, **kwargs):
+        """
+        an unsaved log for a callback with its lookup fields filled in
+        """
+        return cls(
+            json_data=payload, **cls.extract_fields(payload, account_number), **kwargs
+        )
 
     def __str__(self):
         return str(self.recieved_on)
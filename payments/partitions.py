@@ -0,0 +1,311 @@
+import gzip
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from utils.loading import get_model
+
+TransactionLog = get_model("payments", "TransactionLog")
+
+logger = logging.getLogger(__name__)
+
+# rows read from the db and written to the archive per round trip
+ARCHIVE_CHUNK_SIZE = 2000
+
+# what is kept of each log, the other lookup fields are extracted again from
+# json_data on restore
+ARCHIVE_FIELDS = ("id", "date_created", "json_data", "account_number")
+
+Partition = namedtuple("Partition", "name start end")
+
+BOUND_RE = re.compile(r"FOR VALUES FROM \((.+)\) TO \((.+)\)")
+
+
+def month_start(year, month):
+    """
+    Returns:
+        - aware start of the month in TIME_ZONE, month may be out of 1..12
+    """
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return timezone.make_aware(datetime.combine(datetime(year, month, 1), time.min))
+
+
+def get_cutoff(retention_months=None):
+    """
+    Returns:
+        - logs created before this are past retention
+    """
+    if retention_months is None:
+        retention_months = settings.TRANSACTION_LOG_RETENTION_MONTHS
+    today = timezone.localdate()
+    return month_start(today.year, today.month - retention_months + 1)
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TransactionLog._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def _parse_bound(value):
+    if value == "MINVALUE":
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def get_partitions():
+    """
+    Returns:
+        - range partitions of TransactionLog ordered by start, start is None for
+          the partition holding the rows from before partitioning
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TransactionLog._meta.db_table],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_RE.match(bound)
+        if match is None:
+            # the default partition
+            continue
+        start, end = (_parse_bound(value) for value in match.groups())
+        partitions.append(Partition(name, start, end))
+    partitions.sort(key=lambda partition: partition.end)
+    return partitions
+
+
+def create_partitions(months_ahead=None):
+    """
+    create the monthly partitions from this month to months_ahead months from now
+    Returns:
+        - names of the partitions created
+    """
+    if months_ahead is None:
+        months_ahead = settings.TRANSACTION_LOG_PARTITIONS_AHEAD
+    table = TransactionLog._meta.db_table
+    today = timezone.localdate()
+    existing = get_partitions()
+    created = []
+    for offset in range(months_ahead + 1):
+        start = month_start(today.year, today.month + offset)
+        end = month_start(today.year, today.month + offset + 1)
+        if any(
+            (partition.start is None or partition.start < end) and start < partition.end
+            for partition in existing
+        ):
+            continue
+        name = "{}_p{:%Y%m}".format(table, start)
+        sql = "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)".format(
+            connection.ops.quote_name(name), connection.ops.quote_name(table)
+        )
+        try:
+            with db_transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [start, end])
+        except DatabaseError as e:
+            # rows for the month already went to the default partition, they are
+            # archived with a delete once the month is past retention
+            logger.warning("could not create partition %s: %s", name, e)
+            continue
+        created.append(name)
+    return created
+
+
+def write_archive(path, logs):
+    """
+    write tuples of ARCHIVE_FIELDS to a gzipped NDJSON file.
+    The file only appears under path once it is complete and synced
+    Returns:
+        - number of logs written
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial_path = path + ".partial"
+    written = 0
+    with gzip.open(partial_path, "wt", encoding="utf-8") as archive:
+        for log in logs:
+            entry = dict(zip(ARCHIVE_FIELDS, log))
+            archive.write(json.dumps(entry, cls=DjangoJSONEncoder) + "\n")
+            written += 1
+    with open(partial_path, "rb") as archive:
+        os.fsync(archive.fileno())
+    os.replace(partial_path, path)
+    return written
+
+
+def _archive_path(name):
+    return os.path.join(
+        str(settings.TRANSACTION_LOG_ARCHIVE_DIR),
+        "{}-{:%Y%m%d%H%M%S}.ndjson.gz".format(name, timezone.localtime()),
+    )
+
+
+def _logs_between(start, end):
+    logs = TransactionLog.objects.filter(date_created__lt=end)
+    if start is not None:
+        logs = logs.filter(date_created__gte=start)
+    return logs
+
+
+def archive_partition(partition):
+    """
+    write a partition to the archive dir, then detach and drop it. Dropping a
+    partition does not touch the rest of the table
+    Returns:
+        - (archive path, number of logs archived)
+    """
+    table = TransactionLog._meta.db_table
+    path = _archive_path(partition.name)
+    with db_transaction.atomic():
+        with connection.cursor() as cursor:
+            # keep writers out of the partition until it is gone
+            cursor.execute(
+                "LOCK TABLE {} IN SHARE MODE".format(
+                    connection.ops.quote_name(partition.name)
+                )
+            )
+        logs = (
+            _logs_between(partition.start, partition.end)
+            .order_by("id")
+            .values_list(*ARCHIVE_FIELDS)
+            .iterator(chunk_size=ARCHIVE_CHUNK_SIZE)
+        )
+        archived = write_archive(path, logs)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "ALTER TABLE {} DETACH PARTITION {}".format(
+                    connection.ops.quote_name(table),
+                    connection.ops.quote_name(partition.name),
+                )
+            )
+            cursor.execute(
+                "DROP TABLE {}".format(connection.ops.quote_name(partition.name))
+            )
+    return path, archived
+
+
+def archive_range(name, start, end):
+    """
+    write the logs created in [start, end) to the archive dir and delete them.
+    Used where the table is not partitioned and for rows in the default partition
+    Returns:
+        - (archive path, number of logs archived), path is None if there were none
+    """
+    logs = _logs_between(start, end)
+    with db_transaction.atomic():
+        if not logs.exists():
+            return None, 0
+        path = _archive_path(name)
+        archived = write_archive(
+            path,
+            logs.order_by("id")
+            .values_list(*ARCHIVE_FIELDS)
+            .iterator(chunk_size=ARCHIVE_CHUNK_SIZE),
+        )
+        logs.delete()
+    return path, archived
+
+
+def archive_expired(retention_months=None, dry_run=False):
+    """
+    archive and remove the logs older than the retention period, whole
+    partitions where possible
+    Returns:
+        - list of (archive path or partition name on a dry run, logs archived)
+    """
+    cutoff = get_cutoff(retention_months)
+    table = TransactionLog._meta.db_table
+    results = []
+    # the expired partitions cover everything before floor
+    floor = None
+    if is_partitioned():
+        for partition in get_partitions():
+            if partition.end > cutoff:
+                break
+            floor = partition.end
+            if dry_run:
+                count = _logs_between(partition.start, partition.end).count()
+                results.append((partition.name, count))
+            else:
+                results.append(archive_partition(partition))
+
+    # whatever is left is in the default partition, an unpartitioned table or the
+    # expired months of a partition that is still live, such as the one the
+    # rows from before partitioning were moved into
+    oldest = (
+        _logs_between(floor, cutoff)
+        .order_by("date_created")
+        .values_list("date_created", flat=True)
+        .first()
+    )
+    if oldest is not None:
+        oldest = timezone.localtime(oldest)
+        start = month_start(oldest.year, oldest.month)
+        while start < cutoff:
+            end = min(month_start(start.year, start.month + 1), cutoff)
+            name = "{}_{:%Y%m}".format(table, start)
+            if dry_run:
+                results.append((name, _logs_between(start, end).count()))
+            else:
+                path, archived = archive_range(name, start, end)
+                if path is not None:
+                    results.append((path, archived))
+            start = end
+    return results
+
+
+def read_archive(path):
+    """
+    Yields:
+        - unsaved TransactionLog rows from an archive file
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            yield TransactionLog.from_payload(
+                entry["json_data"],
+                entry.get("account_number"),
+                id=entry["id"],
+                date_created=parse_datetime(entry["date_created"]),
+            )
+
+
+def restore_archive(path):
+    """
+    load an archive file back into TransactionLog, logs that are already there
+    are skipped
+    Returns:
+        - number of logs read from the file
+    """
+    restored = 0
+    batch = []
+    for log in read_archive(path):
+        batch.append(log)
+        if len(batch) >= ARCHIVE_CHUNK_SIZE:
+            TransactionLog.objects.bulk_create(batch, ignore_conflicts=True)
+            restored += len(batch)
+            batch = []
+    if batch:
+        TransactionLog.objects.bulk_create(batch, ignore_conflicts=True)
+        restored += len(batch)
+    return restored
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from utils.loading import get_model
+
+PaymentMethod = get_model("payments", "PaymentMethod")
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = "payments:payment-method-registry:version"
+
+_Snapshot = namedtuple("_Snapshot", "methods by_code version loaded_at")
+
+
+class PaymentMethodRegistry(object):
+    """
+    process local copy of the PaymentMethod table.
+
+    Saving or deleting a method bumps a version number kept in the django cache.
+    Every worker compares it with the version it loaded at most every
+    PAYMENT_METHOD_REGISTRY_CHECK_INTERVAL seconds and reloads when it changed.
+    The cache has to be shared by all workers for that, with the default local
+    memory cache other workers only reload after PAYMENT_METHOD_REGISTRY_TTL
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0
+
+    def _get_version(self):
+        try:
+            return cache.get(VERSION_CACHE_KEY, 0)
+        except Exception as e:
+            logger.error(e)
+            return None
+
+    def load(self):
+        version = self._get_version()
+        methods = list(PaymentMethod.objects.order_by("pk"))
+        by_code = {}
+        for method in methods:
+            by_code.setdefault(method.code, method)
+        snapshot = _Snapshot(tuple(methods), by_code, version, time.monotonic())
+        with self._lock:
+            self._snapshot = snapshot
+            self._checked_at = snapshot.loaded_at
+        return snapshot
+
+    def _current(self):
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                check = False
+            elif now - snapshot.loaded_at > settings.PAYMENT_METHOD_REGISTRY_TTL:
+                snapshot, check = None, False
+            else:
+                check = now - self._checked_at > (
+                    settings.PAYMENT_METHOD_REGISTRY_CHECK_INTERVAL
+                )
+                if check:
+                    self._checked_at = now
+        if check and self._get_version() != snapshot.version:
+            snapshot = None
+        if snapshot is None:
+            snapshot = self.load()
+        return snapshot
+
+    def get(self, code):
+        """
+        same as PaymentMethod.objects.get(code=code) without the query
+        Raises:
+            PaymentMethod.DoesNotExist
+        """
+        method = self._current().by_code.get(code)
+        if method is None:
+            raise PaymentMethod.DoesNotExist(
+                "PaymentMethod matching query does not exist."
+            )
+        return method
+
+    def first(self, **filters):
+        """
+        same as PaymentMethod.objects.filter(**filters).first() for plain field
+        equality filters
+        """
+        for method in self._current().methods:
+            if all(getattr(method, name) == value for name, value in filters.items()):
+                return method
+        return None
+
+    def all(self):
+        return list(self._current().methods)
+
+    def invalidate(self):
+        """
+        drop this process's copy and tell the other workers to reload theirs
+        """
+        with self._lock:
+            self._snapshot = None
+        try:
+            cache.add(VERSION_CACHE_KEY, 0, timeout=None)
+            cache.incr(VERSION_CACHE_KEY)
+        except Exception as e:
+            logger.error(e)
+
+
+payment_method_registry = PaymentMethodRegistry()
+
+
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_delete, sender=PaymentMethod)
+def invalidate_payment_methods(sender, **kwargs):
+    # other workers must not reload before the change is visible to them
+    db_transaction.on_commit(payment_method_registry.invalidate)
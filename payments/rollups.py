@@ -0,0 +1,336 @@
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime, time, timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection
+from django.db import transaction as db_transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from payments.signals import transactions_updated
+from utils.loading import get_model
+
+Transaction = get_model("payments", "Transaction")
+RollupCheckpoint = get_model("payments", "RollupCheckpoint")
+HourlyTransactionRollup = get_model("payments", "HourlyTransactionRollup")
+DailyTransactionRollup = get_model("payments", "DailyTransactionRollup")
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+# changed ids resolved to their creation hour per query
+PK_CHUNK_SIZE = 1000
+# a concurrent rebuild of the same bucket makes ours hit the unique constraint
+# where buckets cannot be locked
+REBUILD_ATTEMPTS = 3
+CHECKPOINT_NAME = "transactions"
+# postgres advisory lock class of each rollup, the bucket is the second key
+BUCKET_LOCK_CLASSES = {
+    "payments_hourlytransactionrollup": 72011,
+    "payments_dailytransactionrollup": 72012,
+}
+
+
+def hour_start(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _lock_buckets(model, bucket_keys):
+    """
+    hold the buckets until the end of the db transaction so concurrent rebuilds
+    of the same bucket run one after the other, each computing its rows after
+    the previous one committed. Only on postgres
+    """
+    if connection.vendor != "postgresql":
+        return
+    lock_class = BUCKET_LOCK_CLASSES[model._meta.db_table]
+    with connection.cursor() as cursor:
+        # always in the same order so two rebuilds cannot deadlock
+        for key in sorted(bucket_keys):
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [lock_class, key])
+
+
+def _replace_buckets(model, bucket_filter, bucket_keys, get_rows):
+    """
+    replace the rollups matching bucket_filter with get_rows(), computed once the
+    buckets are locked so a slower rebuild never writes older totals over a newer
+    one
+    """
+    for attempt in range(REBUILD_ATTEMPTS):
+        try:
+            with db_transaction.atomic():
+                _lock_buckets(model, bucket_keys)
+                rows = get_rows()
+                model.objects.filter(**bucket_filter).delete()
+                model.objects.bulk_create(rows)
+            return
+        except IntegrityError:
+            if attempt == REBUILD_ATTEMPTS - 1:
+                raise
+
+
+def _rollup_row(model, bucket, values):
+    return model(
+        bucket=bucket,
+        provider=values["provider"] or "",
+        method=values["method"] or "",
+        status=values["status"],
+        payment_category=values["payment_category"] or "",
+        count=values["total_count"],
+        amount=values["total_amount"] or 0,
+        amount_paid=values["total_amount_paid"] or 0,
+    )
+
+
+def rebuild_hours(start, end):
+    """
+    recompute the hourly rollups for transactions created in [start, end),
+    both on the hour
+    """
+
+    def get_rows():
+        totals = (
+            Transaction.objects.filter(date_created__gte=start, date_created__lt=end)
+            .annotate(hour=TruncHour("date_created"), method_code=F("method__code"))
+            .values("hour", "provider", "method_code", "status", "payment_category")
+            .annotate(
+                total_count=Count("id"),
+                total_amount=Sum("amount"),
+                total_amount_paid=Sum("amount_paid"),
+            )
+            .order_by()
+        )
+        rows = []
+        for values in totals:
+            values["method"] = values.pop("method_code")
+            rows.append(_rollup_row(HourlyTransactionRollup, values["hour"], values))
+        return rows
+
+    first_hour = int(start.timestamp()) // 3600
+    hours = range(first_hour, first_hour + int((end - start) / HOUR))
+    _replace_buckets(
+        HourlyTransactionRollup,
+        {"bucket__gte": start, "bucket__lt": end},
+        hours,
+        get_rows,
+    )
+
+
+def rebuild_days(first_day, last_day):
+    """
+    recompute the daily rollups for first_day to last_day from the hourly ones
+    """
+    start, end = day_start(first_day), day_start(last_day + timedelta(days=1))
+
+    def get_rows():
+        totals = (
+            HourlyTransactionRollup.objects.filter(bucket__gte=start, bucket__lt=end)
+            .annotate(day=TruncDate("bucket"))
+            .values("day", "provider", "method", "status", "payment_category")
+            .annotate(
+                total_count=Sum("count"),
+                total_amount=Sum("amount"),
+                total_amount_paid=Sum("amount_paid"),
+            )
+            .order_by()
+        )
+        return [
+            _rollup_row(DailyTransactionRollup, values["day"], values)
+            for values in totals
+        ]
+
+    _replace_buckets(
+        DailyTransactionRollup,
+        {"bucket__gte": first_day, "bucket__lte": last_day},
+        range(first_day.toordinal(), last_day.toordinal() + 1),
+        get_rows,
+    )
+
+
+def rebuild_range(start, end):
+    """
+    recompute hourly and daily rollups for transactions created in [start, end)
+    """
+    start = hour_start(start)
+    end = hour_start(end - timedelta(microseconds=1)) + HOUR
+    rebuild_hours(start, end)
+    rebuild_days(start.date(), (end - HOUR).date())
+
+
+def rebuild_buckets(hours):
+    """
+    recompute the given hourly rollups and the days they fall on
+    """
+    for hour in sorted(hours):
+        rebuild_hours(hour, hour + HOUR)
+    for day in sorted(set(hour.date() for hour in hours)):
+        rebuild_days(day, day)
+
+
+def catch_up(lag=None):
+    """
+    recompute the buckets of the transactions edited since the last catch up, so
+    changes a worker collected but never flushed are not lost. Runs in one
+    worker at a time, the others skip it while the checkpoint is locked.
+    Deleted transactions leave nothing behind to find, rebuild_rollups repairs
+    their buckets
+    Args:
+        lag: seconds to stay behind now, default=ROLLUP_CATCH_UP_LAG
+
+    Returns:
+        - number of hours recomputed
+    """
+    if lag is None:
+        lag = settings.ROLLUP_CATCH_UP_LAG
+    safe_until = timezone.now() - timedelta(seconds=lag)
+    # the first catch up starts from here, rebuild_rollups covers the past
+    RollupCheckpoint.objects.get_or_create(
+        name=CHECKPOINT_NAME, defaults={"watermark": safe_until}
+    )
+    with db_transaction.atomic():
+        checkpoint = (
+            RollupCheckpoint.objects.select_for_update(skip_locked=True)
+            .filter(name=CHECKPOINT_NAME)
+            .first()
+        )
+        if checkpoint is None or checkpoint.watermark >= safe_until:
+            return 0
+        hours = set(
+            hour_start(hour)
+            for hour in Transaction.objects.filter(
+                last_edited__gt=checkpoint.watermark,
+                last_edited__lte=safe_until,
+                date_created__isnull=False,
+            )
+            .annotate(hour=TruncHour("date_created"))
+            .values_list("hour", flat=True)
+            .distinct()
+            .order_by()
+        )
+        rebuild_buckets(hours)
+        checkpoint.watermark = safe_until
+        checkpoint.save()
+    return len(hours)
+
+
+class RollupUpdater(object):
+    """
+    keeps the rollups current as transactions change.
+
+    Changed transaction ids are collected in memory and every
+    ROLLUP_FLUSH_INTERVAL seconds a background thread recomputes the hours they
+    were created in, and the days those hours fall on. Every
+    ROLLUP_CATCH_UP_INTERVAL seconds it also runs catch_up, which recomputes the
+    buckets of everything edited since the persisted watermark, so changes
+    collected by a worker that dies before flushing are repaired once another
+    worker catches up
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._pending = set()
+        self._pending_hours = set()
+
+    def _start(self):
+        # called with the lock held, once per process
+        self._pid = os.getpid()
+        self._pending = set()
+        self._pending_hours = set()
+        updater = threading.Thread(target=self._run, name="rollup-updater", daemon=True)
+        updater.start()
+        atexit.register(self.flush)
+
+    def mark(self, pks=(), hours=()):
+        """
+        Args:
+            pks: ids of changed transactions
+            hours: creation hours of deleted transactions
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._pending.update(pks)
+            self._pending_hours.update(hours)
+
+    def flush(self):
+        """
+        recompute the buckets of the transactions changed so far
+        Returns:
+            - number of hours recomputed
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return 0
+            pks, self._pending = list(self._pending), set()
+            hours, self._pending_hours = self._pending_hours, set()
+        if not pks and not hours:
+            return 0
+
+        try:
+            for offset in range(0, len(pks), PK_CHUNK_SIZE):
+                for date_created in Transaction.objects.filter(
+                    pk__in=pks[offset : offset + PK_CHUNK_SIZE],
+                    date_created__isnull=False,
+                ).values_list("date_created", flat=True):
+                    hours.add(hour_start(date_created))
+            rebuild_buckets(hours)
+        except Exception as e:
+            logger.error(e)
+            with self._lock:
+                self._pending.update(pks)
+                self._pending_hours.update(hours)
+            return 0
+        return len(hours)
+
+    def _run(self):
+        pid = os.getpid()
+        # catch up right away, repairing what a previous worker left unflushed and
+        # creating the checkpoint before this one has anything to lose
+        next_catch_up = monotonic()
+        while self._pid == pid:
+            close_old_connections()
+            try:
+                self.flush()
+                if monotonic() >= next_catch_up:
+                    next_catch_up = monotonic() + settings.ROLLUP_CATCH_UP_INTERVAL
+                    catch_up()
+            except Exception as e:
+                logger.error(e)
+            self._wakeup.wait(settings.ROLLUP_FLUSH_INTERVAL)
+            self._wakeup.clear()
+
+
+rollup_updater = RollupUpdater()
+
+
+@receiver(post_save, sender=Transaction)
+def mark_saved_transaction(sender, instance, **kwargs):
+    if settings.ROLLUP_ENABLED:
+        pk = instance.pk
+        db_transaction.on_commit(lambda: rollup_updater.mark(pks=[pk]))
+
+
+@receiver(post_delete, sender=Transaction)
+def mark_deleted_transaction(sender, instance, **kwargs):
+    if settings.ROLLUP_ENABLED and instance.date_created is not None:
+        hour = hour_start(instance.date_created)
+        db_transaction.on_commit(lambda: rollup_updater.mark(hours=[hour]))
+
+
+@receiver(transactions_updated)
+def mark_updated_transactions(sender, pks, **kwargs):
+    if settings.ROLLUP_ENABLED:
+        rollup_updater.mark(pks=pks)
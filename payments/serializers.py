@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from payments.models import PaymentMethod, Transaction
+from payments.models import PaymentMethod, Transaction, TransactionLog
 
 
 class PaymentMethodSerializer(serializers.ModelSerializer):
@@ -15,3 +15,9 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
+
+
+class TransactionLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TransactionLog
+        fields = '__all__'
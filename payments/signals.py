@@ -0,0 +1,17 @@
+from django.db import transaction as db_transaction
+from django.dispatch import Signal
+
+# Sent after Transaction rows are changed with queryset.update(), which does not
+# send post_save. Receivers get the primary keys of the changed rows as `pks`
+transactions_updated = Signal()
+
+
+def send_transactions_updated(sender, pks):
+    """
+    send transactions_updated once the surrounding db transaction commits
+    """
+    pks = list(pks)
+    if pks:
+        db_transaction.on_commit(
+            lambda: transactions_updated.send(sender=sender, pks=pks)
+        )
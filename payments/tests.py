@@ -1,3 +1,313 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from payments.logwriter import SPOOL_PREFIX, TransactionLogWriter
+from payments.partitions import (
+    archive_expired,
+    archive_partition,
+    archive_range,
+    get_partitions,
+    is_partitioned,
+    month_start,
+    read_archive,
+    restore_archive,
+)
+from payments.rollups import CHECKPOINT_NAME, catch_up
+from utils.loading import get_model
+
+DailyTransactionRollup = get_model("payments", "DailyTransactionRollup")
+HourlyTransactionRollup = get_model("payments", "HourlyTransactionRollup")
+RollupCheckpoint = get_model("payments", "RollupCheckpoint")
+Transaction = get_model("payments", "Transaction")
+TransactionLog = get_model("payments", "TransactionLog")
+
+
+def stk_callback(checkout_request_id):
+    return {
+        "Body": {
+            "stkCallback": {
+                "MerchantRequestID": "merchant-{}".format(checkout_request_id),
+                "CheckoutRequestID": checkout_request_id,
+                "ResultCode": 0,
+                "ResultDesc": "The service request is processed successfully.",
+            }
+        }
+    }
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+class TempDirMixin(object):
+    def make_temp_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+
+class TransactionLogWriterTests(TempDirMixin, TestCase):
+    def setUp(self):
+        self.spool_dir = self.make_temp_dir()
+        settings = override_settings(
+            TRANSACTION_LOG_BUFFER_ENABLED=True,
+            TRANSACTION_LOG_SPOOL_DIR=self.spool_dir,
+            TRANSACTION_LOG_FLUSH_INTERVAL=3600,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.writer = TransactionLogWriter()
+        self.addCleanup(self.stop_writer)
+
+    def stop_writer(self):
+        # lets the flusher thread of the writer exit
+        self.writer._pid = None
+        self.writer._wakeup.set()
+
+    def spool_files(self):
+        return sorted(os.listdir(self.spool_dir))
+
+    def write_spool(self, name, lines):
+        with open(os.path.join(self.spool_dir, name), "w", encoding="utf-8") as spool:
+            spool.write("\n".join(lines))
+
+    def spool_line(self, checkout_request_id, account_number="T100"):
+        return json.dumps(
+            {
+                "date_created": "2026-10-18T10:00:00+03:00",
+                "json_data": stk_callback(checkout_request_id),
+                "account_number": account_number,
+            }
+        )
+
+    def test_write_is_saved_on_flush(self):
+        self.writer.write(stk_callback("ws_CO_1"), account_number="T100")
+        self.assertFalse(TransactionLog.objects.exists())
+        self.assertEqual(
+            self.spool_files(), ["{}-{}.spool".format(SPOOL_PREFIX, os.getpid())]
+        )
+
+        self.assertEqual(self.writer.flush(), 1)
+        log = TransactionLog.objects.get()
+        self.assertEqual(log.kind, TransactionLog.STKPUSH)
+        self.assertEqual(log.checkout_request_id, "ws_CO_1")
+        self.assertEqual(log.account_number, "T100")
+        # the flushed spool file is gone, only the empty live one is left
+        self.assertEqual(
+            self.spool_files(), ["{}-{}.spool".format(SPOOL_PREFIX, os.getpid())]
+        )
+        self.assertEqual(self.writer.flush(), 0)
+
+    def test_recover_replays_spool_of_dead_process(self):
+        name = "{}-{}.spool".format(SPOOL_PREFIX, dead_pid())
+        self.write_spool(
+            name,
+            [
+                self.spool_line("ws_CO_1"),
+                self.spool_line("ws_CO_2"),
+                # torn by a crash mid write
+                self.spool_line("ws_CO_3")[:20],
+            ],
+        )
+        self.assertEqual(self.writer.recover(), 2)
+        self.assertEqual(
+            sorted(
+                TransactionLog.objects.values_list("checkout_request_id", flat=True)
+            ),
+            ["ws_CO_1", "ws_CO_2"],
+        )
+        self.assertEqual(
+            TransactionLog.objects.first().date_created,
+            datetime(2026, 10, 18, 7, tzinfo=timezone.utc),
+        )
+        self.assertEqual(self.spool_files(), [])
+        self.assertEqual(self.writer.recover(), 0)
+
+    def test_recover_replays_failed_flush_of_dead_process(self):
+        name = "{}-{}.spool.3.flushing".format(SPOOL_PREFIX, dead_pid())
+        self.write_spool(name, [self.spool_line("ws_CO_1")])
+        self.assertEqual(self.writer.recover(), 1)
+        self.assertEqual(self.spool_files(), [])
+
+    def test_recover_skips_spool_of_live_process(self):
+        name = "{}-{}.spool".format(SPOOL_PREFIX, os.getppid())
+        self.write_spool(name, [self.spool_line("ws_CO_1")])
+        self.assertEqual(self.writer.recover(), 0)
+        self.assertEqual(self.spool_files(), [name])
+
+        self.assertEqual(self.writer.recover(include_live=True), 1)
+        self.assertEqual(self.spool_files(), [])
+        self.assertEqual(TransactionLog.objects.count(), 1)
+
+
+class TransactionLogArchiveTests(TempDirMixin, TestCase):
+    def setUp(self):
+        self.archive_dir = self.make_temp_dir()
+        settings = override_settings(
+            TRANSACTION_LOG_ARCHIVE_DIR=self.archive_dir,
+            TRANSACTION_LOG_RETENTION_MONTHS=6,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        now = timezone.localtime().replace(microsecond=0)
+        self.old_month = month_start(now.year, now.month - 8)
+        self.old_log = self.create_log("ws_CO_1", self.old_month + timedelta(days=2))
+        self.recent_log = self.create_log("ws_CO_2", now)
+
+    def create_log(self, checkout_request_id, date_created):
+        log = TransactionLog.from_payload(
+            stk_callback(checkout_request_id), "T100", date_created=date_created
+        )
+        log.save()
+        return log
+
+    def assertRestored(self, log):
+        restored = TransactionLog.objects.get(id=log.id)
+        self.assertEqual(restored.date_created, log.date_created)
+        self.assertEqual(restored.json_data, log.json_data)
+        self.assertEqual(restored.account_number, log.account_number)
+        self.assertEqual(restored.checkout_request_id, log.checkout_request_id)
+
+    def test_archive_range_round_trip(self):
+        end = month_start(self.old_month.year, self.old_month.month + 1)
+        path, archived = archive_range("old", self.old_month, end)
+        self.assertEqual(archived, 1)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + ".partial"))
+        self.assertEqual(
+            list(TransactionLog.objects.values_list("id", flat=True)),
+            [self.recent_log.id],
+        )
+        self.assertEqual([log.id for log in read_archive(path)], [self.old_log.id])
+
+        self.assertEqual(restore_archive(path), 1)
+        self.assertRestored(self.old_log)
+        # restoring again skips the logs that are already there
+        restore_archive(path)
+        self.assertEqual(TransactionLog.objects.count(), 2)
+
+    def test_archive_range_without_logs(self):
+        self.assertEqual(
+            archive_range("empty", self.old_month - timedelta(days=60), self.old_month),
+            (None, 0),
+        )
+        self.assertEqual(os.listdir(self.archive_dir), [])
+
+    def test_archive_expired_keeps_recent_logs(self):
+        # on postgres both logs are in the partition holding the rows from before
+        # partitioning, which is still live
+        partitions = get_partitions() if is_partitioned() else []
+        dry_run = [
+            (name, count) for name, count in archive_expired(dry_run=True) if count
+        ]
+        self.assertEqual(
+            dry_run, [("payments_transactionlog_{:%Y%m}".format(self.old_month), 1)]
+        )
+        self.assertEqual(TransactionLog.objects.count(), 2)
+
+        [(path, archived)] = archive_expired()
+        self.assertEqual(archived, 1)
+        self.assertEqual(
+            list(TransactionLog.objects.values_list("id", flat=True)),
+            [self.recent_log.id],
+        )
+        # the partition is kept, only its expired months are deleted
+        if partitions:
+            self.assertEqual(get_partitions(), partitions)
+        restore_archive(path)
+        self.assertRestored(self.old_log)
+
+    @skipUnless(connection.vendor == "postgresql", "partitioned on postgres only")
+    def test_archive_partition_round_trip(self):
+        partition = get_partitions()[0]
+        self.assertIsNone(partition.start)
+        path, archived = archive_partition(partition)
+        self.assertEqual(archived, 2)
+        self.assertNotIn(partition.name, [p.name for p in get_partitions()])
+        self.assertFalse(TransactionLog.objects.exists())
+
+        # the restored logs land in the default partition
+        self.assertEqual(restore_archive(path), 2)
+        self.assertRestored(self.old_log)
+        self.assertRestored(self.recent_log)
+
+
+class TransactionAnalyticsViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create_superuser("admin", "", "admin")
+        )
+        self.hour = timezone.localtime().replace(
+            minute=0, second=0, microsecond=0
+        ) - timedelta(hours=3)
+        for offset in range(3):
+            HourlyTransactionRollup.objects.create(
+                bucket=self.hour + timedelta(hours=offset),
+                status="Successful",
+                count=1,
+                amount=100,
+                amount_paid=100,
+            )
+
+    def get_buckets(self, **params):
+        response = self.client.get(
+            reverse("transactions-analytics"), dict(params, period="hour")
+        )
+        self.assertEqual(response.status_code, 200)
+        return [row["bucket"] for row in response.data["results"]]
+
+    def test_hour_range_includes_the_hour_of_date_from(self):
+        buckets = self.get_buckets(
+            date_from=(self.hour + timedelta(minutes=30)).isoformat(),
+            date_to=(self.hour + timedelta(hours=2)).isoformat(),
+        )
+        self.assertEqual(buckets, [self.hour, self.hour + timedelta(hours=1)])
+
+    def test_default_hour_range_includes_its_first_hour(self):
+        HourlyTransactionRollup.objects.create(
+            bucket=self.hour - timedelta(hours=45),
+            status="Successful",
+            count=1,
+        )
+        self.assertEqual(len(self.get_buckets()), 4)
+
+
+@override_settings(ELASTICSEARCH_DSL_AUTOSYNC=False, ROLLUP_ENABLED=False)
+class RollupCatchUpTests(TestCase):
+    def test_first_catch_up_starts_the_watermark(self):
+        Transaction.objects.create(account_number="T100", amount=100, narration="n")
+        self.assertEqual(catch_up(), 0)
+        self.assertTrue(RollupCheckpoint.objects.filter(name=CHECKPOINT_NAME).exists())
+        self.assertFalse(HourlyTransactionRollup.objects.exists())
+
+    def test_catch_up_recomputes_transactions_edited_since_the_watermark(self):
+        RollupCheckpoint.objects.create(
+            name=CHECKPOINT_NAME, watermark=timezone.now() - timedelta(minutes=5)
+        )
+        # changed without the updater ever flushing them
+        for account_number in ("T100", "T200"):
+            Transaction.objects.create(
+                account_number=account_number, amount=100, narration="n"
+            )
+        self.assertEqual(catch_up(lag=0), 1)
+        rollup = HourlyTransactionRollup.objects.get()
+        self.assertEqual((rollup.count, rollup.amount), (2, 200))
+        self.assertEqual(DailyTransactionRollup.objects.get().count, 2)
+        self.assertEqual(catch_up(lag=0), 0)
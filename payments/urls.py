@@ -0,0 +1,25 @@
+from django.urls import path
+
+from payments.views import (
+    TransactionAnalyticsView,
+    TransactionExportView,
+    TransactionLogLookupView,
+)
+
+urlpatterns = [
+    path(
+        "transactions/export/",
+        TransactionExportView.as_view(),
+        name="transactions-export",
+    ),
+    path(
+        "transactions/analytics/",
+        TransactionAnalyticsView.as_view(),
+        name="transactions-analytics",
+    ),
+    path(
+        "transaction-logs/",
+        TransactionLogLookupView.as_view(),
+        name="transaction-logs",
+    ),
+]
@@ -1,3 +1,220 @@
-from django.shortcuts import render
+from datetime import timedelta
 
-# Create your views here.
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from payments.exports import (
+    CONTENT_TYPES,
+    CSV,
+    EXPORT_FORMATS,
+    get_export_queryset,
+    iter_export,
+    iter_in_thread,
+    parse_export_date,
+)
+from payments.rollups import hour_start
+from payments.serializers import TransactionLogSerializer
+from utils.core import validate_phone_number
+from utils.loading import get_model
+
+HourlyTransactionRollup = get_model("payments", "HourlyTransactionRollup")
+DailyTransactionRollup = get_model("payments", "DailyTransactionRollup")
+TransactionLog = get_model("payments", "TransactionLog")
+
+ROLLUP_PERIODS = {
+    # period: (rollup model, default range)
+    "hour": (HourlyTransactionRollup, timedelta(hours=48)),
+    "day": (DailyTransactionRollup, timedelta(days=30)),
+}
+ROLLUP_KEYS = ("provider", "method", "status", "payment_category")
+LOG_LOOKUP_FIELDS = (
+    "checkout_request_id",
+    "merchant_request_id",
+    "receipt_number",
+    "account_number",
+    "msisdn",
+)
+MAX_LOG_LOOKUP_RESULTS = 100
+
+
+def split_param(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class TransactionExportView(APIView):
+    """
+    stream transactions as csv or ndjson.
+    Query params:
+        date_from, date_to: ISO dates or datetimes, date_to is exclusive
+        status, provider: comma separated values to filter on
+        output: csv (default) or ndjson
+        gzip: 1 to gzip the download
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        params = request.query_params
+        dates = {}
+        for name in ("date_from", "date_to"):
+            if params.get(name):
+                dates[name] = parse_export_date(params[name])
+                if dates[name] is None:
+                    return Response(
+                        {"detail": f"Invalid {name}, use YYYY-MM-DD"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+        export_format = params.get("output", CSV)
+        if export_format not in EXPORT_FORMATS:
+            formats = ", ".join(EXPORT_FORMATS)
+            return Response(
+                {"detail": f"output must be one of {formats}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        compress = params.get("gzip") in ("1", "true", "True")
+
+        queryset = get_export_queryset(
+            statuses=split_param(params.get("status", "")),
+            providers=split_param(params.get("provider", "")),
+            **dates,
+        )
+        chunks = iter_in_thread(iter_export(queryset, export_format, compress))
+        filename = "transactions.{}".format(export_format)
+        if compress:
+            filename += ".gz"
+        content_type = CONTENT_TYPES[export_format]
+        if compress:
+            content_type = "application/gzip"
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class TransactionAnalyticsView(APIView):
+    """
+    transaction counts and amounts per hour or day, read from the rollups.
+    Query params:
+        period: day (default) or hour
+        date_from, date_to: ISO dates or datetimes, date_to is exclusive. The
+            buckets overlapping the range are returned, by default the last 30
+            days or 48 hours
+        provider, method, status, payment_category: comma separated filters
+        group_by: comma separated keys to split each bucket by
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        params = request.query_params
+        period = params.get("period", "day")
+        if period not in ROLLUP_PERIODS:
+            return Response(
+                {"detail": "period must be day or hour"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        model, default_range = ROLLUP_PERIODS[period]
+
+        date_to = timezone.now()
+        date_from = date_to - default_range
+        for name in ("date_from", "date_to"):
+            if params.get(name):
+                value = parse_export_date(params[name])
+                if value is None:
+                    return Response(
+                        {"detail": f"Invalid {name}, use YYYY-MM-DD"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                if name == "date_from":
+                    date_from = value
+                else:
+                    date_to = value
+        if period == "day":
+            # days that overlap [date_from, date_to), today included by default
+            date_from = timezone.localtime(date_from).date()
+            date_to = timezone.localtime(date_to - timedelta(microseconds=1)).date()
+            date_to += timedelta(days=1)
+        else:
+            # the hour date_from falls in overlaps the range too
+            date_from = hour_start(date_from)
+
+        group_by = split_param(params.get("group_by", ""))
+        if any(key not in ROLLUP_KEYS for key in group_by):
+            return Response(
+                {"detail": "group_by keys: {}".format(", ".join(ROLLUP_KEYS))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rollups = model.objects.filter(bucket__gte=date_from, bucket__lt=date_to)
+        for key in ROLLUP_KEYS:
+            values = split_param(params.get(key, ""))
+            if values:
+                rollups = rollups.filter(**{f"{key}__in": values})
+        totals = (
+            rollups.values("bucket", *group_by)
+            .annotate(
+                total_count=Sum("count"),
+                total_amount=Sum("amount"),
+                total_amount_paid=Sum("amount_paid"),
+            )
+            .order_by("bucket", *group_by)
+        )
+        results = [
+            dict(
+                {key: row[key] for key in ("bucket", *group_by)},
+                count=row["total_count"],
+                amount=row["total_amount"],
+                amount_paid=row["total_amount_paid"],
+            )
+            for row in totals
+        ]
+        return Response({"period": period, "results": results})
+
+
+class TransactionLogLookupView(APIView):
+    """
+    callback logs by the identifiers extracted from them, newest first.
+    Query params:
+        checkout_request_id, merchant_request_id, receipt_number,
+        account_number, msisdn: comma separated values, at least one is required
+        kind: stkpush or c2b
+        limit: at most MAX_LOG_LOOKUP_RESULTS logs, the default
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        params = request.query_params
+        logs = TransactionLog.objects.all()
+        filtered = False
+        for name in LOG_LOOKUP_FIELDS:
+            values = split_param(params.get(name, ""))
+            if name == "msisdn":
+                values = [validate_phone_number(value) or value for value in values]
+            if values:
+                logs = logs.filter(**{f"{name}__in": values})
+                filtered = True
+        if not filtered:
+            return Response(
+                {"detail": "filter on one of {}".format(", ".join(LOG_LOOKUP_FIELDS))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if params.get("kind"):
+            logs = logs.filter(kind=params["kind"])
+
+        limit = MAX_LOG_LOOKUP_RESULTS
+        if params.get("limit"):
+            try:
+                limit = min(max(int(params["limit"]), 1), MAX_LOG_LOOKUP_RESULTS)
+            except ValueError:
+                return Response(
+                    {"detail": "limit must be a number"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        logs = logs.order_by("-date_created", "-id")[:limit]
+        return Response({"results": TransactionLogSerializer(logs, many=True).data})
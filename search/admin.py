@@ -1,3 +1,10 @@
 from django.contrib import admin
 
+from search.models import IndexCheckpoint
+
 # Register your models here.
+
+
+@admin.register(IndexCheckpoint)
+class IndexCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("name", "watermark", "last_id", "rebuild_started", "last_run")
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from django_elasticsearch_dsl.signals import post_index
+
+
+class _Call(object):
+    # a cache miss being computed, other callers for the key wait on it
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SearchResultCache(object):
+    """
+    in process LRU cache of search responses with a TTL.
+
+    Entries are grouped by index. Anything indexed into an index, by the signal
+    processor or a reindex, bumps its generation and makes its entries stale.
+    Changes indexed by other processes are only seen once SEARCH_CACHE_TTL runs
+    out, so keep the TTL short. Concurrent misses for the same key run one
+    elasticsearch query and share its result
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._calls = {}
+
+    def get_or_compute(self, index, key, compute):
+        """
+        Args:
+            index: name of the index the result comes from
+            key: hashable normalized query
+            compute: called on a miss, returns the value to cache
+
+        Returns:
+            - cached or computed value
+        """
+        key = (index, key)
+        with self._lock:
+            generation = self._generations.get(index, 0)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, entry_generation, value = entry
+                if expires > time.monotonic() and entry_generation == generation:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                # don't keep a result that was computed across an invalidation
+                if call.error is None and generation == self._generations.get(index, 0):
+                    self._set(key, generation, call.value)
+            call.done.set()
+        return call.value
+
+    def _set(self, key, generation, value):
+        # called with the lock held
+        expires = time.monotonic() + settings.SEARCH_CACHE_TTL
+        self._entries[key] = (expires, generation, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.SEARCH_CACHE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, index):
+        with self._lock:
+            self._generations[index] = self._generations.get(index, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+search_result_cache = SearchResultCache()
+
+
+@receiver(post_index)
+def invalidate_search_results(sender, **kwargs):
+    search_result_cache.invalidate(sender._index._name)
@@ -0,0 +1,285 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from elasticsearch_dsl.connections import connections
+
+from payments.documents import TransactionDocument
+from utils.loading import get_model
+
+IndexCheckpoint = get_model("search", "IndexCheckpoint")
+
+
+def index_id_range(index_name, start, end, chunk_size):
+    """
+    index transactions with start <= id < end into index_name, run in a rebuild
+    worker process
+    Returns:
+        - number of rows indexed
+    """
+    document = TransactionDocument()
+    queryset = document.get_queryset().filter(id__gte=start, id__lt=end)
+    rows = list(queryset.iterator(chunk_size=chunk_size))
+    document.bulk(
+        (
+            {
+                "_index": index_name,
+                "_id": document.generate_id(row),
+                "_source": document.prepare(row),
+            }
+            for row in rows
+        ),
+        chunk_size=chunk_size,
+    )
+    return len(rows)
+
+
+def iter_changed_transactions(document, checkpoint, chunk_size):
+    """
+    stream transactions changed after the checkpoint in (last_edited, id) order
+    Yields:
+        - lists of at most chunk_size transactions
+    """
+    queryset = document.get_queryset().order_by("last_edited", "id")
+    if checkpoint.watermark is None:
+        queryset = queryset.filter(last_edited__isnull=False)
+    else:
+        queryset = queryset.filter(
+            Q(last_edited__gt=checkpoint.watermark)
+            | Q(last_edited=checkpoint.watermark, id__gt=checkpoint.last_id)
+        )
+    chunk = []
+    for transaction in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(transaction)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Index transactions changed since the last run into elasticsearch, or "
+        "rebuild the whole index with --full"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help=(
+                "reindex every transaction into a new index and point the alias at "
+                "it, resuming an unfinished rebuild"
+            ),
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="with --full, start over instead of resuming",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="parallel bulk requests, worker processes with --full",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="rows read from the db and sent per bulk request",
+        )
+        parser.add_argument(
+            "--lag",
+            type=int,
+            default=60,
+            help=(
+                "seconds the watermark is kept behind now, so rows of transactions "
+                "still committing are not skipped"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        document = TransactionDocument()
+        checkpoint, _ = IndexCheckpoint.objects.get_or_create(
+            name=document._index._name
+        )
+        if options["full"]:
+            indexed = self.rebuild(document, checkpoint, options)
+        else:
+            indexed = self.catch_up(document, checkpoint, options)
+        self.stdout.write(
+            "indexed {} transaction(s) in {:.1f}s".format(
+                indexed, time.monotonic() - started
+            )
+        )
+
+    def catch_up(self, document, checkpoint, options):
+        """
+        stream changed rows in order and send them with parallel bulk requests.
+        The checkpoint only moves past a chunk once it and every chunk before it
+        are indexed
+        """
+        safe_until = timezone.now() - timedelta(seconds=options["lag"])
+        max_inflight = options["workers"] * 2
+        inflight = {}
+        done = {}
+        next_sequence = 0
+        indexed = 0
+
+        def save_progress():
+            nonlocal next_sequence, indexed
+            while next_sequence in done:
+                last, count = done.pop(next_sequence)
+                next_sequence += 1
+                indexed += count
+                if last.last_edited > safe_until:
+                    checkpoint.watermark, checkpoint.last_id = safe_until, 0
+                else:
+                    checkpoint.watermark, checkpoint.last_id = last.last_edited, last.id
+            checkpoint.save()
+
+        def collect(futures):
+            for future in futures:
+                done[inflight.pop(future)] = future.result()
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            try:
+                chunks = iter_changed_transactions(
+                    document, checkpoint, options["chunk_size"]
+                )
+                for sequence, chunk in enumerate(chunks):
+                    future = executor.submit(self.send, document, chunk)
+                    inflight[future] = sequence
+                    if len(inflight) >= max_inflight:
+                        finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                        save_progress()
+                collect(wait(inflight).done)
+            finally:
+                save_progress()
+        return indexed
+
+    def send(self, document, chunk):
+        document.update(chunk, refresh=False, chunk_size=len(chunk))
+        return chunk[-1], len(chunk)
+
+    def start_rebuild(self, document, checkpoint, es):
+        """
+        create the index a rebuild writes to, with the document's settings and
+        mapping
+        """
+        if checkpoint.rebuild_index and not es.indices.exists_alias(
+            name=document._index._name, index=checkpoint.rebuild_index
+        ):
+            # left behind by an unfinished rebuild
+            es.indices.delete(index=checkpoint.rebuild_index, ignore=404)
+        checkpoint.rebuild_started = timezone.now()
+        checkpoint.rebuild_last_id = 0
+        checkpoint.rebuild_index = "{}-{:%Y%m%d%H%M%S}".format(
+            document._index._name, checkpoint.rebuild_started
+        )
+        document._index.clone(name=checkpoint.rebuild_index).create()
+        checkpoint.save()
+
+    def swap_alias(self, document, index_name, es):
+        """
+        point the document's index name at index_name and delete the indices it
+        pointed at before
+        """
+        alias = document._index._name
+        actions = [{"add": {"index": index_name, "alias": alias}}]
+        previous = []
+        if es.indices.exists_alias(name=alias):
+            previous = [
+                name for name in es.indices.get_alias(name=alias) if name != index_name
+            ]
+            actions += [
+                {"remove": {"index": name, "alias": alias}} for name in previous
+            ]
+        elif es.indices.exists(index=alias):
+            # created by search_index before the index was rebuilt behind an alias
+            actions.append({"remove_index": {"index": alias}})
+        es.indices.update_aliases(body={"actions": actions})
+        for name in previous:
+            es.indices.delete(index=name, ignore=404)
+
+    def rebuild(self, document, checkpoint, options):
+        """
+        index every row into a new index, split into id ranges handled by a pool
+        of processes, then swap the alias over so rows deleted since the last
+        rebuild are gone. An interrupted rebuild continues after the last
+        finished range
+        """
+        es = connections.get_connection()
+        if (
+            checkpoint.rebuild_started is None
+            or options["restart"]
+            or not checkpoint.rebuild_index
+            or not es.indices.exists(index=checkpoint.rebuild_index)
+        ):
+            self.start_rebuild(document, checkpoint, es)
+
+        bounds = document.get_queryset().aggregate(first=Min("id"), last=Max("id"))
+        chunk_size = options["chunk_size"]
+        start = max(bounds["first"] or 0, checkpoint.rebuild_last_id)
+        ranges = [
+            (low, low + chunk_size)
+            for low in range(start, (bounds["last"] or 0) + 1, chunk_size)
+        ]
+
+        indexed = 0
+        done = set()
+        next_range = 0
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        ) as executor:
+            futures = {
+                executor.submit(
+                    index_id_range, checkpoint.rebuild_index, low, high, chunk_size
+                ): position
+                for position, (low, high) in enumerate(ranges)
+            }
+            try:
+                for future in as_completed(futures):
+                    indexed += future.result()
+                    done.add(futures[future])
+                    if next_range in done:
+                        while next_range in done:
+                            next_range += 1
+                        checkpoint.rebuild_last_id = ranges[next_range - 1][1]
+                        checkpoint.save()
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                raise CommandError(
+                    "rebuild stopped at id {}: {}".format(checkpoint.rebuild_last_id, e)
+                )
+
+        self.swap_alias(document, checkpoint.rebuild_index, es)
+        # changes made while rebuilding are picked up by the next catch up
+        lag = timedelta(seconds=options["lag"])
+        checkpoint.watermark = checkpoint.rebuild_started - lag
+        checkpoint.last_id = 0
+        checkpoint.rebuild_started = None
+        checkpoint.rebuild_last_id = 0
+        checkpoint.rebuild_index = ""
+        checkpoint.save()
+        return indexed
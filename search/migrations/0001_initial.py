@@ -0,0 +1,26 @@
+# Generated by Django 3.2.14 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='index name', max_length=50, unique=True)),
+                ('watermark', models.DateTimeField(blank=True, help_text='last_edited of the last indexed row', null=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('rebuild_started', models.DateTimeField(blank=True, null=True)),
+                ('rebuild_last_id', models.BigIntegerField(default=0)),
+                ('last_run', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexcheckpoint',
+            name='rebuild_index',
+            field=models.CharField(blank=True, default='', help_text='index being rebuilt', max_length=100),
+        ),
+    ]
@@ -1,3 +1,25 @@
 from django.db import models
 
-# Create your models here.
+
+class IndexCheckpoint(models.Model):
+    """
+    How far reindex_transactions got for an index.
+    Rows are reindexed in (last_edited, id) order, so the watermark and last_id
+    of the last indexed row are enough to resume
+    """
+
+    name = models.CharField(max_length=50, unique=True, help_text="index name")
+    watermark = models.DateTimeField(
+        null=True, blank=True, help_text="last_edited of the last indexed row"
+    )
+    last_id = models.BigIntegerField(default=0)
+    # progress of a full rebuild, cleared once it finishes
+    rebuild_started = models.DateTimeField(null=True, blank=True)
+    rebuild_last_id = models.BigIntegerField(default=0)
+    rebuild_index = models.CharField(
+        max_length=100, blank=True, default="", help_text="index being rebuilt"
+    )
+    last_run = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} {self.watermark}"
@@ -0,0 +1,215 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+from django.db import transaction as db_transaction
+from django.db.models.signals import post_delete, post_save
+
+from django_elasticsearch_dsl.apps import DEDConfig
+from django_elasticsearch_dsl.registries import registry
+from django_elasticsearch_dsl.signals import BaseSignalProcessor
+
+from payments.signals import transactions_updated
+
+logger = logging.getLogger(__name__)
+
+INDEX = "index"
+DELETE = "delete"
+# longest pause between retries while elasticsearch is unreachable
+MAX_RETRY_DELAY = 60
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    keeps elasticsearch in sync without touching it on the request path.
+
+    Saves and deletes only record the changed primary key once the db transaction
+    commits. A background thread per process pushes them to elasticsearch with
+    bulk requests of up to ELASTICSEARCH_SYNC_BATCH_SIZE rows every
+    ELASTICSEARCH_SYNC_FLUSH_INTERVAL seconds. Repeated saves of a row in the
+    same window are indexed once.
+
+    At most ELASTICSEARCH_SYNC_MAX_PENDING rows wait in memory. When that is full
+    a writer waits up to ELASTICSEARCH_SYNC_BLOCK_TIMEOUT seconds for room and the
+    change is then dropped with a warning, reindex_transactions picks it up later
+    """
+
+    def __init__(self, connections):
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._pending = {}
+        self._failures = 0
+        self.dropped = 0
+        super(QueuedSignalProcessor, self).__init__(connections)
+
+    def setup(self):
+        post_save.connect(self.handle_save)
+        post_delete.connect(self.handle_delete)
+        transactions_updated.connect(self.handle_updated)
+
+    def teardown(self):
+        post_save.disconnect(self.handle_save)
+        post_delete.disconnect(self.handle_delete)
+        transactions_updated.disconnect(self.handle_updated)
+
+    def _is_synced(self, model):
+        if not DEDConfig.autosync_enabled():
+            return False
+        return any(
+            not doc.django.ignore_signals for doc in registry.get_documents([model])
+        )
+
+    def handle_save(self, sender, instance, **kwargs):
+        if self._is_synced(sender):
+            pk = instance.pk
+            db_transaction.on_commit(lambda: self.enqueue(sender, [pk], INDEX))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if self._is_synced(sender):
+            pk = instance.pk
+            db_transaction.on_commit(lambda: self.enqueue(sender, [pk], DELETE))
+
+    def handle_updated(self, sender, pks, **kwargs):
+        # rows changed with queryset.update(), sent after commit already
+        if self._is_synced(sender):
+            self.enqueue(sender, pks, INDEX)
+
+    def _start(self):
+        # called with the lock held, once per process
+        self._pid = os.getpid()
+        self._pending = {}
+        self._failures = 0
+        worker = threading.Thread(
+            target=self._run, name="elasticsearch-sync", daemon=True
+        )
+        worker.start()
+        atexit.register(self.flush)
+
+    def enqueue(self, model, pks, action):
+        """
+        queue rows to be indexed or deleted
+        Args:
+            model: django model the rows belong to
+            pks: primary keys of the changed rows
+            action: INDEX or DELETE
+        """
+        dropped = 0
+        with self._cond:
+            if self._pid != os.getpid():
+                self._start()
+            for pk in pks:
+                key = (model._meta.label, pk)
+                if key not in self._pending and not self._has_room():
+                    dropped += 1
+                    continue
+                self._pending[key] = action
+            if len(self._pending) >= settings.ELASTICSEARCH_SYNC_BATCH_SIZE:
+                self._wakeup.set()
+            self.dropped += dropped
+        if dropped:
+            logger.warning(
+                "elasticsearch sync queue is full, dropped %s %s change(s)",
+                dropped,
+                model._meta.label,
+            )
+
+    def _has_room(self):
+        # called with the lock held
+        if len(self._pending) < settings.ELASTICSEARCH_SYNC_MAX_PENDING:
+            return True
+        self._wakeup.set()
+        return self._cond.wait_for(
+            lambda: len(self._pending) < settings.ELASTICSEARCH_SYNC_MAX_PENDING,
+            timeout=settings.ELASTICSEARCH_SYNC_BLOCK_TIMEOUT,
+        )
+
+    def _take_batch(self):
+        with self._cond:
+            batch = []
+            for key in self._pending:
+                batch.append((key, self._pending[key]))
+                if len(batch) >= settings.ELASTICSEARCH_SYNC_BATCH_SIZE:
+                    break
+            for key, _ in batch:
+                del self._pending[key]
+            self._cond.notify_all()
+        return batch
+
+    def flush(self):
+        """
+        push everything queued so far to elasticsearch
+        Returns:
+            - number of rows sent
+        """
+        if self._pid != os.getpid():
+            return 0
+        sent = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return sent
+            try:
+                self.send(batch)
+            except Exception as e:
+                logger.error(e)
+                self._requeue(batch)
+                return sent
+            self._failures = 0
+            sent += len(batch)
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._failures += 1
+            for key, action in batch:
+                # a change queued while we were sending is newer, keep it
+                self._pending.setdefault(key, action)
+
+    def send(self, batch):
+        """
+        index and delete a batch of queued rows with one bulk request per document
+        """
+        grouped = defaultdict(lambda: defaultdict(list))
+        for (label, pk), action in batch:
+            grouped[apps.get_model(label)][action].append(pk)
+
+        for model, actions in grouped.items():
+            for doc in registry.get_documents([model]):
+                if doc.django.ignore_signals:
+                    continue
+                document = doc()
+                if actions[INDEX]:
+                    queryset = document.get_queryset().filter(pk__in=actions[INDEX])
+                    document.update(queryset, refresh=False)
+                if actions[DELETE]:
+                    document.bulk(
+                        (
+                            {
+                                "_op_type": DELETE,
+                                "_index": document._index._name,
+                                "_id": pk,
+                            }
+                            for pk in actions[DELETE]
+                        ),
+                        # rows deleted before they were ever indexed
+                        raise_on_error=False,
+                    )
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wakeup.wait(settings.ELASTICSEARCH_SYNC_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            if self._failures:
+                time.sleep(min(2**self._failures, MAX_RETRY_DELAY))
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(e)
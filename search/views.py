@@ -1,27 +1,82 @@
 import abc
+import base64
+import json
 import logging
+import re
 
+from django.conf import settings
+from django.db.models import Q as DBQ
+
+from elasticsearch.exceptions import ElasticsearchException
 from elasticsearch_dsl import Q
 from rest_framework import status
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
 from payments.documents import PaymentMethodDocument, TransactionDocument
 from payments.serializers import PaymentMethodSerializer, TransactionSerializer
+from search.cache import search_result_cache
+from utils.metrics import SEARCH_QUERY_SECONDS, observe
 
 logger = logging.getLogger(__name__)
 
+# elasticsearch index.max_result_window, from + size can not go past it
+MAX_RESULT_WINDOW = 10000
+CURSOR_QUERY_PARAM = "cursor"
+# detail queries that look like ids or account numbers are looked up directly,
+# several can be asked for at once separated by commas
+LOOKUP_KEY_RE = re.compile(r"^[\w-]{1,40}$")
+MAX_LOOKUP_KEYS = 100
+
+
+def encode_cursor(sort_values):
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        - search_after values or None if the cursor is not one of ours
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list):
+        return None
+    return values
+
 
 class ElasticSearchAPIView(APIView):
     serializer_class = None
     document_class = PaymentMethodDocument.search().query()
+    # keep paginated results in search_result_cache
+    cache_results = False
+    # unique fields a detail lookup matches exactly after the document id, each
+    # indexed with a raw keyword subfield
+    lookup_fields = ()
 
     @abc.abstractmethod
     def generate_q_expression(self, query):
         """This method should be overridden
         and return a Q() expression."""
 
+    def execute(self, search, query):
+        """
+        run an elasticsearch query, timed under its kind of query
+        """
+        with observe(SEARCH_QUERY_SECONDS, view=type(self).__name__, query=query):
+            return search.execute()
+
+    def get_source_fields(self):
+        """
+        fields the serializer reads that are stored in the index
+        """
+        mapping = self.document_class._doc_type.mapping
+        return [name for name in self.serializer_class().fields if name in mapping]
+
     def get_search_queryset(self, request, query, paginate=True):
         try:
             if bool(query):
@@ -29,18 +84,18 @@ class ElasticSearchAPIView(APIView):
                 search = self.document_class.search().query(q)
             else:
                 search = self.document_class.search()
-            response = search.execute()
+            search = search.source(self.get_source_fields())
 
-            print(f'Found {response.hits.total.value} hit(s) for query: "{query}"')
             if paginate:
-                results = self.paginate_queryset(response, request, view=self)
-                serializer = self.serializer_class(results, many=True)
-                return self.get_paginated_response(serializer.data)
-            else:
-                if bool(response):
-                    serializer = self.serializer_class(response, many=True)
-                    return Response(serializer.data[0])
-                return Response({})
+                if self.cache_results and settings.SEARCH_CACHE_ENABLED:
+                    return self.get_cached_page(request, search)
+                return self.get_page(request, search)
+
+            response = self.execute(search, "search")
+            if bool(response):
+                serializer = self.serializer_class(response, many=True)
+                return Response(serializer.data[0])
+            return Response({})
         except Exception as e:
             logger.error(e)
             return Response(
@@ -48,10 +103,184 @@ class ElasticSearchAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+    def get_lookup_keys(self, query):
+        """
+        Returns:
+            - list of keys if the query is key shaped, otherwise None
+        """
+        keys = [key.strip() for key in query.split(",")]
+        if len(keys) > MAX_LOOKUP_KEYS:
+            return None
+        if all(LOOKUP_KEY_RE.match(key) for key in keys):
+            return keys
+        return None
+
+    def get_detail(self, request, query):
+        """
+        resolve key shaped queries with a multi get and exact term lookups,
+        anything else falls back to a full text search
+        """
+        keys = self.get_lookup_keys(query)
+        if keys is None:
+            return self.get_search_queryset(request, query, paginate=False)
+
+        try:
+            found = self.lookup_documents(keys)
+            missing = [key for key in keys if key not in found]
+        except ElasticsearchException as e:
+            logger.error(e)
+            missing = keys
+            found = {}
+        try:
+            if missing:
+                found.update(self.lookup_rows(missing))
+        except Exception as e:
+            logger.error(e)
+            return Response(
+                {"detail": "Failed to query Transaction. Contact Support!"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(keys) == 1:
+            return Response(found.get(keys[0], {}))
+        return Response([found[key] for key in keys if key in found])
+
+    def lookup_documents(self, keys):
+        """
+        Returns:
+            - {key: serialized document} for the keys found in elasticsearch
+        """
+        source = self.get_source_fields()
+        found = {}
+        ids = [key for key in keys if key.isdigit()]
+        if ids:
+            with observe(SEARCH_QUERY_SECONDS, view=type(self).__name__, query="mget"):
+                documents = self.document_class.mget(
+                    ids, missing="skip", _source=source
+                )
+            for document in documents:
+                found[str(document.meta.id)] = self.serializer_class(document).data
+
+        for field in self.lookup_fields:
+            remaining = [key for key in keys if key not in found]
+            if not remaining:
+                break
+            search = (
+                self.document_class.search()
+                .filter("terms", **{"{}.raw".format(field): remaining})
+                .source(source)
+                .extra(size=len(remaining))
+            )
+            for hit in self.execute(search, "lookup"):
+                found[str(getattr(hit, field))] = self.serializer_class(hit).data
+        return found
+
+    def lookup_rows(self, keys):
+        """
+        db fallback for keys elasticsearch did not have
+        Returns:
+            - {key: serialized row}
+        """
+        condition = DBQ(pk__in=[key for key in keys if key.isdigit()])
+        for field in self.lookup_fields:
+            condition |= DBQ(**{"{}__in".format(field): keys})
+        rows = list(self.document_class().get_queryset().filter(condition))
+        found = {}
+        # same precedence as lookup_documents, the primary key first
+        for field in ("pk",) + tuple(self.lookup_fields):
+            for row in rows:
+                key = str(getattr(row, field))
+                if key in keys and key not in found:
+                    found[key] = self.serializer_class(row).data
+        return found
+
+    def get_cache_key(self, request):
+        """
+        the request's query params with the search text normalized, so
+        equivalent searches share an entry
+        """
+        params = []
+        for name, values in request.query_params.lists():
+            if name == "filter":
+                values = [" ".join(value.lower().split()) for value in values]
+            params.append((name, tuple(values)))
+        return (type(self).__name__, request.get_host(), tuple(sorted(params)))
+
+    def get_cached_page(self, request, search):
+        def compute():
+            response = self.get_page(request, search)
+            return response.data, response.status_code
+
+        data, status_code = search_result_cache.get_or_compute(
+            self.document_class._index._name, self.get_cache_key(request), compute
+        )
+        return Response(data, status=status_code)
+
+    def get_page(self, request, search):
+        if CURSOR_QUERY_PARAM in request.query_params:
+            return self.get_cursor_page(request, search)
+        return self.get_offset_page(request, search)
+
+    def get_offset_page(self, request, search):
+        """
+        limit/offset pagination done by elasticsearch with from/size
+        """
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        self.request = request
+        if self.offset + self.limit > MAX_RESULT_WINDOW:
+            return Response(
+                {
+                    "detail": "Offset too deep, page with ?{}= instead".format(
+                        CURSOR_QUERY_PARAM
+                    )
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        search = search.extra(track_total_hits=True)
+        response = self.execute(search[self.offset : self.offset + self.limit], "page")
+        self.count = response.hits.total.value
+        logger.debug("Found %s hit(s) for page %s", self.count, request.query_params)
+        serializer = self.serializer_class(response, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_cursor_page(self, request, search):
+        """
+        deep paging with search_after, newest first.
+        Every page costs the same however far in it is.
+        Start with ?cursor= and follow the next links
+        """
+        limit = self.get_limit(request)
+        cursor = request.query_params[CURSOR_QUERY_PARAM]
+        search = search.sort("-date_created", "-id").extra(
+            size=limit, track_total_hits=False
+        )
+        if cursor:
+            search_after = decode_cursor(cursor)
+            if search_after is None:
+                return Response(
+                    {"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST
+                )
+            search = search.extra(search_after=search_after)
+
+        response = self.execute(search, "cursor")
+        hits = list(response)
+        next_link = None
+        if len(hits) == limit:
+            next_link = replace_query_param(
+                request.build_absolute_uri(),
+                CURSOR_QUERY_PARAM,
+                encode_cursor(list(hits[-1].meta.sort)),
+            )
+        serializer = self.serializer_class(hits, many=True)
+        return Response({"next": next_link, "results": serializer.data})
+
 
 class SearchPaymentMethodView(ElasticSearchAPIView, LimitOffsetPagination):
     serializer_class = PaymentMethodSerializer
     document_class = PaymentMethodDocument
+    cache_results = True
 
     def generate_q_expression(self, query):
         return Q("multi_match", query=query, fields=["name", "code"], fuzziness="auto")
@@ -64,6 +293,7 @@ class SearchPaymentMethodView(ElasticSearchAPIView, LimitOffsetPagination):
 class SearchTransactionView(ElasticSearchAPIView, LimitOffsetPagination):
     serializer_class = TransactionSerializer
     document_class = TransactionDocument
+    cache_results = True
 
     def generate_q_expression(self, query):
         return Q(
@@ -99,12 +329,13 @@ class PaymentMethodDetailView(ElasticSearchAPIView):
         )
 
     def get(self, request, query):
-        return self.get_search_queryset(request, query, paginate=False)
+        return self.get_detail(request, query)
 
 
 class TransactionDetailView(ElasticSearchAPIView):
     serializer_class = TransactionSerializer
     document_class = TransactionDocument
+    lookup_fields = ("account_number",)
 
     def generate_q_expression(self, query):
         return Q(
@@ -117,4 +348,4 @@ class TransactionDetailView(ElasticSearchAPIView):
         )
 
     def get(self, request, query):
-        return self.get_search_queryset(request, query, paginate=False)
+        return self.get_detail(request, query)
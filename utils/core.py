@@ -1,15 +1,15 @@
-import phonenumbers
+import re
+from functools import lru_cache
 
+# kenyan mobile numbers as 07xx/01xx, 2547xx/2541xx or +2547xx/+2541xx. The
+# national part is the KE mobile pattern from the phonenumbers metadata
+KE_MOBILE_RE = re.compile(r"(?:\+?254|0)((?:1(?:0[0-6]|1[0-5]|2[014]|30)|7\d\d)\d{6})")
 
-def validate_phone_number(phonenumber):
-    """
-    validating phone number with international formats
-    Args:
-        phonenumber:
 
-    Returns:
-    - a formatted kenyan phone number with +254
-    """
+def _validate_with_phonenumbers(phonenumber):
+    # phonenumbers loads a lot of metadata, only import it for unusual input
+    import phonenumbers
+
     try:
         _number = phonenumbers.parse(phonenumber, region="KE")
         e164_format = phonenumbers.format_number(
@@ -22,3 +22,23 @@ def validate_phone_number(phonenumber):
         return False
 
     return e164_format
+
+
+@lru_cache(maxsize=4096)
+def validate_phone_number(phonenumber):
+    """
+    validating phone number with international formats.
+    Common kenyan mobile formats are handled with a regex, anything else goes
+    through phonenumbers
+    Args:
+        phonenumber:
+
+    Returns:
+    - a formatted kenyan phone number with +254
+    """
+    match = None
+    if isinstance(phonenumber, str):
+        match = KE_MOBILE_RE.fullmatch(phonenumber)
+    if match is not None:
+        return "+254" + match.group(1)
+    return _validate_with_phonenumbers(phonenumber)
@@ -0,0 +1,250 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from logging.config import ConvertingList
+from logging.handlers import QueueListener
+
+# seconds between reports of records SamplingFilter left out at call sites that
+# have not logged since
+SUPPRESSED_REPORT_INTERVAL = 60
+
+# attributes every LogRecord has, anything else was passed with extra=
+RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "suppressed", "dropped"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    one json object per line. A dict or list logged as the message, like the
+    mpesa payloads, is written as json under `payload` instead of its repr
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created)
+            .astimezone()
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+            "process": record.process,
+        }
+        if isinstance(record.msg, (dict, list)) and not record.args:
+            entry["payload"] = record.msg
+        else:
+            entry["message"] = record.getMessage()
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        # records left out by SamplingFilter or a full queue before this one
+        for name in ("suppressed", "dropped"):
+            if getattr(record, name, 0):
+                entry[name] = getattr(record, name)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        try:
+            return json.dumps(entry, default=str)
+        except ValueError:
+            # e.g. a payload that refers to itself
+            entry["payload"] = repr(entry.get("payload"))
+            return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    thins out records below `level`, warnings and errors always pass.
+
+    A dict or list payload record is kept with probability `sample_rate`, and
+    each logging call is let through at most `rate_limit` times a second
+    (0 for no limit). The next record from a call that passes carries how many
+    were suppressed before it, counts still pending are taken with
+    pop_suppressed
+    """
+
+    def __init__(self, rate_limit=0, sample_rate=1.0, level="WARNING"):
+        super(SamplingFilter, self).__init__()
+        self.rate_limit = float(rate_limit)
+        self.sample_rate = float(sample_rate)
+        if not isinstance(level, int):
+            level = logging.getLevelName(level)
+        self.level = level
+        self._lock = threading.Lock()
+        # (pathname, lineno): [tokens, last refill, suppressed]
+        self._buckets = {}
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        if (
+            self.sample_rate < 1
+            and isinstance(record.msg, (dict, list))
+            and random.random() >= self.sample_rate
+        ):
+            self._suppress(key)
+            return False
+        if self.rate_limit <= 0:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.rate_limit, now, 0]
+            else:
+                bucket[0] = min(
+                    bucket[0] + (now - bucket[1]) * self.rate_limit, self.rate_limit
+                )
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+    def pop_suppressed(self):
+        """
+        Returns:
+            - list of (pathname, lineno, count) of the records suppressed since
+              the last record let through at each call site
+        """
+        suppressed = []
+        with self._lock:
+            for (pathname, lineno), bucket in self._buckets.items():
+                if bucket[2]:
+                    suppressed.append((pathname, lineno, bucket[2]))
+                    bucket[2] = 0
+        return suppressed
+
+    def _suppress(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.rate_limit, time.monotonic(), 0]
+            bucket[2] += 1
+
+
+def _resolve_handlers(handlers):
+    # dictConfig only turns cfg://handlers.<name> into the handler when the
+    # list is indexed
+    if isinstance(handlers, ConvertingList):
+        return [handlers[i] for i in range(len(handlers))]
+    return list(handlers)
+
+
+class QueuedLogHandler(logging.Handler):
+    """
+    hands records to a background thread that formats and writes them with
+    `handlers`, so logging never makes a request wait on the disk or console.
+
+    Records are queued as they are, a payload changed after it was logged may be
+    written with the change. When `maxsize` records are waiting new ones are
+    dropped, the next record written carries how many. Each process starts its
+    own thread on its first record, gunicorn workers forked after logging was
+    configured included.
+
+    Records a SamplingFilter suppressed at call sites that went quiet are
+    reported every SUPPRESSED_REPORT_INTERVAL seconds and on stop
+    """
+
+    def __init__(self, handlers, maxsize=10000):
+        super(QueuedLogHandler, self).__init__()
+        self.handlers = _resolve_handlers(handlers)
+        self.maxsize = int(maxsize)
+        self.queue = None
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._dropped = 0
+        self._next_report = time.monotonic() + SUPPRESSED_REPORT_INTERVAL
+        atexit.register(self.stop)
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            # a listener inherited through fork has no thread in this process
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = pid
+
+    def handle(self, record):
+        # the queue does its own locking, skip the handler lock
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def emit(self, record):
+        try:
+            self._start()
+            if time.monotonic() >= self._next_report:
+                self._next_report = time.monotonic() + SUPPRESSED_REPORT_INTERVAL
+                self.report_suppressed()
+            if self._dropped:
+                record.dropped, self._dropped = self._dropped, 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1 + getattr(record, "dropped", 0)
+        except Exception:
+            self.handleError(record)
+
+    def report_suppressed(self):
+        """
+        queue a record for every call site with suppressed records pending
+        """
+        for log_filter in self.filters:
+            if not isinstance(log_filter, SamplingFilter):
+                continue
+            for pathname, lineno, count in log_filter.pop_suppressed():
+                record = logging.LogRecord(
+                    __name__,
+                    logging.INFO,
+                    pathname,
+                    lineno,
+                    "%s record(s) suppressed from %s:%s",
+                    (count, pathname, lineno),
+                    None,
+                )
+                record.suppressed = count
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    self._dropped += 1
+
+    def stop(self):
+        """
+        write out the records still queued, called at exit
+        """
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self.report_suppressed()
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        self.stop()
+        super(QueuedLogHandler, self).close()
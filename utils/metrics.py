@@ -0,0 +1,184 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, Min
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from utils.loading import get_model
+
+logger = logging.getLogger(__name__)
+
+# safaricom answers in tens of milliseconds to tens of seconds
+DARAJA_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+DARAJA_REQUEST_SECONDS = Histogram(
+    "daraja_request_duration_seconds",
+    "Time taken by safaricom daraja calls",
+    ["endpoint", "status"],
+    buckets=DARAJA_BUCKETS,
+)
+DARAJA_REQUEST_ERRORS = Counter(
+    "daraja_request_errors_total",
+    "Daraja calls that failed or were answered with an error status",
+    ["endpoint", "status"],
+)
+DARAJA_HTTP_REQUESTS = Counter(
+    "daraja_http_requests_total",
+    "Requests sent to daraja by connection, new or reused from the keep-alive pool",
+    ["transport", "connection"],
+)
+CALLBACK_SECONDS = Histogram(
+    "daraja_callback_duration_seconds",
+    "Time taken to process mpesa callbacks",
+    ["callback", "outcome"],
+)
+DUPLICATE_CALLBACKS = Counter(
+    "daraja_duplicate_callbacks_total",
+    "Mpesa callbacks that had already been applied",
+    ["source"],
+)
+SEARCH_QUERY_SECONDS = Histogram(
+    "search_query_duration_seconds",
+    "Time taken by elasticsearch queries",
+    ["view", "query", "outcome"],
+)
+
+
+def is_multiprocess():
+    """
+    True when the metrics of all workers are kept in PROMETHEUS_MULTIPROC_DIR,
+    see gunicorn.conf.py
+    """
+    return bool(
+        os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        or os.environ.get("prometheus_multiproc_dir")
+    )
+
+
+@contextmanager
+def observe(histogram, **labels):
+    """
+    time the block into histogram. The block can set the outcome label through
+    the yielded dict, it is `ok` by default and `error` if the block raises
+    """
+    started = time.perf_counter()
+    outcome = {"outcome": "ok"}
+    try:
+        yield outcome
+    except BaseException:
+        outcome["outcome"] = "error"
+        raise
+    finally:
+        histogram.labels(outcome=outcome["outcome"], **labels).observe(
+            time.perf_counter() - started
+        )
+
+
+def observed(histogram, **labels):
+    """
+    decorator timing every call of a function into histogram, see observe
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe(histogram, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def observe_daraja_request(endpoint):
+    """
+    time a daraja call. The block sets the yielded dict's status to the http
+    status code of the response, it stays `error` if no response came back
+    """
+    started = time.perf_counter()
+    request = {"status": "error"}
+    try:
+        yield request
+    finally:
+        status_code = str(request["status"])
+        DARAJA_REQUEST_SECONDS.labels(endpoint=endpoint, status=status_code).observe(
+            time.perf_counter() - started
+        )
+        if not status_code.startswith("2"):
+            DARAJA_REQUEST_ERRORS.labels(endpoint=endpoint, status=status_code).inc()
+
+
+class InitiatedBacklogCollector(object):
+    """
+    stk pushes still waiting for their callback, read from the db on every
+    scrape so all workers report the same value
+    """
+
+    def collect(self):
+        Transaction = get_model("payments", "Transaction")
+        try:
+            backlog = Transaction.objects.filter(
+                status=Transaction.INITIATED
+            ).aggregate(count=Count("id"), oldest=Min("date_created"))
+        except DatabaseError as e:
+            logger.error(e)
+            return
+        yield GaugeMetricFamily(
+            "payments_initiated_transactions",
+            "Transactions waiting for their stk push callback",
+            value=backlog["count"],
+        )
+        oldest = backlog["oldest"]
+        age = (timezone.now() - oldest).total_seconds() if oldest else 0
+        yield GaugeMetricFamily(
+            "payments_initiated_oldest_age_seconds",
+            "Age of the oldest transaction waiting for its stk push callback",
+            value=age,
+        )
+
+
+backlog_registry = CollectorRegistry(auto_describe=False)
+backlog_registry.register(InitiatedBacklogCollector())
+
+
+def get_registry():
+    """
+    Returns:
+        - registry with the metrics of every worker when running multiprocess,
+          otherwise the ones of this process
+    """
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """
+    prometheus text exposition of all metrics. Requires
+    `Authorization: Bearer <METRICS_TOKEN>` when METRICS_TOKEN is set
+    """
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != "Bearer {}".format(token):
+        return HttpResponseForbidden()
+    output = generate_latest(get_registry()) + generate_latest(backlog_registry)
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,33 @@
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently as PostgresAddIndexConcurrently,
+)
+from django.db.migrations import AddIndex
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """
+    AddIndex that builds the index with CREATE INDEX CONCURRENTLY on postgres so
+    writes to a busy table are not blocked while it builds. Other databases, like
+    the sqlite used in development, get a plain AddIndex.
+
+    The migration needs `atomic = False`. A build that fails on postgres leaves
+    an invalid index behind, drop it before migrating again
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            return super(AddIndexConcurrently, self).database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        return AddIndex.database_forwards(
+            self, app_label, schema_editor, from_state, to_state
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            return super(AddIndexConcurrently, self).database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        return AddIndex.database_backwards(
+            self, app_label, schema_editor, from_state, to_state
+        )
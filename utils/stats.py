@@ -0,0 +1,36 @@
+import math
+
+
+def percentile(values, pct):
+    """
+    nearest-rank percentile
+    Args:
+        values: sorted list of numbers
+        pct: 0 - 100
+
+    Returns:
+        - the value below which pct percent of values fall, None if values is empty
+    """
+    if not values:
+        return None
+    rank = max(int(math.ceil(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def summarize(durations):
+    """
+    Args:
+        durations: timings in seconds
+
+    Returns:
+        - dict of count, p50, p99 and max in milliseconds
+    """
+    values = sorted(durations)
+    if not values:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50) * 1000,
+        "p99": percentile(values, 99) * 1000,
+        "max": values[-1] * 1000,
+    }